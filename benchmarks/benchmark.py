@@ -0,0 +1,216 @@
+import argparse
+import json
+import logging
+import os
+import resource
+import sys
+import threading
+import time
+import urllib.request
+from http.server import ThreadingHTTPServer
+from typing import List
+from prometheus_client import CollectorRegistry, MetricsHandler
+from prometheus_aws_guardduty_exporter.exposition import CachedExposition, startCachedMetricsServer
+from .standin import StandInProcess
+
+
+def parseArguments(argv: List[str]):
+    parser = argparse.ArgumentParser(description="Benchmark the exporter against a local GuardDuty and STS stand-in")
+    parser.add_argument("--accounts", default=25, type=int, help="The number of accounts (each one with an assumed role)")
+    parser.add_argument("--regions", default=20, type=int, help="The number of regions of each account")
+    parser.add_argument("--scrapes", default=20, type=int, help="The number of scrapes to run")
+    parser.add_argument("--warmup-scrapes", default=1, type=int, help="The number of scrapes to run before measuring (ie. to create clients)")
+    parser.add_argument("--scrapers", default=1, type=int, help="The number of concurrent scrapers (only in http mode)")
+    parser.add_argument("--mode", default="collect", choices=["collect", "http"], help="Whether to directly call collect() or scrape the /metrics endpoint")
+    parser.add_argument("--latency", default=0.05, type=float, help="The latency (in seconds) of each stand-in API call")
+    parser.add_argument("--error-rate", default=0, type=float, help="The ratio of stand-in API calls failing with an internal error")
+    parser.add_argument("--throttle-rate", default=0, type=float, help="The ratio of stand-in API calls failing with throttling")
+    parser.add_argument("--detectors", default=1, type=int, help="The number of detectors of each region")
+    parser.add_argument("--backend", default="threads", choices=["threads", "asyncio"], help="The collector backend")
+    parser.add_argument("--max-concurrency", default=None, type=int, help="The collector max concurrency")
+    parser.add_argument("--refresh-interval", default=None, type=float, help="The collector background refresh interval")
+    parser.add_argument("--cache-ttl", default=0, type=float, help="The collector cache TTL")
+    parser.add_argument("--detector-cache-ttl", default=0, type=float, help="The collector detector cache TTL")
+    parser.add_argument("--cached-exposition", default=False, action="store_true", help="Serve the /metrics endpoint from the cached exposition (only in http mode)")
+    parser.add_argument("--json", default=False, action="store_true", help="Print the report as JSON")
+
+    return parser.parse_args(argv)
+
+
+def percentile(values: List[float], ratio: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(ratio * (len(values) - 1))))] if values else 0
+
+
+class ThreadsSampler():
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.peak = threading.active_count()
+        self.shutdown = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="threads-sampler", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.shutdown.set()
+        self.thread.join()
+
+    def _run(self):
+        while not self.shutdown.wait(self.interval):
+            self.peak = max(self.peak, threading.active_count())
+
+
+def createCollector(args, regions: List[str], roleArns: List[str]):
+    # Imported here, so that the stand-in endpoint is configured before botocore is loaded
+    from prometheus_aws_guardduty_exporter.collector import GuardDutyMetricsCollector
+    from prometheus_aws_guardduty_exporter.async_collector import AsyncGuardDutyMetricsCollector
+
+    collectorClass = AsyncGuardDutyMetricsCollector if args.backend == "asyncio" else GuardDutyMetricsCollector
+    return collectorClass(
+        regions,
+        roleArns,
+        refreshInterval=args.refresh_interval,
+        maxConcurrency=args.max_concurrency,
+        cacheTtl=args.cache_ttl,
+        detectorCacheTtl=args.detector_cache_ttl)
+
+
+def runScrapes(args, scrape) -> List[float]:
+    latencies = []
+    latenciesLock = threading.Lock()
+
+    def _worker(count: int):
+        for _ in range(count):
+            startTime = time.monotonic()
+            scrape()
+
+            with latenciesLock:
+                latencies.append(time.monotonic() - startTime)
+
+    scrapers = args.scrapers if args.mode == "http" else 1
+    workers = [threading.Thread(target=_worker, args=[args.scrapes // scrapers + (1 if index < args.scrapes % scrapers else 0)]) for index in range(scrapers)]
+
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    return latencies
+
+
+def run(args) -> dict:
+    standIn = StandInProcess(latency=args.latency, errorRate=args.error_rate, throttleRate=args.throttle_rate, detectorsPerRegion=args.detectors)
+    standIn.start()
+
+    # Route all AWS API calls to the stand-in
+    os.environ.update({
+        "AWS_ENDPOINT_URL": standIn.endpointUrl,
+        "AWS_ACCESS_KEY_ID": "AKIABENCHMARK0000000",
+        "AWS_SECRET_ACCESS_KEY": "secret",
+        "AWS_DEFAULT_REGION": "us-east-1",
+    })
+
+    regions = [f"bench-region-{index}" for index in range(args.regions)]
+    roleArns = [f"arn:aws:iam::{100000000000 + index}:role/guardduty-exporter" for index in range(args.accounts)]
+
+    sampler = ThreadsSampler()
+    sampler.start()
+
+    collector = createCollector(args, regions, roleArns)
+    collector.start()
+
+    # Wait for the first background refresh to complete
+    if args.refresh_interval is not None:
+        while not collector.collect():
+            time.sleep(0.01)
+
+    if args.mode == "http":
+        registry = CollectorRegistry(auto_describe=True)
+        registry.register(collector)
+        if args.cached_exposition:
+            server = startCachedMetricsServer(CachedExposition(registry, collector), 0, "127.0.0.1")
+        else:
+            # The server is created explicitly (rather than with start_http_server()) to keep its handle
+            server = ThreadingHTTPServer(("127.0.0.1", 0), MetricsHandler.factory(registry))
+            server.daemon_threads = True
+            threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+
+        url = f"http://127.0.0.1:{server.server_address[1]}/metrics"
+
+        def scrape():
+            with urllib.request.urlopen(url) as response:
+                response.read()
+    else:
+        scrape = collector.collect
+
+    # Warm up (not measured)
+    warmupStartTime = time.monotonic()
+    for _ in range(args.warmup_scrapes):
+        scrape()
+    warmupDuration = time.monotonic() - warmupStartTime
+
+    requestsBefore = standIn.getRequestsCount()
+    startTime = time.monotonic()
+    latencies = runScrapes(args, scrape)
+    duration = time.monotonic() - startTime
+    requestsAfter = standIn.getRequestsCount()
+
+    if args.mode == "http":
+        server.shutdown()
+        server.server_close()
+
+        # The handler class references the registry: release the collector before the interpreter exits
+        registry.unregister(collector)
+
+    collector.stop()
+    sampler.stop()
+    standIn.stop()
+
+    apiCalls = {operation: count - requestsBefore.get(operation, 0) for operation, count in requestsAfter.items()}
+
+    return {
+        "targets": len(regions) * len(roleArns),
+        "warmup_seconds": round(warmupDuration, 3),
+        "scrapes": len(latencies),
+        "duration_seconds": round(duration, 3),
+        "scrape_errors": sum(state.scrapeErrors for state in collector.states.values()),
+        "latency_seconds": {
+            "p50": round(percentile(latencies, 0.5), 4),
+            "p90": round(percentile(latencies, 0.9), 4),
+            "p99": round(percentile(latencies, 0.99), 4),
+            "max": round(max(latencies, default=0), 4),
+        },
+        "api_calls_per_scrape": {operation: round(count / max(1, len(latencies)), 2) for operation, count in sorted(apiCalls.items())},
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "peak_threads": sampler.peak,
+    }
+
+
+def printReport(report: dict):
+    print(f"Targets (account x region): {report['targets']}")
+    print(f"Warmup:                     {report['warmup_seconds']}s")
+    print(f"Scrapes:                    {report['scrapes']} in {report['duration_seconds']}s")
+    print(f"Scrape errors (total):      {report['scrape_errors']}")
+    print("Scrape latency:             " + ", ".join(f"{name}={value * 1000:.1f}ms" for name, value in report["latency_seconds"].items()))
+    print("API calls per scrape:       " + (", ".join(f"{operation}={count}" for operation, count in report["api_calls_per_scrape"].items()) or "none"))
+    print(f"Peak RSS:                   {report['peak_rss_mb']} MB")
+    print(f"Peak threads:               {report['peak_threads']}")
+
+
+def main(argv: List[str]):
+    args = parseArguments(argv)
+
+    # Errors are reported in the summary
+    logging.disable(logging.ERROR)
+
+    report = run(args)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        printReport(report)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,181 @@
+import json
+import multiprocessing
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+# The region is extracted from the credential scope of the request signature
+CREDENTIAL_SCOPE_REGEX = re.compile(r"Credential=[^/]+/\d+/([^/]+)/")
+
+STATISTICS_PATH_REGEX = re.compile(r"^/detector/([^/]+)/findings/statistics$")
+
+ASSUME_ROLE_RESPONSE = """<AssumeRoleResponse xmlns="https://sts.amazonaws.com/doc/2011-06-15/">
+  <AssumeRoleResult>
+    <Credentials>
+      <AccessKeyId>AKIABENCHMARK0000000</AccessKeyId>
+      <SecretAccessKey>secret</SecretAccessKey>
+      <SessionToken>token</SessionToken>
+      <Expiration>{expiration}</Expiration>
+    </Credentials>
+    <AssumedRoleUser>
+      <Arn>{roleArn}/GuardDutyExporter</Arn>
+      <AssumedRoleId>AROABENCHMARK:GuardDutyExporter</AssumedRoleId>
+    </AssumedRoleUser>
+  </AssumeRoleResult>
+  <ResponseMetadata>
+    <RequestId>benchmark</RequestId>
+  </ResponseMetadata>
+</AssumeRoleResponse>"""
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    # Keep connections alive, like AWS endpoints do
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        if not self._beforeRequest("ListDetectors"):
+            return
+
+        if self.path.startswith("/detector"):
+            region = self._getRegion()
+            self._respondJson(200, {"detectorIds": [f"detector-{region}-{index}" for index in range(self.server.detectorsPerRegion)]})
+        else:
+            self._respondJson(404, {"__type": "NotFoundException", "message": "Not found"})
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+        # STS uses the query protocol
+        if self.path == "/" and b"Action=AssumeRole" in body:
+            if not self._beforeRequest("AssumeRole"):
+                return
+
+            params = parse_qs(body.decode("utf-8"))
+            expiration = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(time.time() + 3600))
+            self._respond(200, "text/xml", ASSUME_ROLE_RESPONSE.format(expiration=expiration, roleArn=params["RoleArn"][0]).encode("utf-8"))
+            return
+
+        if not self._beforeRequest("GetFindingsStatistics"):
+            return
+
+        match = STATISTICS_PATH_REGEX.match(self.path)
+        if not match:
+            self._respondJson(404, {"__type": "NotFoundException", "message": "Not found"})
+            return
+
+        # Findings are deterministic for each detector
+        generator = random.Random(match.group(1))
+        countBySeverity = {f"{generator.choice([2.0, 5.0, 8.0]) + generator.randint(0, 9) / 10:.1f}": generator.randint(0, 100) for _ in range(5)}
+        self._respondJson(200, {"findingStatistics": {"countBySeverity": countBySeverity}})
+
+    def log_message(self, format, *args):
+        pass
+
+    def _beforeRequest(self, operation: str) -> bool:
+        self.server.countRequest(operation)
+
+        if self.server.latency > 0:
+            time.sleep(self.server.latency)
+
+        # Simulate throttling and internal errors
+        outcome = random.random()
+        if outcome < self.server.throttleRate:
+            self._respondJson(429, {"__type": "TooManyRequestsException", "message": "Rate exceeded"})
+            return False
+        if outcome < self.server.throttleRate + self.server.errorRate:
+            self._respondJson(500, {"__type": "InternalServerErrorException", "message": "Internal error"})
+            return False
+
+        return True
+
+    def _getRegion(self) -> str:
+        match = CREDENTIAL_SCOPE_REGEX.search(self.headers.get("Authorization", ""))
+        return match.group(1) if match else "unknown"
+
+    def _respondJson(self, status: int, body: dict):
+        self._respond(status, "application/json", json.dumps(body).encode("utf-8"))
+
+    def _respond(self, status: int, contentType: str, payload: bytes):
+        self.send_response(status)
+        self.send_header("Content-Type", contentType)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    # Accept many concurrent connections, like AWS endpoints do
+    request_queue_size = 1024
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0, errorRate: float = 0, throttleRate: float = 0, detectorsPerRegion: int = 1):
+        super().__init__((host, port), StandInHandler)
+        self.latency = latency
+        self.errorRate = errorRate
+        self.throttleRate = throttleRate
+        self.detectorsPerRegion = detectorsPerRegion
+        self.requests = {}
+        self.requestsLock = threading.Lock()
+        self.thread = None
+
+    @property
+    def endpointUrl(self) -> str:
+        return f"http://{self.server_address[0]}:{self.server_address[1]}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, name="standin", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        self.thread.join()
+
+    def countRequest(self, operation: str):
+        with self.requestsLock:
+            self.requests[operation] = self.requests.get(operation, 0) + 1
+
+    def getRequestsCount(self) -> dict:
+        with self.requestsLock:
+            return dict(self.requests)
+
+
+def runStandIn(connection, **kwargs):
+    server = StandInServer(**kwargs)
+    server.start()
+    connection.send(server.endpointUrl)
+
+    # Answer the requests count until stopped
+    while connection.recv() != "stop":
+        connection.send(server.getRequestsCount())
+
+    server.stop()
+
+
+class StandInProcess():
+    # The stand-in runs in a child process, so that its threads and memory are not accounted to the exporter
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+        self.connection = None
+        self.process = None
+        self.endpointUrl = None
+
+    def start(self):
+        self.connection, childConnection = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=runStandIn, args=[childConnection], kwargs=self.kwargs, name="standin", daemon=True)
+        self.process.start()
+        childConnection.close()
+        self.endpointUrl = self.connection.recv()
+
+    def stop(self):
+        self.connection.send("stop")
+        self.process.join()
+        self.connection.close()
+
+    def getRequestsCount(self) -> dict:
+        self.connection.send("count")
+        return self.connection.recv()
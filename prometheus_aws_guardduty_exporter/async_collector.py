@@ -0,0 +1,273 @@
+import asyncio
+import contextlib
+import threading
+import time
+from typing import List
+from .collector import GuardDutyMetricsCollector, CURRENT_FINDINGS_CRITERIA, addCountBySeverity
+from .breakdowns import addGroupedStatistics, newRegionStats
+from .findings import addFindingsTracking
+from .ratelimit import isThrottlingError
+from .targets import Target
+
+# aiobotocore is an optional dependency, only required by the asyncio backend
+try:
+    import aiobotocore.session
+    from aiobotocore.credentials import AioDeferredRefreshableCredentials
+except ImportError:
+    aiobotocore = None
+
+
+# Collects the same metrics of GuardDutyMetricsCollector, but issuing all the AWS
+# API calls concurrently on a single event loop, instead of using a thread per target.
+class AsyncGuardDutyMetricsCollector(GuardDutyMetricsCollector):
+    def __init__(self, *args, **kwargs):
+        if aiobotocore is None:
+            raise RuntimeError("The asyncio backend requires the aiobotocore package: pip3 install prometheus-aws-guardduty-exporter[asyncio]")
+
+        super().__init__(*args, **kwargs)
+
+        # The event loop runs in a dedicated thread, so that clients (and their connection
+        # pools) can be reused across scrapes
+        self.loop = None
+        self.loopThread = None
+        self.loopLock = threading.Lock()
+        self.semaphore = None
+
+        # The pending (or completed) creation of the client of each (region, role), along with
+        # all the clients opened for it (including the STS one), closed once not used anymore
+        self.asyncClients = {}
+
+    def stop(self):
+        super().stop()
+
+        with self.loopLock:
+            if self.loop is None:
+                return
+
+            asyncio.run_coroutine_threadsafe(self._closeClients(list(self.asyncClients.values())), self.loop).result()
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.loopThread.join()
+            self.loop.close()
+
+            self.loop = None
+            self.loopThread = None
+            self.asyncClients = {}
+
+    def _createPool(self):
+        # No thread pool is required
+        return None
+
+    def _resizePool(self):
+        # The semaphore is created again on the next collection
+        self.semaphore = None
+
+    def _resetClients(self):
+        super()._resetClients()
+
+        asyncClients = list(self.asyncClients.values())
+        self.asyncClients = {}
+        self._closeClientsLater(asyncClients)
+
+    def _removeTarget(self, target: Target):
+        super()._removeTarget(target)
+
+        asyncClient = self.asyncClients.pop((target.region, target.roleArn), None)
+        if asyncClient is not None:
+            self._closeClientsLater([asyncClient])
+
+    def _closeClientsLater(self, asyncClients: list):
+        # Clients are closed on the loop (which is never started while there are no clients)
+        if asyncClients and self.loop is not None:
+            asyncio.run_coroutine_threadsafe(self._closeClients(asyncClients), self.loop)
+
+    def _collectTargets(self, targets: List[Target]):
+        return asyncio.run_coroutine_threadsafe(self._collectTargetsAsync(targets), self._getLoop()).result()
+
+    def _getLoop(self):
+        with self.loopLock:
+            if self.loop is None:
+                self.loop = asyncio.new_event_loop()
+                self.loopThread = threading.Thread(target=self.loop.run_forever, name="guardduty-asyncio", daemon=True)
+                self.loopThread.start()
+
+            return self.loop
+
+    async def _collectTargetsAsync(self, targets: List[Target]):
+        # Limit the number of in-flight API calls
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.maxConcurrency)
+
+        return await asyncio.gather(*[self._collectMetricsByTargetAsync(target) for target in targets])
+
+    async def _collectMetricsByTargetAsync(self, target: Target):
+        startTime = time.monotonic()
+        regionStats = newRegionStats(self.breakdowns)
+
+        try:
+            # Regions known to have no detectors don't even require a client
+            detectorIds = self._getCachedDetectorIds(target)
+            client = await self._getClient(target.region, target.roleArn) if detectorIds != [] else None
+
+            # List GuardDuty detectors
+            if detectorIds is None:
+                try:
+                    detectorIds = (await self._callApiAsync(target, client.list_detectors))["DetectorIds"]
+                except Exception as error:
+                    detectorIds = self._onListDetectorsError(target, error)
+                else:
+                    self._cacheDetectorIds(target, detectorIds)
+
+            # Get statistics of all detectors concurrently
+            countsBySeverity = await asyncio.gather(*[self._getCountBySeverity(target, client, detectorId) for detectorId in detectorIds])
+            totalFindings = {detectorId: sum(countBySeverity.values()) for detectorId, countBySeverity in zip(detectorIds, countsBySeverity)}
+
+            for countBySeverity in countsBySeverity:
+                addCountBySeverity(regionStats, countBySeverity)
+
+            # Get grouped statistics concurrently, with a single call for each breakdown of each detector
+            groups = [(breakdown, detectorId) for breakdown in self.groupedBreakdowns for detectorId in detectorIds]
+            responses = await asyncio.gather(*[self._callApiAsync(target, client.get_findings_statistics, **self._getGroupedStatisticsParams(detectorId, breakdown)) for breakdown, detectorId in groups])
+
+            for (breakdown, detectorId), response in zip(groups, responses):
+                addGroupedStatistics(regionStats, breakdown, response["FindingStatistics"], totalFindings[detectorId])
+
+            self._limitCardinality(regionStats)
+
+            # Fetch the findings updated since the previous poll, for all detectors concurrently
+            if self.trackFindings:
+                results = await asyncio.gather(*[self._pollFindingsAsync(target, client, detectorId) for detectorId in detectorIds], return_exceptions=True)
+
+                # Tracking errors don't prevent exporting the statistics
+                for detectorId, result in zip(detectorIds, results):
+                    if isinstance(result, Exception):
+                        self._logTrackingError(target, detectorId, result)
+                    else:
+                        self._reconcileFindings(target, detectorId, totalFindings[detectorId])
+
+                addFindingsTracking(regionStats, self._getFindingsTrackers(target, detectorIds))
+        except Exception as error:
+            self._invalidateDetectorIds(target, error)
+            self._logTargetError(target, error)
+
+            # We return False on error so we can increase the errors_total metric
+            regionStats = False
+
+        self.instrumentation.observeTarget(target.accountId, target.region, time.monotonic() - startTime)
+
+        return (target, regionStats)
+
+    async def _getCountBySeverity(self, target: Target, client, detectorId: str):
+        response = await self._callApiAsync(
+            target,
+            client.get_findings_statistics,
+            DetectorId=detectorId,
+            FindingCriteria=CURRENT_FINDINGS_CRITERIA,
+            FindingStatisticTypes=["COUNT_BY_SEVERITY"])
+
+        return response["FindingStatistics"]["CountBySeverity"]
+
+    async def _pollFindingsAsync(self, target: Target, client, detectorId: str):
+        tracker = self._getFindingsTrackers(target, [detectorId])[0]
+        pollStartTime = time.time()
+        params = tracker.getListFindingsParams(detectorId)
+
+        while True:
+            response = await self._callApiAsync(target, client.list_findings, **params)
+            findings = []
+
+            if response["FindingIds"]:
+                findings = (await self._callApiAsync(target, client.get_findings, DetectorId=detectorId, FindingIds=response["FindingIds"]))["Findings"]
+
+            # The tracker is updated page by page, so that a failed poll is resumed where it stopped
+            nextToken = response.get("NextToken")
+            tracker.update(findings, pollStartTime, complete=not nextToken)
+
+            if not nextToken:
+                break
+
+            # The following pages must be listed with the same criteria
+            params = dict(params, NextToken=nextToken)
+
+    async def _callApiAsync(self, target: Target, operation, **kwargs):
+        rateLimiter = self.states[target].rateLimiter
+
+        # Wait for the rate limiter without holding an in-flight slot
+        if rateLimiter is not None:
+            delay = rateLimiter.reserve()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+        try:
+            async with self.semaphore:
+                response = await operation(**kwargs)
+        except Exception as error:
+            # Slow down on throttling
+            if rateLimiter is not None and isThrottlingError(error):
+                rateLimiter.onThrottled()
+            raise
+
+        if rateLimiter is not None:
+            rateLimiter.onSuccess()
+
+        return response
+
+    async def _getClient(self, region: str, roleArn=None):
+        key = (region, roleArn)
+
+        # All coroutines run on the same loop, so the client creation is shared
+        # by storing the pending task
+        if key not in self.asyncClients:
+            openedClients = []
+            self.asyncClients[key] = (asyncio.ensure_future(self._createClient(region, roleArn, openedClients)), openedClients)
+
+        asyncClient = self.asyncClients[key]
+
+        try:
+            return await asyncClient[0]
+        except Exception:
+            # Retry the creation on next scrape, closing the clients opened so far
+            if self.asyncClients.get(key) is asyncClient:
+                self.asyncClients.pop(key)
+                await self._closeClients([asyncClient])
+            raise
+
+    async def _closeClients(self, asyncClients: list):
+        # Release the connection pools of the clients which are not used anymore, once created
+        for task, openedClients in asyncClients:
+            with contextlib.suppress(Exception):
+                await task
+
+            for client in openedClients:
+                with contextlib.suppress(Exception):
+                    await client.close()
+
+    async def _createClient(self, region: str, roleArn, openedClients: list):
+        session = self.clients.dataLoader.register(aiobotocore.session.get_session())
+
+        if roleArn is not None:
+            stsClient = await session.create_client("sts", config=self.botoConfig, region_name=region).__aenter__()
+            openedClients.append(stsClient)
+            self.instrumentation.instrumentClient(stsClient)
+
+            async def _refresh():
+                credentials = (await stsClient.assume_role(
+                    RoleArn=roleArn,
+                    RoleSessionName="GuardDutyExporter",
+                    DurationSeconds=3600
+                ))["Credentials"]
+
+                return {
+                    "access_key": credentials["AccessKeyId"],
+                    "secret_key": credentials["SecretAccessKey"],
+                    "token": credentials["SessionToken"],
+                    "expiry_time": credentials["Expiration"].isoformat(),
+                }
+
+            session = self.clients.dataLoader.register(aiobotocore.session.get_session())
+            session._credentials = AioDeferredRefreshableCredentials(refresh_using=_refresh, method="sts-assume-role")
+
+        client = await session.create_client("guardduty", config=self.botoConfig, region_name=region, endpoint_url=self.endpointUrl).__aenter__()
+        openedClients.append(client)
+        self.instrumentation.instrumentClient(client)
+
+        return client
@@ -0,0 +1,65 @@
+import sys
+from typing import Dict, List, NamedTuple
+
+# The value of the bucket aggregating findings exceeding the cardinality limit
+OTHER_BUCKET = "other"
+
+# The max number of groups returned by GetFindingsStatistics (which doesn't support pagination):
+# groups are sorted by count, so only the less relevant ones can be missed (and counted as other)
+MAX_GROUPS = 100
+
+
+class GroupedBreakdown(NamedTuple):
+    groupBy: str
+    responseKey: str
+    valueKey: str
+
+
+# Breakdowns requiring an additional GetFindingsStatistics call (grouped by) per detector
+GROUPED_BREAKDOWNS = {
+    "finding_type": GroupedBreakdown("FINDING_TYPE", "GroupedByFindingType", "FindingType"),
+    "resource_type": GroupedBreakdown("RESOURCE", "GroupedByResource", "ResourceType"),
+}
+
+# Breakdowns computed from the findings count by severity, at no additional cost
+SEVERITY_LEVEL_BREAKDOWN = "severity_level"
+
+BREAKDOWNS = [SEVERITY_LEVEL_BREAKDOWN] + list(GROUPED_BREAKDOWNS.keys())
+
+
+def newRegionStats(breakdowns: List[str]) -> Dict[str, Dict[str, float]]:
+    regionStats = {"severity": {"low": 0, "medium": 0, "high": 0}}
+
+    for breakdown in breakdowns:
+        regionStats[breakdown] = {}
+
+    return regionStats
+
+
+def addGroupedStatistics(regionStats: dict, breakdown: str, findingStatistics: dict, totalFindings: float):
+    groupedBreakdown = GROUPED_BREAKDOWNS[breakdown]
+    counts = regionStats[breakdown]
+    groupedFindings = 0
+
+    for group in findingStatistics.get(groupedBreakdown.responseKey, []):
+        # Values are interned, because the same ones (ie. finding types) are shared by most regions
+        value = sys.intern(group.get(groupedBreakdown.valueKey) or "unknown")
+        counts[value] = counts.get(value, 0) + group.get("TotalFindings", 0)
+        groupedFindings += group.get("TotalFindings", 0)
+
+    # The findings of the groups exceeding MAX_GROUPS are counted as other, so that
+    # the breakdown adds up to the total number of current findings of the detector
+    if totalFindings > groupedFindings:
+        counts[OTHER_BUCKET] = counts.get(OTHER_BUCKET, 0) + totalFindings - groupedFindings
+
+
+def limitCardinality(counts: Dict[str, float], limit: int) -> Dict[str, float]:
+    if limit <= 0 or len(counts) <= limit:
+        return counts
+
+    # Keep the top values (by count) and aggregate the others
+    sortedCounts = sorted(counts.items(), key=lambda item: item[1], reverse=True)
+    limited = dict(sortedCounts[:limit - 1])
+    limited[OTHER_BUCKET] = limited.get(OTHER_BUCKET, 0) + sum(count for _, count in sortedCounts[limit - 1:])
+
+    return limited
@@ -0,0 +1,65 @@
+import fnmatch
+from typing import Dict, List, Optional
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client.samples import Sample
+
+# The severity buckets of the findings
+SEVERITIES = ["low", "medium", "high"]
+
+
+def isAllowed(value: str, includePatterns: Optional[List[str]] = None, excludePatterns: Optional[List[str]] = None) -> bool:
+    # The value must match at least one of the included patterns (if any) and none of the excluded ones
+    if includePatterns and not any(fnmatch.fnmatchcase(value, pattern) for pattern in includePatterns):
+        return False
+
+    return not any(fnmatch.fnmatchcase(value, pattern) for pattern in excludePatterns or [])
+
+
+def buildSample(metric, labels: Dict[str, str], value: float) -> Sample:
+    # The samples of counters are suffixed by _total
+    return Sample(f"{metric.name}_total" if metric.type == "counter" else metric.name, labels, value)
+
+
+def applySeriesBudget(metrics: list, maxSeries: int) -> Dict[str, int]:
+    # Keep up to maxSeries series of each metric (in the targets order, so that the same series are
+    # kept across refreshes), returning the number of dropped series by metric. The series of an
+    # (account, region) pair are kept or dropped together, so that a region is never partially exported.
+    droppedSeries = {}
+
+    for metric in metrics:
+        if maxSeries <= 0 or len(metric.samples) <= maxSeries:
+            continue
+
+        groups = {}
+        for sample in metric.samples:
+            groups.setdefault((sample.labels.get("account_id"), sample.labels.get("region")), []).append(sample)
+
+        samples = []
+        for groupSamples in groups.values():
+            if len(samples) + len(groupSamples) > maxSeries:
+                break
+
+            samples += groupSamples
+
+        droppedSeries[metric.name] = len(metric.samples) - len(samples)
+        metric.samples = samples
+
+    return droppedSeries
+
+
+def buildSeriesMetrics(metrics: list, droppedSeries: Dict[str, int]) -> list:
+    seriesMetric = GaugeMetricFamily(
+        "aws_guardduty_series",
+        "The number of series exported by metric (excluding the instrumentation metrics)",
+        labels=["metric"])
+
+    droppedSeriesMetric = GaugeMetricFamily(
+        "aws_guardduty_series_dropped",
+        "The number of series dropped by metric, because exceeding the max series per metric",
+        labels=["metric"])
+
+    for metric in metrics:
+        seriesMetric.add_metric(value=len(metric.samples), labels=[metric.name])
+        droppedSeriesMetric.add_metric(value=droppedSeries.get(metric.name, 0), labels=[metric.name])
+
+    return [seriesMetric, droppedSeriesMetric]
@@ -4,35 +4,150 @@ import time
 import sys
 import signal
 from typing import List
-from pythonjsonlogger import jsonlogger
 from prometheus_client import start_http_server, Gauge
 from prometheus_client.core import REGISTRY
-from .collector import GuardDutyMetricsCollector
+from .breakdowns import BREAKDOWNS
+from .budgets import SEVERITIES
+from .config import CONFIG_KEYS, ConfigFile
+from .scheduling import parseRefreshTier
+from .sharding import ShardedMetricsCollector
+from .detectors import discoverRegions
+from .exposition import CachedExposition, startCachedMetricsServer
+from .push import pushToGateway, pushToRemoteWrite
+from .targets import loadRoleArns
 
 
 def parseArguments(argv: List[str]):
     # Parse arguments
     parser = argparse.ArgumentParser()
-    parser.add_argument("--region", metavar="REGION", required=True, nargs="+", help="AWS GuardDuty region (can specify multiple space separated regions)")
-    parser.add_argument("--role-arn", required=False, default=None, help="The ARN of an AWS role to assume (optional)")
+    regionsGroup = parser.add_mutually_exclusive_group()
+    regionsGroup.add_argument("--region", metavar="REGION", nargs="+", help="AWS GuardDuty region (can specify multiple space separated regions)")
+    regionsGroup.add_argument("--all-regions", default=False, action="store_true", help="Scrape all the regions where GuardDuty is available, skipping the ones without detectors")
+    parser.add_argument("--config-file", required=False, default=None, help="The path to a YAML config file of regions, role ARNs, refresh tiers, concurrency and timeouts, overriding the command line arguments and reloaded on change or SIGHUP (optional)")
+    parser.add_argument("--role-arn", metavar="ROLE_ARN", required=False, default=None, nargs="+", help="The ARN of an AWS role to assume (optional, can specify multiple space separated roles to scrape multiple accounts)")
+    parser.add_argument("--role-arn-file", required=False, default=None, help="The path to a file containing the ARNs of AWS roles to assume, one per line (optional)")
+    parser.add_argument("--max-concurrency", required=False, default=None, type=int, help="The max number of (account, region) pairs scraped concurrently (optional)")
+    parser.add_argument("--refresh-interval", required=False, default=None, type=float, help="Refresh metrics in background every given number of seconds, instead of on each scrape (optional)")
+    parser.add_argument("--min-collect-interval", required=False, default=0, type=float, help="The min number of seconds between two collections when collecting on each scrape: scrapes in between are served the latest collected metrics (optional)")
+    parser.add_argument("--cache-ttl", required=False, default=0, type=float, help="The number of seconds the metrics of a region are cached for: once expired, cached metrics are served while refreshed in background (optional)")
+    parser.add_argument("--refresh-tier", metavar="SECONDS:PATTERN[,PATTERN...]", required=False, default=None, action="append", type=parseRefreshTier, help="Refresh the regions matching the given patterns (ie. us-* or ACCOUNT_ID/REGION) every given number of seconds (optional, can be repeated)")
+    parser.add_argument("--refresh-jitter", required=False, default=0.1, type=float, help="The random jitter applied to the refresh interval of each region, as a fraction of the interval")
+    parser.add_argument("--detector-cache-ttl", required=False, default=0, type=float, help="The number of seconds the detectors of a region are cached for, instead of being listed on each refresh (optional)")
+    parser.add_argument("--max-staleness", required=False, default=0, type=float, help="The max number of seconds the last good metrics of a failing region are served for (optional)")
+    parser.add_argument("--connect-timeout", required=False, default=2, type=float, help="The timeout (in seconds) to connect to AWS APIs")
+    parser.add_argument("--read-timeout", required=False, default=10, type=float, help="The timeout (in seconds) to read responses from AWS APIs")
+    parser.add_argument("--max-attempts", required=False, default=2, type=int, help="The max number of attempts of each AWS API call, including the initial one")
+    parser.add_argument("--retry-mode", required=False, default="legacy", choices=["legacy", "standard", "adaptive"], help="The botocore retry mode")
+    parser.add_argument("--rate-limit", required=False, default=None, type=float, help="The max number of AWS API calls per second to each region of each account, adaptively reduced on throttling (optional)")
+    parser.add_argument("--rate-limit-burst", required=False, default=None, type=float, help="The max burst of AWS API calls to each region of each account (optional)")
+    parser.add_argument("--circuit-breaker-threshold", required=False, default=0, type=int, help="Skip scraping a region after the given number of consecutive failures (optional)")
+    parser.add_argument("--circuit-breaker-cooldown", required=False, default=300, type=float, help="The number of seconds a persistently failing region is skipped for")
+    parser.add_argument("--breakdown", metavar="BREAKDOWN", required=False, default=None, nargs="+", choices=BREAKDOWNS, help=f"Export the current findings also broken down by the given dimensions (optional, can specify multiple space separated breakdowns): {', '.join(BREAKDOWNS)}")
+    parser.add_argument("--breakdown-limit", required=False, default=25, type=int, help="The max number of values of each breakdown per region, aggregating the others into the 'other' value")
+    parser.add_argument("--max-series-per-metric", required=False, default=0, type=int, help="The max number of series exported by each metric, dropping the exceeding ones (optional)")
+    parser.add_argument("--include-region", metavar="PATTERN", required=False, default=None, nargs="+", help="Scrape only the regions matching the given patterns (ie. eu-*) (optional, can specify multiple space separated patterns)")
+    parser.add_argument("--exclude-region", metavar="PATTERN", required=False, default=None, nargs="+", help="Don't scrape the regions matching the given patterns (optional, can specify multiple space separated patterns)")
+    parser.add_argument("--include-severity", metavar="SEVERITY", required=False, default=None, nargs="+", choices=SEVERITIES, help=f"Export only the findings of the given severities (optional): {', '.join(SEVERITIES)}")
+    parser.add_argument("--exclude-severity", metavar="SEVERITY", required=False, default=None, nargs="+", choices=SEVERITIES, help=f"Don't export the findings of the given severities (optional): {', '.join(SEVERITIES)}")
+    parser.add_argument("--track-findings", required=False, default=False, action="store_true", help="Incrementally keep track of findings, to export the number of new findings and the age of the oldest unarchived finding (optional)")
+    parser.add_argument("--state-file", required=False, default=None, help="The path to a file where the state is persisted, so that it's restored on restart (optional)")
+    parser.add_argument("--state-save-interval", required=False, default=60, type=float, help="The min number of seconds between two saves of the state file")
+    parser.add_argument("--shards", required=False, default=1, type=int, help="Collect metrics in the given number of worker processes, each one scraping a shard of the (account, region) pairs (optional, requires --refresh-interval)")
+    parser.add_argument("--backend", required=False, default="threads", choices=["threads", "asyncio"], help="The backend used to call AWS APIs: threads (default) or asyncio (requires aiobotocore)")
+    parser.add_argument("--cached-exposition", required=False, default=False, action="store_true", help="Serve a metrics payload rendered once per refresh (and shared by concurrent scrapes) instead of rendering it on each scrape (optional)")
+    parser.add_argument("--push-gateway", required=False, default=None, help="Collect metrics once and push them to the Pushgateway at the given URL, instead of exposing them (optional)")
+    parser.add_argument("--push-remote-write", required=False, default=None, help="Collect metrics once and push them to the Prometheus remote write endpoint at the given URL, instead of exposing them (optional)")
+    parser.add_argument("--push-job", required=False, default="aws_guardduty_exporter", help="The job label of the pushed metrics")
+    parser.add_argument("--push-timeout", required=False, default=30, type=float, help="The timeout (in seconds) to push metrics")
     parser.add_argument("--exporter-host", required=False, default="127.0.0.1", help="The host at which the Prometheus exporter should listen to")
     parser.add_argument("--exporter-port", required=False, default="9100", type=int, help="The port at which the Prometheus exporter should listen to")
     parser.add_argument("--log-level", help="Minimum log level. Accepted values are: DEBUG, INFO, WARNING, ERROR, CRITICAL", default="INFO")
 
-    return parser.parse_args(argv)
+    args = parser.parse_args(argv)
 
+    if not args.region and not args.all_regions and not args.config_file:
+        parser.error("one of the arguments --region --all-regions --config-file is required")
 
-def main(args):
-    shutdown = False
+    if args.shards > 1 and args.refresh_interval is None:
+        parser.error("--shards requires --refresh-interval")
+
+    if (args.push_gateway or args.push_remote_write) and (args.refresh_interval is not None or args.shards > 1):
+        parser.error("--push-gateway and --push-remote-write collect metrics once, so can't be used with --refresh-interval or --shards")
+
+    return args
+
+
+def initLogger(logLevel: str):
+    from pythonjsonlogger import jsonlogger
 
-    # Init logger
     logHandler = logging.StreamHandler()
     formatter = jsonlogger.JsonFormatter("%(asctime)s %(levelname)s %(message)s", datefmt="%Y-%m-%d %H:%M:%S")
     logHandler.setFormatter(formatter)
 
     logger = logging.getLogger()
     logger.addHandler(logHandler)
-    logger.setLevel(args.log_level)
+    logger.setLevel(logLevel)
+
+    return logger
+
+
+def getCollectorClass(backend: str):
+    # Imported lazily, so that botocore is loaded only by processes calling AWS APIs (ie. not by the
+    # main process when sharding) and aiobotocore only when required
+    if backend == "asyncio":
+        from .async_collector import AsyncGuardDutyMetricsCollector
+        return AsyncGuardDutyMetricsCollector
+
+    from .collector import GuardDutyMetricsCollector
+    return GuardDutyMetricsCollector
+
+
+def reloadConfig(configFile: ConfigFile, collector, collectorKwargs: dict, logger):
+    # Settings removed from the config file are restored to the command line ones
+    try:
+        reloadedKwargs = {key: collectorKwargs[key] for key in CONFIG_KEYS.values()}
+        reloadedKwargs.update(configFile.load())
+
+        if not reloadedKwargs["regions"]:
+            raise ValueError("no regions to scrape")
+
+        collector.reconfigure(**reloadedKwargs)
+    except Exception as error:
+        logger.error(f"Unable to reload the config from {configFile.filepath} because of error: {str(error)}")
+        return
+
+    logger.info(f"Reloaded the config from {configFile.filepath}")
+
+
+def pushOnce(args, collector, logger) -> int:
+    # Restore the state (if any), so that counters don't reset between runs
+    collector.start()
+
+    try:
+        metrics = list(collector.collect())
+
+        if args.push_gateway:
+            pushToGateway(args.push_gateway, metrics, args.push_job, timeout=args.push_timeout)
+            logger.info(f"Pushed metrics to the Pushgateway at {args.push_gateway}")
+
+        if args.push_remote_write:
+            pushToRemoteWrite(args.push_remote_write, metrics, args.push_job, timeout=args.push_timeout)
+            logger.info(f"Pushed metrics to the remote write endpoint at {args.push_remote_write}")
+    except Exception as error:
+        logger.error(f"Unable to push metrics because of error: {str(error)}")
+        return 1
+    finally:
+        collector.stop()
+
+    return 0
+
+
+def main(args):
+    shutdown = False
+    reload = False
+
+    # Init logger
+    logger = initLogger(args.log_level)
 
     # Register signal handler
     def _on_sigterm(signal, frame):
@@ -40,12 +155,73 @@ def main(args):
         nonlocal shutdown
         shutdown = True
 
+    def _on_sighup(signal, frame):
+        nonlocal reload
+        reload = True
+
     signal.signal(signal.SIGINT, _on_sigterm)
     signal.signal(signal.SIGTERM, _on_sigterm)
+    signal.signal(signal.SIGHUP, _on_sighup)
 
     # Register our custom collector
-    logger.info("Collecting initial metrics")
-    REGISTRY.register(GuardDutyMetricsCollector(args.region, args.role_arn))
+    logger.info("Starting collector")
+    roleArns = (args.role_arn or []) + (loadRoleArns(args.role_arn_file) if args.role_arn_file else [])
+    regions = discoverRegions() if args.all_regions else args.region
+    collectorKwargs = dict(
+        regions=regions,
+        roleArns=roleArns or None,
+        refreshInterval=args.refresh_interval,
+        maxConcurrency=args.max_concurrency,
+        cacheTtl=args.cache_ttl,
+        maxStaleness=args.max_staleness,
+        connectTimeout=args.connect_timeout,
+        readTimeout=args.read_timeout,
+        maxAttempts=args.max_attempts,
+        retryMode=args.retry_mode,
+        rateLimit=args.rate_limit,
+        rateLimitBurst=args.rate_limit_burst,
+        circuitBreakerThreshold=args.circuit_breaker_threshold,
+        circuitBreakerCooldown=args.circuit_breaker_cooldown,
+        breakdowns=args.breakdown,
+        breakdownLimit=args.breakdown_limit,
+        trackFindings=args.track_findings,
+        stateFilepath=args.state_file,
+        stateSaveInterval=args.state_save_interval,
+        minCollectInterval=args.min_collect_interval,
+        refreshTiers=args.refresh_tier,
+        refreshJitter=args.refresh_jitter,
+        detectorCacheTtl=args.detector_cache_ttl,
+        skipRegionsWithoutDetectors=args.all_regions,
+        maxSeriesPerMetric=args.max_series_per_metric,
+        includeRegions=args.include_region,
+        excludeRegions=args.exclude_region,
+        includeSeverities=args.include_severity,
+        excludeSeverities=args.exclude_severity)
+
+    # The config file overrides the command line arguments
+    configFile = ConfigFile(args.config_file) if args.config_file else None
+
+    try:
+        config = configFile.load() if configFile is not None else {}
+    except Exception as error:
+        logger.error(f"Unable to load the config from {args.config_file} because of error: {str(error)}")
+        return 1
+
+    if not config.get("regions", regions):
+        logger.error("No regions to scrape: set --region, --all-regions or the regions in the config file")
+        return 1
+
+    if args.shards > 1:
+        collector = ShardedMetricsCollector(args.shards, args.backend, logLevel=args.log_level, **{**collectorKwargs, **config})
+    else:
+        collector = getCollectorClass(args.backend)(**{**collectorKwargs, **config})
+
+    # Run once, pushing metrics instead of exposing them
+    if args.push_gateway or args.push_remote_write:
+        return pushOnce(args, collector, logger)
+
+    collector.start()
+    REGISTRY.register(collector)
 
     # Set the up metric value, which will be steady to 1 for the entire app lifecycle
     upMetric = Gauge(
@@ -55,17 +231,26 @@ def main(args):
     upMetric.set(1)
 
     # Start server
-    start_http_server(args.exporter_port, args.exporter_host)
+    if args.cached_exposition:
+        startCachedMetricsServer(CachedExposition(REGISTRY, collector), args.exporter_port, args.exporter_host)
+    else:
+        start_http_server(args.exporter_port, args.exporter_host)
     logger.info("Exporter listening on {host}:{port}".format(host=args.exporter_host, port=args.exporter_port))
 
     while not shutdown:
         time.sleep(1)
 
+        # Reload the config file on SIGHUP or once changed
+        if configFile is not None and (reload or configFile.hasChanged()):
+            reload = False
+            reloadConfig(configFile, collector, collectorKwargs, logger)
+
+    collector.stop()
     logger.info("Exporter has shutdown")
 
 
 def run():
-    main(parseArguments(sys.argv[1:]))
+    sys.exit(main(parseArguments(sys.argv[1:])))
 
 
 if __name__ == '__main__':
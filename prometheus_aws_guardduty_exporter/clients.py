@@ -0,0 +1,108 @@
+import threading
+from typing import Optional
+import boto3
+import botocore
+import botocore.session
+from botocore.credentials import DeferredRefreshableCredentials
+from .instrumentation import CollectorInstrumentation
+
+
+class SharedDataLoader():
+    # Each botocore session loads (and caches) the service models and endpoints through its own data loader:
+    # sharing the loader across sessions loads them once per process, instead of once per client
+    def __init__(self):
+        self.loader = None
+        self.lock = threading.Lock()
+
+    def register(self, session):
+        with self.lock:
+            if self.loader is None:
+                self.loader = session.get_component("data_loader")
+            else:
+                session.register_component("data_loader", self.loader)
+
+        return session
+
+
+class GuardDutyClientsCache():
+    def __init__(self, botoConfig: botocore.client.Config, endpointUrl: Optional[str] = None, instrumentation: Optional[CollectorInstrumentation] = None):
+        self.botoConfig = botoConfig
+        self.endpointUrl = endpointUrl
+        self.instrumentation = instrumentation
+        self.dataLoader = SharedDataLoader()
+        self.clients = {}
+        self.stsClients = {}
+        self.clientsLocks = {}
+        self.lock = threading.Lock()
+
+    def getClient(self, region: str, roleArn=None):
+        key = (region, roleArn)
+
+        # Fast path: the client has already been created
+        client = self.clients.get(key)
+        if client is not None:
+            return client
+
+        # Each client is created once, without blocking the creation of clients for other keys
+        with self.lock:
+            clientLock = self.clientsLocks.setdefault(key, threading.Lock())
+
+        with clientLock:
+            if key not in self.clients:
+                session = self._createSession(region, roleArn)
+                self.clients[key] = self._instrument(session.client("guardduty", config=self.botoConfig, region_name=region, endpoint_url=self.endpointUrl))
+
+            return self.clients[key]
+
+    def removeClient(self, region: str, roleArn=None):
+        key = (region, roleArn)
+
+        with self.lock:
+            self.clientsLocks.pop(key, None)
+            clients = [self.clients.pop(key, None), self.stsClients.pop(key, None)]
+
+        # Release the connection pools
+        for client in clients:
+            if client is not None:
+                client.close()
+
+    def close(self):
+        for region, roleArn in set(self.clients.keys()) | set(self.stsClients.keys()):
+            self.removeClient(region, roleArn)
+
+    def _instrument(self, client):
+        if self.instrumentation is not None:
+            self.instrumentation.instrumentClient(client)
+
+        return client
+
+    def _createSession(self, region: str, roleArn=None):
+        botocoreSession = self.dataLoader.register(botocore.session.get_session())
+
+        if roleArn is not None:
+            botocoreSession._credentials = self._createAssumeRoleCredentials(region, roleArn)
+
+        return boto3.session.Session(botocore_session=botocoreSession)
+
+    def _createAssumeRoleCredentials(self, region: str, roleArn: str):
+        session = boto3.session.Session(botocore_session=self.dataLoader.register(botocore.session.get_session()))
+        stsClient = self._instrument(session.client("sts", config=self.botoConfig, region_name=region))
+        self.stsClients[(region, roleArn)] = stsClient
+
+        def _refresh():
+            credentials = stsClient.assume_role(
+                RoleArn=roleArn,
+                RoleSessionName="GuardDutyExporter",
+                DurationSeconds=3600
+            )["Credentials"]
+
+            return {
+                "access_key": credentials["AccessKeyId"],
+                "secret_key": credentials["SecretAccessKey"],
+                "token": credentials["SessionToken"],
+                "expiry_time": credentials["Expiration"].isoformat(),
+            }
+
+        # Credentials are lazily fetched on first use and then automatically
+        # refreshed by botocore shortly before they expire
+        return DeferredRefreshableCredentials(refresh_using=_refresh, method="sts-assume-role")
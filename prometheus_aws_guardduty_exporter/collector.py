@@ -1,89 +1,805 @@
 import logging
-import boto3
+import sys
+import threading
+import time
 import botocore
 from multiprocessing.dummy import Pool
-from typing import List
+from typing import List, Optional
 from prometheus_client.core import GaugeMetricFamily, CounterMetricFamily
+from .budgets import SEVERITIES, applySeriesBudget, buildSample, buildSeriesMetrics, isAllowed
+from .breakdowns import BREAKDOWNS, GROUPED_BREAKDOWNS, MAX_GROUPS, SEVERITY_LEVEL_BREAKDOWN, addGroupedStatistics, limitCardinality, newRegionStats
+from .clients import GuardDutyClientsCache
+from .detectors import getErrorCode, isDetectorNotFoundError, isRegionDisabledError
+from .findings import FindingsTracker, addFindingsTracking, getSeverityBucket
+from .instrumentation import CollectorInstrumentation, buildSnapshotAgeMetric
+from .ratelimit import CircuitBreaker, TokenBucket, isThrottlingError
+from .scheduling import RefreshTier, getNextRefreshDelay, getRefreshInterval
+from .sharding import filterShardTargets
+from .state import StateFile
+from .targets import Target, buildTargets
+
+
+# The default max number of (account, region) targets scraped concurrently
+DEFAULT_MAX_CONCURRENCY = 32
+
+# The min number of seconds the background refresh waits between two refreshes
+MIN_REFRESH_WAIT = 1
+
+# The number of seconds regions without detectors are skipped for (when skipping them), unless the detectors are cached longer
+NO_DETECTORS_CACHE_TTL = 3600
+
+# Only current (unarchived) findings are counted
+CURRENT_FINDINGS_CRITERIA = {"Criterion": {"service.archived": {"Eq": ["false"]}}}
+
+
+def addCountBySeverity(regionStats: dict, countBySeverity: dict):
+    for severity, count in countBySeverity.items():
+        severity = float(severity)
+        regionStats["severity"][getSeverityBucket(severity)] += count
+
+        # Keep track of the exact severity level too, if required
+        if SEVERITY_LEVEL_BREAKDOWN in regionStats:
+            severityLevels = regionStats[SEVERITY_LEVEL_BREAKDOWN]
+            severityLevel = sys.intern(f"{severity:.1f}")
+            severityLevels[severityLevel] = severityLevels.get(severityLevel, 0) + count
+
+
+class TargetState():
+    def __init__(self):
+        # The latest successfully collected stats (last good)
+        self.stats = None
+        self.lastSuccessTime = None
+        self.lastAttemptTime = None
+        self.refreshInterval = 0
+        self.nextRefreshDelay = None
+        self.failing = False
+        self.scrapeErrors = 0
+        self.circuitBreaker = None
+        self.rateLimiter = None
+        self.findingsTrackers = {}
+        self.detectorIds = None
+        self.detectorsListedAt = None
+
+        # The error code of the listing of the detectors, when the region has been skipped because of it
+        self.skipErrorCode = None
+
+        # The samples built from the stats, reused until the stats change
+        self.statsSamples = None
 
 
 class GuardDutyMetricsCollector():
-    def __init__(self, regions: List[str], roleArn=None):
+    def __init__(
+            self,
+            regions: List[str],
+            roleArns: Optional[List[str]] = None,
+            refreshInterval: Optional[float] = None,
+            maxConcurrency: Optional[int] = None,
+            endpointUrl: Optional[str] = None,
+            cacheTtl: float = 0,
+            maxStaleness: float = 0,
+            connectTimeout: float = 2,
+            readTimeout: float = 10,
+            maxAttempts: int = 2,
+            retryMode: str = "legacy",
+            rateLimit: Optional[float] = None,
+            rateLimitBurst: Optional[float] = None,
+            circuitBreakerThreshold: int = 0,
+            circuitBreakerCooldown: float = 300,
+            breakdowns: Optional[List[str]] = None,
+            breakdownLimit: int = 25,
+            trackFindings: bool = False,
+            stateFilepath: Optional[str] = None,
+            stateSaveInterval: float = 60,
+            minCollectInterval: float = 0,
+            refreshTiers: Optional[List[RefreshTier]] = None,
+            refreshJitter: float = 0.1,
+            detectorCacheTtl: float = 0,
+            skipRegionsWithoutDetectors: bool = False,
+            shardIndex: int = 0,
+            shardsCount: int = 1,
+            maxSeriesPerMetric: int = 0,
+            includeRegions: Optional[List[str]] = None,
+            excludeRegions: Optional[List[str]] = None,
+            includeSeverities: Optional[List[str]] = None,
+            excludeSeverities: Optional[List[str]] = None):
         self.regions = regions
-        self.roleArn = roleArn
-        self.pool = Pool(len(self.regions))
-        self.scrapeErrors = {region: 0 for region in regions}
+        self.roleArns = roleArns
+        self.includeRegions = includeRegions
+        self.excludeRegions = excludeRegions
+        self.shardIndex = shardIndex
+        self.shardsCount = shardsCount
+        self.targets = self._buildTargets(regions, roleArns)
+        self.refreshInterval = refreshInterval
+        self.maxConcurrency = self._getMaxConcurrency(maxConcurrency)
+        self.poolLock = threading.Lock()
+        self.pool = self._createPool()
+
+        # The per-target state: results are cached for cacheTtl seconds, while the last good
+        # results are served up to maxStaleness seconds when a target is failing
+        self.cacheTtl = cacheTtl
+        self.maxStaleness = maxStaleness
+        self.statesLock = threading.Lock()
+        self.inFlightTargets = set()
+
+        # Each target is refreshed on its own schedule: the interval depends on the first matching
+        # tier (defaulting to the cache TTL or refresh interval) and is jittered to smooth API calls
+        self.refreshTiers = refreshTiers or []
+        self.refreshJitter = refreshJitter
+
+        # Each target has its own (optional) rate limiter and circuit breaker, so that a throttled
+        # or persistently failing region doesn't affect the others
+        self.circuitBreakerThreshold = circuitBreakerThreshold
+        self.circuitBreakerCooldown = circuitBreakerCooldown
+        self.rateLimit = rateLimit
+        self.rateLimitBurst = rateLimitBurst
+        self.states = {target: self._createTargetState(target) for target in self.targets}
+
+        # Optional breakdowns of the findings count (ie. by finding type), each one limited
+        # to breakdownLimit values per region to keep the series cardinality under control
+        self.breakdowns = [breakdown for breakdown in BREAKDOWNS if breakdown in (breakdowns or [])]
+        self.groupedBreakdowns = [breakdown for breakdown in self.breakdowns if breakdown in GROUPED_BREAKDOWNS]
+        self.breakdownLimit = breakdownLimit
+
+        # Detectors almost never change, so they're optionally listed at most once every detectorCacheTtl
+        # seconds. Regions without detectors (or not enabled) can be skipped, to poll only the used ones.
+        self.detectorCacheTtl = detectorCacheTtl
+        self.skipRegionsWithoutDetectors = skipRegionsWithoutDetectors
+
+        # Budgets keeping the number of exported series under control
+        self.maxSeriesPerMetric = maxSeriesPerMetric
+        self.severities = [severity for severity in SEVERITIES if isAllowed(severity, includeSeverities, excludeSeverities)]
+        self.droppedSeries = {}
+
+        # Optionally keep track of findings incrementally, to export new findings and their age
+        self.trackFindings = trackFindings
+
+        # GuardDuty clients are reused across scrapes, along with their connection pools and credentials
+        self.botoConfig = botocore.client.Config(connect_timeout=connectTimeout, read_timeout=readTimeout, retries={"max_attempts": maxAttempts, "mode": retryMode})
+        self.endpointUrl = endpointUrl
+        self.instrumentation = CollectorInstrumentation()
+        self.clients = GuardDutyClientsCache(self.botoConfig, endpointUrl, self.instrumentation)
+
+        # The state is optionally persisted to disk, so that metrics can be served immediately
+        # after a restart and counters never decrease
+        self.stateFile = StateFile(stateFilepath) if stateFilepath else None
+        self.stateSaveInterval = stateSaveInterval
+        self.stateSavedAt = None
+        self.stateSaveLock = threading.Lock()
+
+        # The latest snapshot of metrics, used when refreshing in background
+        self.snapshotLock = threading.Lock()
+        self.snapshotMetrics = None
+        self.snapshotTimestamp = None
+
+        # When collecting on scrape, concurrent scrapes share a single in-flight fan-out and
+        # fan-outs are run at most once every minCollectInterval seconds (single-flight)
+        self.minCollectInterval = minCollectInterval
+        self.collectLock = threading.Lock()
+        self.collectedMetrics = None
+        self.collectedAt = None
+        self.collects = 0
+
+        # Background refresh thread, woken up early when the targets are reconfigured
+        self.refreshThread = None
+        self.refreshShutdown = threading.Event()
+        self.refreshWakeup = threading.Event()
+
+    def start(self):
+        if self.stateFile is not None:
+            self._loadState()
+
+        # The background refresh is disabled: metrics are collected on each scrape
+        if self.refreshInterval is None or self.refreshThread is not None:
+            return
+
+        self.refreshShutdown.clear()
+        self.refreshWakeup.clear()
+        self.refreshThread = threading.Thread(target=self._refreshLoop, name="guardduty-refresh", daemon=True)
+        self.refreshThread.start()
+
+    def stop(self):
+        if self.refreshThread is not None:
+            self.refreshShutdown.set()
+            self.refreshWakeup.set()
+            self.refreshThread.join()
+            self.refreshThread = None
+
+        if self.stateFile is not None:
+            self._saveState(force=True)
+
+    def describe(self):
+        # Avoid the registry to collect metrics (and call AWS APIs) at registration time
+        return []
 
     def collect(self):
+        # When not refreshing in background, each scrape triggers a fan-out to all regions
+        if self.refreshInterval is None:
+            metrics = self._collectSingleFlight()
+            return metrics + buildSeriesMetrics(metrics, self.droppedSeries) + self.instrumentation.collect()
+
+        return self.collectSnapshot() + self.collectRuntime()
+
+    def collectSnapshot(self):
+        # The metrics of the snapshot, which only change once refreshed in background
+        with self.snapshotLock:
+            metrics = self.snapshotMetrics
+
+        # No snapshot has been built yet
+        if metrics is None:
+            return []
+
+        return metrics + buildSeriesMetrics(metrics, self.droppedSeries)
+
+    def collectRuntime(self):
+        # The metrics changing between refreshes in background (ie. the snapshot age)
+        with self.snapshotLock:
+            timestamp = self.snapshotTimestamp
+
+        # No snapshot has been built yet
+        if timestamp is None:
+            return []
+
+        return [buildSnapshotAgeMetric(timestamp)] + self.instrumentation.collect()
+
+    def refresh(self):
+        startTime = time.monotonic()
+        now = time.time()
+
+        # Look for targets whose cached results have expired and are not already being refreshed
+        with self.statesLock:
+            expiredTargets = [target for target in self.targets if target not in self.inFlightTargets and self._isExpired(self.states[target], now) and not self.states[target].circuitBreaker.isOpen(now)]
+            self.inFlightTargets.update(expiredTargets)
+
+            # When refreshing on scrape, targets having cached results are revalidated in background
+            # while serving the cached results (stale-while-revalidate)
+            if self.refreshInterval is None and self.cacheTtl > 0:
+                revalidateTargets = [target for target in expiredTargets if self.states[target].stats is not None]
+            else:
+                revalidateTargets = []
+
+        if revalidateTargets:
+            threading.Thread(target=self._refreshTargets, args=[revalidateTargets], name="guardduty-revalidate", daemon=True).start()
+
+        syncTargets = [target for target in expiredTargets if target not in revalidateTargets]
+        if syncTargets:
+            self._refreshTargets(syncTargets)
+
+        metrics = self._buildMetrics(time.time())
+        self.instrumentation.observeCollect(time.monotonic() - startTime)
+
+        with self.snapshotLock:
+            self.snapshotMetrics = metrics
+            self.snapshotTimestamp = time.time()
+
+        if self.stateFile is not None:
+            self._saveState()
+
+        return metrics
+
+    def reconfigure(
+            self,
+            regions: List[str],
+            roleArns: Optional[List[str]] = None,
+            refreshTiers: Optional[List[RefreshTier]] = None,
+            maxConcurrency: Optional[int] = None,
+            connectTimeout: float = 2,
+            readTimeout: float = 10):
+        targets = self._buildTargets(regions, roleArns)
+
+        with self.statesLock:
+            currentTargets = set(targets)
+            addedTargets = [target for target in targets if target not in self.states]
+            removedTargets = [target for target in self.targets if target not in currentTargets]
+
+            self.regions = regions
+            self.roleArns = roleArns
+            self.targets = targets
+            self.refreshTiers = refreshTiers or []
+
+            # The targets still scraped keep their state (last good stats, counters, detectors, rate limiter and
+            # circuit breaker), so that only the added ones are scraped right away
+            for target in addedTargets:
+                self.states[target] = self._createTargetState(target)
+
+            for target, state in self.states.items():
+                refreshInterval = self._getTargetRefreshInterval(target)
+
+                # The delay jittered from the previous interval is capped, so that a target moved
+                # to a faster tier is refreshed in time
+                if refreshInterval != state.refreshInterval:
+                    state.refreshInterval = refreshInterval
+                    if state.nextRefreshDelay is not None:
+                        state.nextRefreshDelay = min(state.nextRefreshDelay, refreshInterval)
+
+            # The removed targets being refreshed are torn down once refreshed
+            for target in removedTargets:
+                if target not in self.inFlightTargets:
+                    self._removeTarget(target)
+
+        # Clients are created with the timeouts, so they're created again only when the timeouts change
+        if (connectTimeout, readTimeout) != (self.botoConfig.connect_timeout, self.botoConfig.read_timeout):
+            self.botoConfig = self.botoConfig.merge(botocore.client.Config(connect_timeout=connectTimeout, read_timeout=readTimeout))
+            self._resetClients()
+
+        maxConcurrency = self._getMaxConcurrency(maxConcurrency)
+        if maxConcurrency != self.maxConcurrency:
+            self.maxConcurrency = maxConcurrency
+            self._resizePool()
+
+        logging.getLogger().info(f"Reconfigured the targets: {len(addedTargets)} added, {len(removedTargets)} removed, {len(targets)} scraped")
+
+        # Scrape the added targets (and stop exporting the removed ones) without waiting for the next refresh
+        self.refreshWakeup.set()
+
+    def exportState(self) -> dict:
+        with self.statesLock:
+            return {
+                "savedAt": time.time(),
+                "targets": [{
+                    "accountId": target.accountId,
+                    "roleArn": target.roleArn,
+                    "region": target.region,
+                    "stats": state.stats,
+                    "lastSuccessTime": state.lastSuccessTime,
+                    "lastAttemptTime": state.lastAttemptTime,
+                    "failing": state.failing,
+                    "scrapeErrors": state.scrapeErrors,
+                    "findingsTrackers": {detectorId: tracker.toDict() for detectorId, tracker in state.findingsTrackers.items()},
+                    "detectorIds": state.detectorIds,
+                    "detectorsListedAt": state.detectorsListedAt,
+                    "skipErrorCode": state.skipErrorCode,
+                } for target, state in self.states.items()],
+            }
+
+    def importState(self, data: dict):
+        with self.statesLock:
+            for targetData in data["targets"]:
+                # Skip targets which are not scraped anymore
+                target = Target(targetData["accountId"], targetData["roleArn"], targetData["region"])
+                if target not in self.states:
+                    continue
+
+                state = self.states[target]
+                state.stats = targetData["stats"]
+                state.lastSuccessTime = targetData["lastSuccessTime"]
+                state.lastAttemptTime = targetData["lastAttemptTime"]
+                state.failing = targetData["failing"]
+                state.scrapeErrors = targetData["scrapeErrors"]
+                state.findingsTrackers = {detectorId: FindingsTracker.fromDict(tracker) for detectorId, tracker in targetData["findingsTrackers"].items()}
+                state.detectorIds = targetData.get("detectorIds")
+                state.detectorsListedAt = targetData.get("detectorsListedAt")
+                state.skipErrorCode = targetData.get("skipErrorCode")
+
+    def _collectSingleFlight(self):
+        collects = self.collects
+
+        with self.collectLock:
+            # Share the results of the fan-out completed while waiting, or of a recent one
+            if self.collectedMetrics is not None and (self.collects != collects or time.monotonic() - self.collectedAt < self.minCollectInterval):
+                return self.collectedMetrics
+
+            self.collectedMetrics = self.refresh()
+            self.collectedAt = time.monotonic()
+            self.collects += 1
+
+            return self.collectedMetrics
+
+    def _loadState(self):
+        try:
+            data = self.stateFile.load()
+        except Exception as error:
+            logging.getLogger().warning(f"Unable to load the state from {self.stateFile.filepath} because of error: {str(error)}")
+            return
+
+        if data is None:
+            return
+
+        self.importState(data)
+
+        # Build the snapshot from the restored state, so that it can be served before the first refresh
+        metrics = self._buildMetrics(time.time())
+
+        with self.snapshotLock:
+            self.snapshotMetrics = metrics
+            self.snapshotTimestamp = data["savedAt"]
+
+        logging.getLogger().info(f"Restored the state saved at {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(data['savedAt']))}")
+
+    def _saveState(self, force: bool = False):
+        # Never save the state concurrently, and at most once every stateSaveInterval seconds
+        if not self.stateSaveLock.acquire(blocking=force):
+            return
+
+        try:
+            if not force and self.stateSavedAt is not None and time.monotonic() - self.stateSavedAt < self.stateSaveInterval:
+                return
+
+            self.stateFile.save(self.exportState())
+            self.stateSavedAt = time.monotonic()
+        except Exception as error:
+            logging.getLogger().error(f"Unable to save the state to {self.stateFile.filepath} because of error: {str(error)}")
+        finally:
+            self.stateSaveLock.release()
+
+    def _buildTargets(self, regions: List[str], roleArns: Optional[List[str]] = None) -> List[Target]:
+        targets = [target for target in buildTargets(regions, roleArns) if isAllowed(target.region, self.includeRegions, self.excludeRegions)]
+        return filterShardTargets(targets, self.shardIndex, self.shardsCount)
+
+    def _getMaxConcurrency(self, maxConcurrency: Optional[int]) -> int:
+        return maxConcurrency or max(1, min(len(self.targets), DEFAULT_MAX_CONCURRENCY))
+
+    def _getTargetRefreshInterval(self, target: Target) -> float:
+        return getRefreshInterval(self.refreshTiers, target, max(self.cacheTtl, self.refreshInterval or 0))
+
+    def _createTargetState(self, target: Target) -> TargetState:
+        state = TargetState()
+        state.refreshInterval = self._getTargetRefreshInterval(target)
+        state.circuitBreaker = CircuitBreaker(self.circuitBreakerThreshold, self.circuitBreakerCooldown)
+        state.rateLimiter = TokenBucket(self.rateLimit, self.rateLimitBurst) if self.rateLimit else None
+
+        return state
+
+    def _getRefreshTime(self, state: TargetState) -> float:
+        # The expiration is based on the last attempt, so that a failing target is not hammered on each scrape
+        if state.lastAttemptTime is None:
+            return 0
+
+        return state.lastAttemptTime + (state.nextRefreshDelay if state.nextRefreshDelay is not None else state.refreshInterval)
+
+    def _getNextRefreshTime(self) -> Optional[float]:
+        # The earliest time a target is due to be refreshed (skipping targets with an open circuit breaker)
+        with self.statesLock:
+            return min((max(self._getRefreshTime(state), state.circuitBreaker.openUntil or 0) for target, state in self.states.items() if target not in self.inFlightTargets), default=None)
+
+    def _isExpired(self, state: TargetState, now: float):
+        return now >= self._getRefreshTime(state)
+
+    def _refreshTargets(self, targets: List[Target]):
+        try:
+            results = self._collectTargets(targets)
+            now = time.time()
+
+            with self.statesLock:
+                for target, regionStats in results:
+                    state = self.states[target]
+                    state.lastAttemptTime = now
+                    state.nextRefreshDelay = getNextRefreshDelay(state.refreshInterval, self.refreshJitter, state.nextRefreshDelay is None)
+
+                    if not regionStats:
+                        state.scrapeErrors += 1
+                        state.failing = True
+                        state.circuitBreaker.onFailure(now)
+                    else:
+                        state.stats = regionStats
+                        state.lastSuccessTime = now
+                        state.failing = False
+                        state.circuitBreaker.onSuccess()
+        finally:
+            with self.statesLock:
+                self.inFlightTargets.difference_update(targets)
+
+                # Tear down the targets removed while being refreshed
+                currentTargets = set(self.targets)
+                for target in targets:
+                    if target not in currentTargets:
+                        self._removeTarget(target)
+
+    def _removeTarget(self, target: Target):
+        self.states.pop(target, None)
+        self.clients.removeClient(target.region, target.roleArn)
+        self.instrumentation.removeTarget(target.accountId, target.region)
+
+    def _buildMetrics(self, now: float):
         # Init metrics
         currentFindingsMetric = GaugeMetricFamily(
             "aws_guardduty_current_findings",
             "The current number of unarchived findings",
-            labels=["region", "severity"])
+            labels=["account_id", "region", "severity"])
 
         scrapeErrorsMetric = CounterMetricFamily(
             "aws_guardduty_scrape_errors_total",
             "The total number of scrape errors",
-            labels=["region"])
+            labels=["account_id", "region"])
 
-        results = [self.pool.apply_async(self._collectMetricsByRegion, [region, self.roleArn]) for region in self.regions]
-        for result in results:
-            region, regionStats = result.get()
-            if not regionStats:
-                self.scrapeErrors[region] += 1
-            else:
-                for severity, count in regionStats.items():
-                    currentFindingsMetric.add_metric(value=count, labels=[region, severity])
+        circuitBreakerMetric = GaugeMetricFamily(
+            "aws_guardduty_circuit_breaker_open",
+            "Whether the scraping of a region is temporarily skipped because persistently failing (1) or not (0)",
+            labels=["account_id", "region"])
+
+        lastSuccessMetric = GaugeMetricFamily(
+            "aws_guardduty_last_success_timestamp_seconds",
+            "The timestamp of the latest successful collection of metrics from a region",
+            labels=["account_id", "region"])
+
+        breakdownMetrics = {breakdown: GaugeMetricFamily(
+            f"aws_guardduty_current_findings_by_{breakdown}",
+            f"The current number of unarchived findings by {breakdown.replace('_', ' ')}",
+            labels=["account_id", "region", breakdown]) for breakdown in self.breakdowns}
+
+        newFindingsMetric = CounterMetricFamily(
+            "aws_guardduty_findings_new_total",
+            "The total number of new findings",
+            labels=["account_id", "region", "severity"])
+
+        oldestFindingMetric = GaugeMetricFamily(
+            "aws_guardduty_oldest_unarchived_finding_age_seconds",
+            "The age of the oldest unarchived finding",
+            labels=["account_id", "region"])
+
+        regionsSkippedMetric = GaugeMetricFamily(
+            "aws_guardduty_regions_skipped",
+            "The number of regions skipped because without detectors or not enabled for the account (reason is the error code listing detectors, also returned on invalid credentials)",
+            labels=["account_id", "reason"])
+        regionsSkipped = {}
+
+        statsMetrics = [currentFindingsMetric, newFindingsMetric] + list(breakdownMetrics.values())
+
+        with self.statesLock:
+            for target in self.targets:
+                state = self.states[target]
+
+                # Skip regions without detectors
+                if self.skipRegionsWithoutDetectors and state.detectorIds == []:
+                    key = (target.accountId, state.skipErrorCode or "no_detectors")
+                    regionsSkipped[key] = regionsSkipped.get(key, 0) + 1
+                    continue
+
+                # Evict the last good results once they're too stale
+                if state.stats is not None and state.failing and now - state.lastSuccessTime > self.maxStaleness:
+                    state.stats = None
+
+                if state.stats is not None:
+                    # The samples built from the stats are reused until the target is refreshed
+                    if state.statsSamples is None or state.statsSamples[0] is not state.stats:
+                        state.statsSamples = (state.stats, self._buildStatsSamples(target, state.stats, statsMetrics))
+
+                    for metric in statsMetrics:
+                        metric.samples += state.statsSamples[1][metric.name]
+
+                    if state.stats.get("oldest_unarchived_finding_created_at") is not None:
+                        oldestFindingMetric.add_metric(value=max(0, now - state.stats["oldest_unarchived_finding_created_at"]), labels=[target.accountId, target.region])
+
+                scrapeErrorsMetric.add_metric(value=state.scrapeErrors, labels=[target.accountId, target.region])
+
+                if state.lastSuccessTime is not None:
+                    lastSuccessMetric.add_metric(value=state.lastSuccessTime, labels=[target.accountId, target.region])
+
+                circuitBreakerMetric.add_metric(value=1 if state.circuitBreaker.isOpen(now) else 0, labels=[target.accountId, target.region])
+
+        metrics = [currentFindingsMetric, scrapeErrorsMetric, lastSuccessMetric, circuitBreakerMetric] + list(breakdownMetrics.values())
+
+        if self.trackFindings:
+            metrics += [newFindingsMetric, oldestFindingMetric]
+
+        if self.skipRegionsWithoutDetectors:
+            for (accountId, reason), count in sorted(regionsSkipped.items()):
+                regionsSkippedMetric.add_metric(value=count, labels=[accountId, reason])
+
+            metrics.append(regionsSkippedMetric)
+
+        self.droppedSeries = applySeriesBudget(metrics, self.maxSeriesPerMetric)
+
+        return metrics
+
+    def _buildStatsSamples(self, target: Target, stats: dict, statsMetrics: list):
+        currentFindingsMetric, newFindingsMetric = statsMetrics[:2]
+        samples = {metric.name: [] for metric in statsMetrics}
+
+        for severity in self.severities:
+            labels = {"account_id": target.accountId, "region": target.region, "severity": severity}
+
+            if severity in stats["severity"]:
+                samples[currentFindingsMetric.name].append(buildSample(currentFindingsMetric, labels, stats["severity"][severity]))
+
+            if severity in stats.get("new_findings", {}):
+                samples[newFindingsMetric.name].append(buildSample(newFindingsMetric, labels, stats["new_findings"][severity]))
+
+        for breakdownMetric, breakdown in zip(statsMetrics[2:], self.breakdowns):
+            for value, count in stats.get(breakdown, {}).items():
+                samples[breakdownMetric.name].append(buildSample(breakdownMetric, {"account_id": target.accountId, "region": target.region, breakdown: value}, count))
 
-            scrapeErrorsMetric.add_metric(value=self.scrapeErrors[region], labels=[region])
+        return samples
 
-        return [currentFindingsMetric, scrapeErrorsMetric]
+    def _createPool(self):
+        return Pool(self.maxConcurrency)
 
-    def _collectMetricsByRegion(self, region, roleToAssumeArn=None):
-        botoConfig = botocore.client.Config(connect_timeout=2, read_timeout=10, retries={"max_attempts": 2})
+    def _resizePool(self):
+        # The tasks already submitted to the previous pool are completed before its threads exit
+        with self.poolLock:
+            pool = self.pool
+            self.pool = self._createPool()
 
-        if roleToAssumeArn is not None:
-            assumeRoleResponse = boto3.client('sts', config=botoConfig, region_name=region).assume_role(
-                RoleArn=roleToAssumeArn,
-                RoleSessionName="GuardDutyExporter",
-                DurationSeconds=900
-            )
-            session = boto3.session.Session(
-                aws_access_key_id=assumeRoleResponse['Credentials']['AccessKeyId'],
-                aws_secret_access_key=assumeRoleResponse['Credentials']['SecretAccessKey'],
-                aws_session_token=assumeRoleResponse['Credentials']['SessionToken']
-            )
-        else:
-            session = boto3.session.Session()
+        pool.close()
 
-        client = session.client("guardduty", config=botoConfig, region_name=region)
-        regionStats = {"low": 0, "medium": 0, "high": 0}
+    def _resetClients(self):
+        clients = GuardDutyClientsCache(self.botoConfig, self.endpointUrl, self.instrumentation)
+        clients.dataLoader = self.clients.dataLoader
+        clients, self.clients = self.clients, clients
+
+        # Release the connection pools of the previous clients
+        clients.close()
+
+    def _collectTargets(self, targets: List[Target]):
+        with self.poolLock:
+            results = [self.pool.apply_async(self._collectMetricsByTarget, [target]) for target in targets]
+
+        return [result.get() for result in results]
+
+    def _refreshLoop(self):
+        while not self.refreshShutdown.is_set():
+            startTime = time.monotonic()
+
+            try:
+                self.refresh()
+            except Exception as error:
+                logging.getLogger().error(f"Unable to refresh GuardDuty metrics because of error: {str(error)}")
+
+            # Wait until the next target is due to be refreshed (or shutdown)
+            nextRefreshTime = self._getNextRefreshTime()
+            wait = self.refreshInterval - (time.monotonic() - startTime) if nextRefreshTime is None else nextRefreshTime - time.time()
+            self.refreshWakeup.wait(max(MIN_REFRESH_WAIT, wait))
+            self.refreshWakeup.clear()
+
+    def _collectMetricsByTarget(self, target: Target):
+        startTime = time.monotonic()
+        region = target.region
+        regionStats = newRegionStats(self.breakdowns)
 
         try:
+            # Regions known to have no detectors don't even require a client
+            detectorIds = self._getCachedDetectorIds(target)
+            client = self.clients.getClient(region, target.roleArn) if detectorIds != [] else None
+
             # List GuardDuty detectors
-            detectorIds = client.list_detectors()["DetectorIds"]
+            if detectorIds is None:
+                try:
+                    detectorIds = self._callApi(target, client.list_detectors)["DetectorIds"]
+                except Exception as error:
+                    detectorIds = self._onListDetectorsError(target, error)
+                else:
+                    self._cacheDetectorIds(target, detectorIds)
 
             # Get statistics
+            totalFindings = {}
+
             for detectorId in detectorIds:
-                countBySeverity = client.get_findings_statistics(
+                countBySeverity = self._callApi(
+                    target,
+                    client.get_findings_statistics,
                     DetectorId=detectorId,
-                    FindingCriteria={"Criterion": {"service.archived": {"Eq": ["false"]}}},
+                    FindingCriteria=CURRENT_FINDINGS_CRITERIA,
                     FindingStatisticTypes=["COUNT_BY_SEVERITY"])["FindingStatistics"]["CountBySeverity"]
 
-                for severity, count in countBySeverity.items():
-                    severity = float(severity)
+                addCountBySeverity(regionStats, countBySeverity)
+                totalFindings[detectorId] = sum(countBySeverity.values())
+
+                # Get grouped statistics, with a single call for each breakdown
+                for breakdown in self.groupedBreakdowns:
+                    findingStatistics = self._callApi(
+                        target,
+                        client.get_findings_statistics,
+                        **self._getGroupedStatisticsParams(detectorId, breakdown))["FindingStatistics"]
 
-                    # Group severity levels into low, medium and high according to this doc:
-                    # https://docs.aws.amazon.com/guardduty/latest/ug/guardduty_findings.html#guardduty_findings-severity
-                    if severity < 4:
-                        regionStats["low"] += count
-                    elif severity < 7:
-                        regionStats["medium"] += count
+                    addGroupedStatistics(regionStats, breakdown, findingStatistics, totalFindings[detectorId])
+
+            self._limitCardinality(regionStats)
+
+            # Fetch the findings updated since the previous poll
+            if self.trackFindings:
+                for detectorId in detectorIds:
+                    # Tracking errors don't prevent exporting the statistics
+                    try:
+                        self._pollFindings(target, client, detectorId)
+                    except Exception as error:
+                        self._logTrackingError(target, detectorId, error)
                     else:
-                        regionStats["high"] += count
+                        self._reconcileFindings(target, detectorId, totalFindings[detectorId])
+
+                addFindingsTracking(regionStats, self._getFindingsTrackers(target, detectorIds))
         except Exception as error:
-            logging.getLogger().error(f"Unable to scrape GuardDuty statistics from {region} because of error: {str(error)}")
+            self._invalidateDetectorIds(target, error)
+            self._logTargetError(target, error)
 
             # We return False on error so we can increase the errors_total metric
             regionStats = False
 
-        return (region, regionStats)
+        self.instrumentation.observeTarget(target.accountId, target.region, time.monotonic() - startTime)
+
+        return (target, regionStats)
+
+    def _getCachedDetectorIds(self, target: Target) -> Optional[List[str]]:
+        state = self.states[target]
+
+        # Regions without detectors are dropped from the polling set even if detectors are not cached
+        cacheTtl = max(self.detectorCacheTtl, NO_DETECTORS_CACHE_TTL) if self.skipRegionsWithoutDetectors and state.detectorIds == [] else self.detectorCacheTtl
+
+        if cacheTtl > 0 and state.detectorIds is not None and time.time() - state.detectorsListedAt < cacheTtl:
+            return state.detectorIds
+
+        return None
+
+    def _cacheDetectorIds(self, target: Target, detectorIds: List[str], skipErrorCode: Optional[str] = None):
+        state = self.states[target]
+        state.detectorIds = detectorIds
+        state.detectorsListedAt = time.time()
+        state.skipErrorCode = skipErrorCode
+
+    def _invalidateDetectorIds(self, target: Target, error: Exception):
+        # A cached detector has been deleted: detectors are listed again on the next refresh
+        if isDetectorNotFoundError(error):
+            self.states[target].detectorIds = None
+
+    def _onListDetectorsError(self, target: Target, error: Exception) -> List[str]:
+        # A region not enabled for the account has no detectors, but the same error codes are returned on invalid credentials
+        if self.skipRegionsWithoutDetectors and isRegionDisabledError(error):
+            logging.getLogger().warning(f"Skipping GuardDuty region {target.region} (account: {target.accountId or 'default'}) because listing detectors failed with error code {getErrorCode(error)}: either the region is not enabled for the account or the credentials are invalid")
+            self._cacheDetectorIds(target, [], getErrorCode(error))
+            return []
+
+        raise error
+
+    def _getFindingsTrackers(self, target: Target, detectorIds: List[str]):
+        trackers = self.states[target].findingsTrackers
+        return [trackers.setdefault(detectorId, FindingsTracker()) for detectorId in detectorIds]
+
+    def _pollFindings(self, target: Target, client, detectorId: str):
+        tracker = self._getFindingsTrackers(target, [detectorId])[0]
+        pollStartTime = time.time()
+        params = tracker.getListFindingsParams(detectorId)
+
+        while True:
+            response = self._callApi(target, client.list_findings, **params)
+            findings = []
+
+            if response["FindingIds"]:
+                findings = self._callApi(target, client.get_findings, DetectorId=detectorId, FindingIds=response["FindingIds"])["Findings"]
+
+            # The tracker is updated page by page, so that a failed poll is resumed where it stopped
+            nextToken = response.get("NextToken")
+            tracker.update(findings, pollStartTime, complete=not nextToken)
+
+            if not nextToken:
+                break
+
+            # The following pages must be listed with the same criteria
+            params = dict(params, NextToken=nextToken)
+
+    def _reconcileFindings(self, target: Target, detectorId: str, unarchivedCount: int):
+        self._getFindingsTrackers(target, [detectorId])[0].reconcile(unarchivedCount)
+
+    def _getGroupedStatisticsParams(self, detectorId: str, breakdown: str):
+        return {
+            "DetectorId": detectorId,
+            "FindingCriteria": CURRENT_FINDINGS_CRITERIA,
+            "GroupBy": GROUPED_BREAKDOWNS[breakdown].groupBy,
+            "OrderBy": "DESC",
+            "MaxResults": MAX_GROUPS,
+        }
+
+    def _limitCardinality(self, regionStats: dict):
+        for breakdown in self.breakdowns:
+            regionStats[breakdown] = limitCardinality(regionStats[breakdown], self.breakdownLimit)
+
+    def _callApi(self, target: Target, operation, **kwargs):
+        rateLimiter = self.states[target].rateLimiter
+        if rateLimiter is None:
+            return operation(**kwargs)
+
+        rateLimiter.acquire()
+
+        try:
+            response = operation(**kwargs)
+        except Exception as error:
+            # Slow down on throttling
+            if isThrottlingError(error):
+                rateLimiter.onThrottled()
+            raise
+
+        rateLimiter.onSuccess()
+        return response
+
+    def _logTargetError(self, target: Target, error: Exception):
+        logging.getLogger().error(f"Unable to scrape GuardDuty statistics from {target.region} (account: {target.accountId or 'default'}) because of error: {str(error)}")
+
+    def _logTrackingError(self, target: Target, detectorId: str, error: Exception):
+        logging.getLogger().error(f"Unable to track GuardDuty findings of detector {detectorId} from {target.region} (account: {target.accountId or 'default'}) because of error: {str(error)}")
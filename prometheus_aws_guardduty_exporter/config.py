@@ -0,0 +1,89 @@
+import os
+from typing import Optional
+from .scheduling import RefreshTier, parseRefreshTier
+
+# The settings which can be set in the config file (and reloaded without restarting), mapped
+# to the collector arguments. Settings missing in the config file default to the command line ones.
+CONFIG_KEYS = {
+    "regions": "regions",
+    "role_arns": "roleArns",
+    "refresh_tiers": "refreshTiers",
+    "max_concurrency": "maxConcurrency",
+    "connect_timeout": "connectTimeout",
+    "read_timeout": "readTimeout",
+}
+
+
+def parseRefreshTierConfig(value) -> RefreshTier:
+    # Tiers are either in the --refresh-tier format or mappings of interval and patterns
+    if isinstance(value, dict):
+        if "interval" not in value or not value.get("patterns"):
+            raise ValueError(f"Invalid refresh tier {value}: expected interval and patterns")
+
+        return RefreshTier(float(value["interval"]), [str(pattern) for pattern in value["patterns"]])
+
+    return parseRefreshTier(str(value))
+
+
+def parseStringsConfig(key: str, value) -> list:
+    if not isinstance(value, list) or not all(isinstance(item, str) for item in value):
+        raise ValueError(f"Invalid config {key}: expected a list of strings")
+
+    return value
+
+
+def parseConfig(data: Optional[dict]) -> dict:
+    # An empty config file sets nothing
+    if data is None:
+        return {}
+
+    if not isinstance(data, dict):
+        raise ValueError("Invalid config: expected a mapping of settings")
+
+    unknownKeys = sorted(set(data) - set(CONFIG_KEYS))
+    if unknownKeys:
+        raise ValueError(f"Unknown config settings: {', '.join(unknownKeys)}")
+
+    config = {}
+
+    if "regions" in data:
+        config["regions"] = parseStringsConfig("regions", data["regions"])
+
+    if "role_arns" in data:
+        config["roleArns"] = parseStringsConfig("role_arns", data["role_arns"] or []) or None
+
+    if "refresh_tiers" in data:
+        config["refreshTiers"] = [parseRefreshTierConfig(tier) for tier in data["refresh_tiers"] or []]
+
+    if "max_concurrency" in data:
+        config["maxConcurrency"] = int(data["max_concurrency"]) if data["max_concurrency"] is not None else None
+
+    for key in ["connect_timeout", "read_timeout"]:
+        if key in data:
+            config[CONFIG_KEYS[key]] = float(data[key])
+
+    return config
+
+
+class ConfigFile():
+    def __init__(self, filepath: str):
+        self.filepath = filepath
+        self.loadedMtime = None
+
+    def hasChanged(self) -> bool:
+        try:
+            return os.stat(self.filepath).st_mtime_ns != self.loadedMtime
+        except OSError:
+            # The file is being replaced (or has been removed): keep the current config
+            return False
+
+    def load(self) -> dict:
+        # Imported lazily, so that PyYAML is loaded only when a config file is used
+        import yaml
+
+        # The modification time is tracked even if the config is invalid, so that it's loaded
+        # again only once changed
+        self.loadedMtime = os.stat(self.filepath).st_mtime_ns
+
+        with open(self.filepath) as file:
+            return parseConfig(yaml.safe_load(file))
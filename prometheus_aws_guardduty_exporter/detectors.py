@@ -0,0 +1,45 @@
+import gzip
+import importlib.util
+import json
+import os
+from typing import List
+
+# The error codes returned by GuardDuty when a (cached) detector doesn't exist anymore
+DETECTOR_NOT_FOUND_ERROR_CODES = {"BadRequestException", "ResourceNotFoundException"}
+
+# The error codes returned by AWS APIs when calling a region not enabled for the account (ie. opt-in regions)
+REGION_DISABLED_ERROR_CODES = {"UnrecognizedClientException", "InvalidClientTokenId", "AuthFailure"}
+
+
+def getErrorCode(error: Exception) -> str:
+    response = getattr(error, "response", None) or {}
+    return response.get("Error", {}).get("Code")
+
+
+def isDetectorNotFoundError(error: Exception) -> bool:
+    return getErrorCode(error) in DETECTOR_NOT_FOUND_ERROR_CODES
+
+
+def isRegionDisabledError(error: Exception) -> bool:
+    return getErrorCode(error) in REGION_DISABLED_ERROR_CODES
+
+
+def discoverRegions(partition: str = "aws") -> List[str]:
+    # The regions where GuardDuty is available, according to the endpoints shipped with botocore (no API call).
+    # The endpoints data is read without importing botocore, so that it's loaded only by processes calling AWS APIs.
+    dataDir = os.path.join(importlib.util.find_spec("botocore").submodule_search_locations[0], "data")
+
+    if os.path.exists(os.path.join(dataDir, "endpoints.json")):
+        with open(os.path.join(dataDir, "endpoints.json"), "rb") as file:
+            endpoints = json.load(file)
+    else:
+        with gzip.open(os.path.join(dataDir, "endpoints.json.gz"), "rb") as file:
+            endpoints = json.load(file)
+
+    # Only the regional endpoints, like boto3 Session.get_available_regions()
+    for partitionData in endpoints["partitions"]:
+        if partitionData["partition"] == partition:
+            serviceEndpoints = partitionData["services"].get("guardduty", {}).get("endpoints", {})
+            return [region for region in serviceEndpoints if region in partitionData["regions"]]
+
+    return []
@@ -0,0 +1,131 @@
+import gzip
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import NamedTuple
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from prometheus_client.openmetrics.exposition import CONTENT_TYPE_LATEST as OPENMETRICS_CONTENT_TYPE_LATEST
+from prometheus_client.openmetrics.exposition import generate_latest as generate_latest_openmetrics
+
+# A lower compression level than the default (9) is way faster while compressing metrics about the same
+GZIP_COMPRESS_LEVEL = 6
+
+OPENMETRICS_EOF = b"# EOF\n"
+
+
+class MetricsPayload(NamedTuple):
+    text: bytes
+    textGzip: bytes
+    openMetrics: bytes
+    openMetricsGzip: bytes
+
+
+class CollectedMetrics():
+    # A registry-like wrapper of already collected metrics, so that they can be
+    # serialized to multiple formats while collecting them only once
+    def __init__(self, metrics: list):
+        self.metrics = metrics
+
+    def collect(self):
+        return self.metrics
+
+
+class CachedExposition():
+    def __init__(self, registry, collector):
+        self.registry = registry
+        self.collector = collector
+        self.payload = None
+        self.payloadKey = None
+        self.payloadNames = set()
+        self.renders = 0
+        self.renderLock = threading.Lock()
+
+    def getPayload(self) -> MetricsPayload:
+        if self.collector.refreshInterval is None:
+            return self._getSharedPayload(None, lambda: list(self.registry.collect()), eof=True)[0]
+
+        # When refreshing in background, the snapshot is rendered once per refresh, while the other metrics
+        # (ie. the snapshot age, the instrumentation and the process metrics) are rendered on each scrape
+        snapshot, snapshotNames = self._getSharedPayload(self.collector.snapshotTimestamp, self.collector.collectSnapshot, eof=False)
+        runtime = self._render([metric for metric in self.registry.collect() if metric.name not in snapshotNames], eof=True)
+
+        # Gzip members can be concatenated too
+        return MetricsPayload(*[snapshotPart + runtimePart for snapshotPart, runtimePart in zip(snapshot, runtime)])
+
+    def _getSharedPayload(self, key, collect, eof: bool):
+        renders = self.renders
+
+        with self.renderLock:
+            # Scrapes waiting for an in-flight render share its payload (coalescing)
+            if self.payload is not None and (self.renders != renders or (key is not None and key == self.payloadKey)):
+                return self.payload, self.payloadNames
+
+            metrics = collect()
+            self.payload = self._render(metrics, eof)
+            self.payloadKey = key
+            self.payloadNames = {metric.name for metric in metrics}
+            self.renders += 1
+
+            return self.payload, self.payloadNames
+
+    def _render(self, metrics: list, eof: bool) -> MetricsPayload:
+        metrics = CollectedMetrics(metrics)
+        text = generate_latest(metrics)
+        openMetrics = generate_latest_openmetrics(metrics)
+
+        # The OpenMetrics EOF marker must only end the whole payload
+        if not eof:
+            openMetrics = openMetrics[:-len(OPENMETRICS_EOF)]
+
+        return MetricsPayload(
+            text=text,
+            textGzip=gzip.compress(text, compresslevel=GZIP_COMPRESS_LEVEL),
+            openMetrics=openMetrics,
+            openMetricsGzip=gzip.compress(openMetrics, compresslevel=GZIP_COMPRESS_LEVEL))
+
+
+class CachedMetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == "/favicon.ico":
+            self.send_response(404)
+            self.end_headers()
+            return
+
+        payload = self.server.exposition.getPayload()
+        accept = [value.split(";")[0].strip() for value in self.headers.get("Accept", "").split(",")]
+        acceptEncoding = [value.split(";")[0].strip() for value in self.headers.get("Accept-Encoding", "").split(",")]
+        openMetrics = "application/openmetrics-text" in accept
+        compressed = "gzip" in acceptEncoding
+
+        if openMetrics:
+            body = payload.openMetricsGzip if compressed else payload.openMetrics
+        else:
+            body = payload.textGzip if compressed else payload.text
+
+        self.send_response(200)
+        self.send_header("Content-Type", OPENMETRICS_CONTENT_TYPE_LATEST if openMetrics else CONTENT_TYPE_LATEST)
+        self.send_header("Content-Length", str(len(body)))
+        if compressed:
+            self.send_header("Content-Encoding", "gzip")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class CachedMetricsServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    # Concurrent scrapes shouldn't be dropped by a short listen backlog
+    request_queue_size = 128
+
+    def __init__(self, address, exposition: CachedExposition):
+        self.exposition = exposition
+        super().__init__(address, CachedMetricsHandler)
+
+
+def startCachedMetricsServer(exposition: CachedExposition, port: int, host: str = "") -> CachedMetricsServer:
+    server = CachedMetricsServer((host, port), exposition)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+
+    return server
@@ -0,0 +1,186 @@
+import datetime
+import threading
+from typing import List, NamedTuple, Optional
+
+# The max number of findings returned by ListFindings and GetFindings on each call
+FINDINGS_PAGE_SIZE = 50
+
+# The initial watermark is moved back by a safety margin, to tolerate a clock skew with AWS
+WATERMARK_CLOCK_SKEW = 60
+
+# The number of consecutive refreshes the indexed findings must differ from the actual number of unarchived
+# ones before syncing again, so that findings created between the statistics call and the poll are tolerated
+RECONCILE_MAX_MISMATCHES = 2
+
+
+def getSeverityBucket(severity: float) -> str:
+    # Group severity levels into low, medium and high according to this doc:
+    # https://docs.aws.amazon.com/guardduty/latest/ug/guardduty_findings.html#guardduty_findings-severity
+    if severity < 4:
+        return "low"
+    elif severity < 7:
+        return "medium"
+    else:
+        return "high"
+
+
+def parseTimestamp(value: str) -> float:
+    return datetime.datetime.fromisoformat(value).timestamp()
+
+
+class IndexedFinding(NamedTuple):
+    severity: float
+    type: str
+    archived: bool
+    createdAt: float
+
+
+class FindingsTracker():
+    def __init__(self):
+        # The updatedAt (in milliseconds) of the most recently updated finding: only findings
+        # updated since the watermark are fetched, so that the cost is proportional to the churn
+        self.watermark = None
+        self.findings = {}
+        self.newFindings = {"low": 0, "medium": 0, "high": 0}
+        self.mismatches = 0
+        self.lock = threading.Lock()
+
+        # The progress of the (initial or re-) sync, which can span multiple polls: the findings fetched
+        # so far, the updatedAt (in milliseconds) of the most recently updated one and the sync start time
+        self.syncFindings = {}
+        self.syncWatermark = None
+        self.syncStartedAt = None
+
+    def getListFindingsParams(self, detectorId: str, nextToken: Optional[str] = None) -> dict:
+        if self.watermark is None:
+            # The initial sync only fetches current (unarchived) findings, resuming from the last fetched page
+            criterion = {"service.archived": {"Eq": ["false"]}}
+            if self.syncWatermark is not None:
+                criterion["updatedAt"] = {"GreaterThanOrEqual": self.syncWatermark}
+        else:
+            # Archived findings are fetched too, to keep track of them
+            criterion = {"updatedAt": {"GreaterThanOrEqual": self.watermark}}
+
+        params = {
+            "DetectorId": detectorId,
+            "FindingCriteria": {"Criterion": criterion},
+            "SortCriteria": {"AttributeName": "updatedAt", "OrderBy": "ASC"},
+            "MaxResults": FINDINGS_PAGE_SIZE,
+        }
+
+        if nextToken:
+            params["NextToken"] = nextToken
+
+        return params
+
+    def update(self, findings: List[dict], pollStartTime: float, complete: bool = True):
+        # Each page of findings is applied as soon as fetched (findings are sorted by updatedAt), so that a failed
+        # poll is resumed where it stopped, while complete is set on the last page
+        with self.lock:
+            if self.watermark is None:
+                self._updateSync(findings, pollStartTime, complete)
+                return
+
+            for finding in findings:
+                indexed = self._indexFinding(finding)
+
+                # Only unarchived findings are indexed
+                if indexed.archived:
+                    self.findings.pop(finding["Id"], None)
+                else:
+                    if finding["Id"] not in self.findings:
+                        self.newFindings[getSeverityBucket(indexed.severity)] += 1
+
+                    self.findings[finding["Id"]] = indexed
+
+                self.watermark = max(self.watermark, int(parseTimestamp(finding["UpdatedAt"]) * 1000))
+
+    def reconcile(self, unarchivedCount: int):
+        # Findings deleted by GuardDuty (ie. once the retention period expires) are never fetched again: when the
+        # number of indexed findings persistently differs from the actual number of unarchived ones, the next
+        # poll syncs again
+        with self.lock:
+            if self.watermark is None:
+                return
+
+            self.mismatches = self.mismatches + 1 if len(self.findings) != unarchivedCount else 0
+
+            if self.mismatches >= RECONCILE_MAX_MISMATCHES:
+                self.watermark = None
+                self.mismatches = 0
+
+    def _updateSync(self, findings: List[dict], pollStartTime: float, complete: bool):
+        if self.syncStartedAt is None:
+            self.syncStartedAt = pollStartTime
+
+        for finding in findings:
+            self.syncFindings[finding["Id"]] = self._indexFinding(finding)
+            self.syncWatermark = max(self.syncWatermark or 0, int(parseTimestamp(finding["UpdatedAt"]) * 1000))
+
+        if not complete:
+            return
+
+        # A resync builds the index again from scratch, counting as new the findings missing from
+        # the previous index (but on the very first sync, where all the findings are already there)
+        if self.findings:
+            for findingId, finding in self.syncFindings.items():
+                if findingId not in self.findings:
+                    self.newFindings[getSeverityBucket(finding.severity)] += 1
+
+        # Once synced, the watermark is moved at least to the sync start time, so that
+        # archived findings are never fetched in full
+        self.findings = self.syncFindings
+        self.watermark = max(int((self.syncStartedAt - WATERMARK_CLOCK_SKEW) * 1000), self.syncWatermark or 0)
+        self.syncFindings = {}
+        self.syncWatermark = None
+        self.syncStartedAt = None
+
+    def _indexFinding(self, finding: dict) -> IndexedFinding:
+        return IndexedFinding(
+            severity=float(finding["Severity"]),
+            type=finding["Type"],
+            archived=bool(finding.get("Service", {}).get("Archived", False)),
+            createdAt=parseTimestamp(finding["CreatedAt"]))
+
+    def getOldestUnarchivedCreatedAt(self) -> Optional[float]:
+        with self.lock:
+            return min((finding.createdAt for finding in self.findings.values()), default=None)
+
+    def toDict(self) -> dict:
+        # Findings are stored as lists to keep the state compact
+        with self.lock:
+            return {
+                "watermark": self.watermark,
+                "newFindings": dict(self.newFindings),
+                "findings": {findingId: list(finding) for findingId, finding in self.findings.items()},
+                "syncFindings": {findingId: list(finding) for findingId, finding in self.syncFindings.items()},
+                "syncWatermark": self.syncWatermark,
+                "syncStartedAt": self.syncStartedAt,
+            }
+
+    @classmethod
+    def fromDict(cls, data: dict) -> "FindingsTracker":
+        tracker = cls()
+        tracker.watermark = data["watermark"]
+        tracker.newFindings.update(data["newFindings"])
+
+        # Skip the archived findings indexed by previous versions
+        tracker.findings = {findingId: IndexedFinding(*finding) for findingId, finding in data["findings"].items() if not finding[2]}
+        tracker.syncFindings = {findingId: IndexedFinding(*finding) for findingId, finding in data.get("syncFindings", {}).items()}
+        tracker.syncWatermark = data.get("syncWatermark")
+        tracker.syncStartedAt = data.get("syncStartedAt")
+
+        return tracker
+
+
+def addFindingsTracking(regionStats: dict, trackers: List[FindingsTracker]):
+    newFindings = {"low": 0, "medium": 0, "high": 0}
+    for tracker in trackers:
+        for severity, count in tracker.newFindings.items():
+            newFindings[severity] += count
+
+    oldestCreatedAt = [tracker.getOldestUnarchivedCreatedAt() for tracker in trackers]
+    oldestCreatedAt = [createdAt for createdAt in oldestCreatedAt if createdAt is not None]
+
+    regionStats["new_findings"] = newFindings
+    regionStats["oldest_unarchived_finding_created_at"] = min(oldestCreatedAt, default=None)
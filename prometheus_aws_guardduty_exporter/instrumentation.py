@@ -0,0 +1,113 @@
+import time
+from prometheus_client import Counter, Gauge, Histogram
+from prometheus_client.core import GaugeMetricFamily
+from .ratelimit import THROTTLING_ERROR_CODES
+
+# The context key used to track the start time of an API call
+START_TIME_CONTEXT_KEY = "guarddutyExporterStartTime"
+
+# The name of the metric exporting the age of the metrics snapshot
+SNAPSHOT_AGE_METRIC = "aws_guardduty_snapshot_age_seconds"
+
+
+def buildSnapshotAgeMetric(timestamp: float) -> GaugeMetricFamily:
+    snapshotAgeMetric = GaugeMetricFamily(
+        SNAPSHOT_AGE_METRIC,
+        "The number of seconds since the metrics snapshot has been refreshed")
+    snapshotAgeMetric.add_metric(value=max(0, time.time() - timestamp), labels=[])
+
+    return snapshotAgeMetric
+
+
+class CollectorInstrumentation():
+    def __init__(self):
+        # Metrics are not registered to the global registry, because they're exported by the collector
+        self.collectDurationMetric = Gauge(
+            "aws_guardduty_collect_duration_seconds",
+            "The duration of the latest collection of metrics from all regions",
+            registry=None)
+
+        self.targetDurationMetric = Histogram(
+            "aws_guardduty_region_collect_duration_seconds",
+            "The duration of the collection of metrics from a single region",
+            labelnames=["account_id", "region"],
+            buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+            registry=None)
+
+        self.apiCallDurationMetric = Histogram(
+            "aws_guardduty_api_call_duration_seconds",
+            "The duration of AWS API calls, including retries",
+            labelnames=["operation"],
+            buckets=(0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+            registry=None)
+
+        self.apiCallsMetric = Counter(
+            "aws_guardduty_api_calls_total",
+            "The total number of AWS API calls, by outcome (success, error or throttled)",
+            labelnames=["operation", "outcome"],
+            registry=None)
+
+        self.apiRetriesMetric = Counter(
+            "aws_guardduty_api_retries_total",
+            "The total number of AWS API calls retried by botocore",
+            labelnames=["operation"],
+            registry=None)
+
+    def instrumentClient(self, client):
+        # The unique ID guarantees each handler is registered once, even if the same client is instrumented twice
+        uniqueId = f"guardduty-exporter-{id(self)}"
+        client.meta.events.register("before-parameter-build", self._onBeforeCall, unique_id=f"{uniqueId}-before-call")
+        client.meta.events.register("after-call", self._onAfterCall, unique_id=f"{uniqueId}-after-call")
+        client.meta.events.register("after-call-error", self._onAfterCallError, unique_id=f"{uniqueId}-after-call-error")
+
+    def observeCollect(self, duration: float):
+        self.collectDurationMetric.set(duration)
+
+    def observeTarget(self, accountId: str, region: str, duration: float):
+        self.targetDurationMetric.labels(accountId, region).observe(duration)
+
+    def removeTarget(self, accountId: str, region: str):
+        # The target may have never been collected (older prometheus_client versions raise on unknown labels)
+        try:
+            self.targetDurationMetric.remove(accountId, region)
+        except KeyError:
+            pass
+
+    def collect(self):
+        metrics = []
+
+        for metric in [self.collectDurationMetric, self.targetDurationMetric, self.apiCallDurationMetric, self.apiCallsMetric, self.apiRetriesMetric]:
+            metrics += metric.collect()
+
+        return metrics
+
+    def _onBeforeCall(self, context=None, **kwargs):
+        if context is not None:
+            context[START_TIME_CONTEXT_KEY] = time.monotonic()
+
+    def _onAfterCall(self, event_name, http_response, parsed, context=None, **kwargs):
+        operation = event_name.split(".")[-1]
+        errorCode = parsed.get("Error", {}).get("Code")
+
+        if http_response.status_code < 300:
+            outcome = "success"
+        elif errorCode in THROTTLING_ERROR_CODES:
+            outcome = "throttled"
+        else:
+            outcome = "error"
+
+        self._observeCall(operation, outcome, context)
+
+        retries = parsed.get("ResponseMetadata", {}).get("RetryAttempts", 0)
+        if retries:
+            self.apiRetriesMetric.labels(operation).inc(retries)
+
+    def _onAfterCallError(self, event_name, context=None, **kwargs):
+        self._observeCall(event_name.split(".")[-1], "error", context)
+
+    def _observeCall(self, operation: str, outcome: str, context=None):
+        self.apiCallsMetric.labels(operation, outcome).inc()
+
+        startTime = (context or {}).get(START_TIME_CONTEXT_KEY)
+        if startTime is not None:
+            self.apiCallDurationMetric.labels(operation).observe(time.monotonic() - startTime)
@@ -0,0 +1,114 @@
+import struct
+import time
+import urllib.request
+from typing import Dict, List, Optional
+from prometheus_client import push_to_gateway
+from .exposition import CollectedMetrics
+
+# python-snappy is an optional dependency: without it, payloads are snappy-encoded
+# uncompressed (as literals), which any snappy decoder accepts
+try:
+    import snappy
+except ImportError:
+    snappy = None
+
+# The max length of a snappy literal encoded by encodeSnappy()
+SNAPPY_MAX_LITERAL_LENGTH = 65536
+
+
+def encodeVarint(value: int) -> bytes:
+    encoded = bytearray()
+
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+
+        if value:
+            encoded.append(byte | 0x80)
+        else:
+            encoded.append(byte)
+            return bytes(encoded)
+
+
+def encodeProtobufField(fieldNumber: int, payload: bytes) -> bytes:
+    # Length-delimited field (wire type 2)
+    return encodeVarint(fieldNumber << 3 | 2) + encodeVarint(len(payload)) + payload
+
+
+def encodeWriteRequest(timeseries: List[tuple]) -> bytes:
+    # Encode a remote write WriteRequest protobuf message, where each time series is a
+    # tuple of (labels, value, timestamp in milliseconds)
+    request = bytearray()
+
+    for labels, value, timestamp in timeseries:
+        encoded = bytearray()
+
+        # Labels must be sorted by name
+        for name, labelValue in sorted(labels.items()):
+            encoded += encodeProtobufField(1, encodeProtobufField(1, name.encode("utf-8")) + encodeProtobufField(2, labelValue.encode("utf-8")))
+
+        # The sample value is a double (wire type 1) and the timestamp an int64 (wire type 0)
+        sample = b"\x09" + struct.pack("<d", value) + b"\x10" + encodeVarint(timestamp)
+        encoded += encodeProtobufField(2, sample)
+
+        request += encodeProtobufField(1, bytes(encoded))
+
+    return bytes(request)
+
+
+def encodeSnappy(payload: bytes) -> bytes:
+    if snappy is not None:
+        return snappy.compress(payload)
+
+    # Snappy block format: the uncompressed length followed by literals only
+    encoded = bytearray(encodeVarint(len(payload)))
+
+    for offset in range(0, len(payload), SNAPPY_MAX_LITERAL_LENGTH):
+        chunk = payload[offset:offset + SNAPPY_MAX_LITERAL_LENGTH]
+        length = len(chunk) - 1
+
+        if length < 60:
+            encoded.append(length << 2)
+        elif length < 256:
+            encoded += bytes([60 << 2, length])
+        else:
+            encoded += bytes([61 << 2]) + struct.pack("<H", length)
+
+        encoded += chunk
+
+    return bytes(encoded)
+
+
+def buildTimeseries(metrics: list, extraLabels: Dict[str, str], timestamp: Optional[float] = None) -> List[tuple]:
+    timestampMs = int((timestamp if timestamp is not None else time.time()) * 1000)
+    timeseries = []
+
+    for metric in metrics:
+        for sample in metric.samples:
+            # Empty labels are equivalent to missing ones, and rejected by some receivers
+            labels = {name: value for name, value in {**extraLabels, **sample.labels}.items() if value != ""}
+            labels["__name__"] = sample.name
+
+            timeseries.append((labels, float(sample.value), int(sample.timestamp * 1000) if sample.timestamp is not None else timestampMs))
+
+    return timeseries
+
+
+def pushToRemoteWrite(url: str, metrics: list, job: str, timeout: float = 30):
+    payload = encodeSnappy(encodeWriteRequest(buildTimeseries(metrics, {"job": job})))
+
+    request = urllib.request.Request(url, data=payload, method="POST", headers={
+        "Content-Encoding": "snappy",
+        "Content-Type": "application/x-protobuf",
+        "User-Agent": "prometheus-aws-guardduty-exporter",
+        "X-Prometheus-Remote-Write-Version": "0.1.0",
+    })
+
+    # Non-2xx responses raise an HTTPError
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        response.read()
+
+
+def pushToGateway(url: str, metrics: list, job: str, timeout: float = 30):
+    # The metrics of the job are replaced
+    push_to_gateway(url, job, CollectedMetrics(metrics), timeout=timeout)
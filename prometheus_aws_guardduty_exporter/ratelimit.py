@@ -0,0 +1,70 @@
+import threading
+import time
+from typing import Optional
+
+# The error codes returned by AWS APIs when throttling requests
+THROTTLING_ERROR_CODES = {"Throttling", "ThrottlingException", "ThrottledException", "TooManyRequestsException", "RequestLimitExceeded"}
+
+
+def isThrottlingError(error: Exception) -> bool:
+    response = getattr(error, "response", None) or {}
+    return response.get("Error", {}).get("Code") in THROTTLING_ERROR_CODES
+
+
+class TokenBucket():
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        # The rate (tokens per second) is adaptive: it's decreased on throttling
+        # and slowly increased back to the max rate on success (AIMD)
+        self.maxRate = rate
+        self.minRate = rate / 16
+        self.rate = rate
+        self.burst = burst or max(1, rate)
+        self.tokens = self.burst
+        self.updatedAt = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self) -> float:
+        # Take a token, returning the number of seconds to wait before it's actually available
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updatedAt) * self.rate)
+            self.updatedAt = now
+            self.tokens -= 1
+
+            return 0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def acquire(self):
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+    def onThrottled(self):
+        with self.lock:
+            self.rate = max(self.minRate, self.rate / 2)
+
+    def onSuccess(self):
+        with self.lock:
+            self.rate = min(self.maxRate, self.rate + self.maxRate / 10)
+
+
+class CircuitBreaker():
+    def __init__(self, threshold: int, cooldown: float):
+        # The circuit is opened after threshold consecutive failures (0 to disable it)
+        # and half-opened after cooldown seconds, allowing a single attempt
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.openUntil = None
+
+    def isOpen(self, now: float) -> bool:
+        return self.openUntil is not None and now < self.openUntil
+
+    def onSuccess(self):
+        self.failures = 0
+        self.openUntil = None
+
+    def onFailure(self, now: float):
+        self.failures += 1
+
+        if self.threshold > 0 and self.failures >= self.threshold:
+            self.openUntil = now + self.cooldown
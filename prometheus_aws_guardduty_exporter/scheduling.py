@@ -0,0 +1,52 @@
+import fnmatch
+import random
+from typing import List, NamedTuple
+from .targets import Target
+
+
+class RefreshTier(NamedTuple):
+    interval: float
+    patterns: List[str]
+
+
+def parseRefreshTier(value: str) -> RefreshTier:
+    # The format is SECONDS:PATTERN[,PATTERN...]
+    interval, _, patterns = value.partition(":")
+    patterns = [pattern.strip() for pattern in patterns.split(",") if pattern.strip()]
+
+    if not patterns:
+        raise ValueError(f"Invalid refresh tier {value}: expected SECONDS:PATTERN[,PATTERN...]")
+
+    return RefreshTier(float(interval), patterns)
+
+
+def matchesRefreshTier(tier: RefreshTier, target: Target) -> bool:
+    for pattern in tier.patterns:
+        # Patterns containing a slash match ACCOUNT_ID/REGION, the other ones match the region only
+        value = f"{target.accountId}/{target.region}" if "/" in pattern else target.region
+
+        if fnmatch.fnmatchcase(value, pattern):
+            return True
+
+    return False
+
+
+def getRefreshInterval(tiers: List[RefreshTier], target: Target, defaultInterval: float) -> float:
+    # The first matching tier wins
+    for tier in tiers:
+        if matchesRefreshTier(tier, target):
+            return tier.interval
+
+    return defaultInterval
+
+
+def getNextRefreshDelay(interval: float, jitter: float, first: bool) -> float:
+    if jitter <= 0:
+        return interval
+
+    # The first refresh after startup is spread across the second half of the interval, so that targets
+    # get out of phase, while the following ones are randomly jittered to keep them out of phase
+    if first:
+        return interval * random.uniform(0.5, 1)
+
+    return interval * random.uniform(1 - jitter, 1 + jitter)
@@ -0,0 +1,261 @@
+import bisect
+import hashlib
+import logging
+import multiprocessing
+import queue
+import signal
+import threading
+import time
+from typing import List
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client.metrics_core import Metric
+from .budgets import applySeriesBudget, buildSeriesMetrics
+from .instrumentation import buildSnapshotAgeMetric
+from .targets import Target
+
+# The number of points of each shard on the hash ring: the more, the more even the distribution of targets
+HASH_RING_REPLICAS = 128
+
+# How often (in seconds) a worker checks whether its collector has refreshed the metrics
+WORKER_PUBLISH_INTERVAL = 1
+
+
+def hashKey(key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
+
+
+class HashRing():
+    def __init__(self, shardsCount: int, replicas: int = HASH_RING_REPLICAS):
+        # Each shard owns the arcs of the ring preceding its points, so that changing the number
+        # of shards only moves the targets of the arcs taken over by the added (or removed) shards
+        points = sorted((hashKey(f"shard-{shardIndex}-{replica}"), shardIndex) for shardIndex in range(shardsCount) for replica in range(replicas))
+        self.hashes = [point[0] for point in points]
+        self.shards = [point[1] for point in points]
+
+    def getShard(self, key: str) -> int:
+        index = bisect.bisect(self.hashes, hashKey(key)) % len(self.hashes)
+        return self.shards[index]
+
+
+def getTargetKey(target: Target) -> str:
+    return f"{target.accountId}/{target.region}"
+
+
+def filterShardTargets(targets: List[Target], shardIndex: int, shardsCount: int) -> List[Target]:
+    if shardsCount <= 1:
+        return targets
+
+    ring = HashRing(shardsCount)
+    return [target for target in targets if ring.getShard(getTargetKey(target)) == shardIndex]
+
+
+def mergeMetrics(metricsByShard: List[list]) -> list:
+    # Families exported by multiple shards are merged. Series exported by multiple shards (ie. the
+    # instrumentation ones, which have no target labels) are summed, but gauges and created timestamps.
+    families = {}
+    samples = {}
+
+    for metrics in metricsByShard:
+        for metric in metrics:
+            if metric.name not in families:
+                families[metric.name] = Metric(metric.name, metric.documentation, metric.type, metric.unit)
+                samples[metric.name] = {}
+
+            familySamples = samples[metric.name]
+            for sample in metric.samples:
+                key = (sample.name, tuple(sorted(sample.labels.items())))
+                existing = familySamples.get(key)
+
+                if existing is None:
+                    familySamples[key] = sample
+                elif sample.name.endswith("_created"):
+                    familySamples[key] = existing._replace(value=min(existing.value, sample.value))
+                elif metric.type == "gauge":
+                    familySamples[key] = existing._replace(value=max(existing.value, sample.value))
+                else:
+                    familySamples[key] = existing._replace(value=existing.value + sample.value)
+
+    for name, family in families.items():
+        family.samples = list(samples[name].values())
+
+    return list(families.values())
+
+
+def runShardWorker(shardIndex: int, shardsCount: int, backend: str, collectorKwargs: dict, logLevel: str, resultsQueue, configQueue, shutdown):
+    # The parent process coordinates the shutdown
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    from .cli import getCollectorClass, initLogger
+    initLogger(logLevel)
+
+    collector = getCollectorClass(backend)(shardIndex=shardIndex, shardsCount=shardsCount, **collectorKwargs)
+    collector.start()
+    publishedTimestamp = None
+
+    # Publish the metrics to the parent process after each refresh
+    while not shutdown.is_set():
+        # Apply the configuration reloaded by the parent process
+        try:
+            collector.reconfigure(**configQueue.get_nowait())
+        except queue.Empty:
+            pass
+        except Exception as error:
+            logging.getLogger().error(f"Unable to reconfigure shard {shardIndex} because of error: {str(error)}")
+
+        timestamp = collector.snapshotTimestamp
+
+        # The snapshot age and the series budget are computed by the parent process, which knows when each
+        # shard has been refreshed and all the series, so the snapshot is published apart from the instrumentation
+        if timestamp is not None and timestamp != publishedTimestamp:
+            with collector.snapshotLock:
+                metrics = collector.snapshotMetrics
+
+            resultsQueue.put((shardIndex, timestamp, metrics, collector.instrumentation.collect()))
+            publishedTimestamp = timestamp
+
+        shutdown.wait(WORKER_PUBLISH_INTERVAL)
+
+    collector.stop()
+
+
+# Collects metrics in multiple worker processes, each one owning a shard of the targets (assigned
+# via consistent hashing) and refreshing them in background, and exports the merged metrics.
+class ShardedMetricsCollector():
+    def __init__(self, shardsCount: int, backend: str = "threads", logLevel: str = "INFO", **collectorKwargs):
+        if not collectorKwargs.get("refreshInterval"):
+            raise ValueError("Sharding requires refreshing metrics in background")
+
+        self.shardsCount = shardsCount
+        self.backend = backend
+        self.collectorKwargs = collectorKwargs
+        self.refreshInterval = collectorKwargs["refreshInterval"]
+        self.maxSeriesPerMetric = collectorKwargs.get("maxSeriesPerMetric", 0)
+        self.logLevel = logLevel
+
+        # Workers are spawned (instead of forked) because the parent process runs threads
+        self.context = multiprocessing.get_context("spawn")
+        self.resultsQueue = None
+        self.shutdown = None
+        self.processes = {}
+        self.configQueues = {}
+
+        # The latest metrics published by each shard, along with its instrumentation metrics and the time
+        # its snapshot has been refreshed
+        self.metricsLock = threading.Lock()
+        self.shardsMetrics = {}
+        self.shardsInstrumentationMetrics = {}
+        self.shardsSnapshotTimestamps = {}
+        self.snapshotTimestamp = None
+
+        self.receiveThread = None
+        self.stopping = threading.Event()
+
+    def start(self):
+        self.resultsQueue = self.context.Queue()
+        self.shutdown = self.context.Event()
+        self.stopping.clear()
+
+        for shardIndex in range(self.shardsCount):
+            self._startWorker(shardIndex)
+
+        self.receiveThread = threading.Thread(target=self._receiveLoop, name="guardduty-shards", daemon=True)
+        self.receiveThread.start()
+
+    def stop(self):
+        if self.receiveThread is None:
+            return
+
+        # Results are received while the workers are shutting down, so that they never block on a full queue
+        self.shutdown.set()
+        for process in self.processes.values():
+            process.join()
+
+        self.stopping.set()
+        self.receiveThread.join()
+        self.receiveThread = None
+        self.processes = {}
+        self.configQueues = {}
+
+    def reconfigure(self, **reloadedKwargs):
+        # Workers restarted from now on get the reloaded configuration as well
+        self.collectorKwargs.update(reloadedKwargs)
+
+        for configQueue in self.configQueues.values():
+            configQueue.put(reloadedKwargs)
+
+    def describe(self):
+        return []
+
+    def collect(self):
+        return self.collectSnapshot() + self.collectRuntime()
+
+    def collectSnapshot(self):
+        # The merged metrics of the shards snapshots, which only change once a shard publishes a new one
+        with self.metricsLock:
+            shardsMetrics = [self.shardsMetrics[shardIndex] for shardIndex in sorted(self.shardsMetrics.keys())]
+
+        # The series budget is enforced on the merged metrics, so that it applies to all the shards together
+        metrics = mergeMetrics(shardsMetrics)
+        droppedSeries = applySeriesBudget(metrics, self.maxSeriesPerMetric)
+
+        return metrics + buildSeriesMetrics(metrics, droppedSeries)
+
+    def collectRuntime(self):
+        # The metrics changing between snapshots (ie. the snapshot age and the shards status)
+        with self.metricsLock:
+            shardIndexes = sorted(self.shardsMetrics.keys())
+            shardsInstrumentationMetrics = [self.shardsInstrumentationMetrics.get(shardIndex, []) for shardIndex in shardIndexes]
+            shardsSnapshotTimestamps = list(self.shardsSnapshotTimestamps.values())
+
+        shardUpMetric = GaugeMetricFamily(
+            "aws_guardduty_shard_up",
+            "Whether the worker process of a shard is running (1) or not (0)",
+            labels=["shard"])
+
+        for shardIndex in range(self.shardsCount):
+            process = self.processes.get(shardIndex)
+            shardUpMetric.add_metric(value=1 if process is not None and process.is_alive() else 0, labels=[str(shardIndex)])
+
+        # The age of the oldest shard snapshot, so that a stuck shard is noticed
+        snapshotAgeMetrics = [buildSnapshotAgeMetric(min(shardsSnapshotTimestamps))] if shardsSnapshotTimestamps else []
+
+        return snapshotAgeMetrics + [shardUpMetric] + mergeMetrics(shardsInstrumentationMetrics)
+
+    def _startWorker(self, shardIndex: int):
+        # Each shard persists its own state, while the series budget is enforced by the parent process
+        collectorKwargs = dict(self.collectorKwargs, maxSeriesPerMetric=0)
+        if collectorKwargs.get("stateFilepath"):
+            collectorKwargs["stateFilepath"] = f"{collectorKwargs['stateFilepath']}.{shardIndex}"
+
+        configQueue = self.context.Queue()
+
+        process = self.context.Process(
+            target=runShardWorker,
+            args=[shardIndex, self.shardsCount, self.backend, collectorKwargs, self.logLevel, self.resultsQueue, configQueue, self.shutdown],
+            name=f"guardduty-shard-{shardIndex}",
+            daemon=True)
+
+        process.start()
+        self.processes[shardIndex] = process
+        self.configQueues[shardIndex] = configQueue
+
+    def _receiveLoop(self):
+        while not self.stopping.is_set():
+            try:
+                shardIndex, snapshotTimestamp, metrics, instrumentationMetrics = self.resultsQueue.get(timeout=1)
+
+                with self.metricsLock:
+                    self.shardsMetrics[shardIndex] = metrics
+                    self.shardsInstrumentationMetrics[shardIndex] = instrumentationMetrics
+                    self.shardsSnapshotTimestamps[shardIndex] = snapshotTimestamp
+                    self.snapshotTimestamp = time.time()
+            except queue.Empty:
+                pass
+
+            self._restartDeadWorkers()
+
+    def _restartDeadWorkers(self):
+        for shardIndex, process in list(self.processes.items()):
+            if not process.is_alive() and not self.shutdown.is_set():
+                logging.getLogger().error(f"The worker process of shard {shardIndex} exited with code {process.exitcode}: restarting it")
+                self._startWorker(shardIndex)
@@ -0,0 +1,44 @@
+import gzip
+import json
+import os
+import tempfile
+from typing import Optional
+
+# The version of the state file format, increased on backward incompatible changes
+STATE_VERSION = 1
+
+
+class StateFile():
+    def __init__(self, filepath: str):
+        self.filepath = filepath
+
+    def load(self) -> Optional[dict]:
+        if not os.path.exists(self.filepath):
+            return None
+
+        with gzip.open(self.filepath, "rt", encoding="utf-8") as file:
+            state = json.load(file)
+
+        # Ignore a state saved with an incompatible format
+        if state.get("version") != STATE_VERSION:
+            return None
+
+        return state
+
+    def save(self, state: dict):
+        payload = gzip.compress(json.dumps({"version": STATE_VERSION, **state}, separators=(",", ":")).encode("utf-8"))
+
+        # Write to a temporary file in the same directory and then atomically replace
+        # the state file, so that a crash never leaves a partially written state
+        fd, tmpFilepath = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.filepath)), prefix=".state-")
+
+        try:
+            with os.fdopen(fd, "wb") as file:
+                file.write(payload)
+                file.flush()
+                os.fsync(file.fileno())
+
+            os.replace(tmpFilepath, self.filepath)
+        except Exception:
+            os.unlink(tmpFilepath)
+            raise
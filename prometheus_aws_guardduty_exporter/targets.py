@@ -0,0 +1,33 @@
+from typing import List, NamedTuple, Optional
+
+
+class Target(NamedTuple):
+    accountId: str
+    roleArn: Optional[str]
+    region: str
+
+
+def parseAccountId(roleArn: Optional[str]) -> str:
+    # The account ID is the 5th field of the role ARN (ie. arn:aws:iam::123456789012:role/name).
+    # When no role is assumed, the account ID is left empty so that the label is dropped by Prometheus.
+    if roleArn is None:
+        return ""
+
+    parts = roleArn.split(":")
+    if len(parts) < 6 or not parts[4]:
+        raise ValueError(f"Invalid role ARN: {roleArn}")
+
+    return parts[4]
+
+
+def buildTargets(regions: List[str], roleArns: Optional[List[str]] = None) -> List[Target]:
+    # Scrape each region of each account
+    return [Target(parseAccountId(roleArn), roleArn, region) for roleArn in (roleArns or [None]) for region in regions]
+
+
+def loadRoleArns(filepath: str) -> List[str]:
+    # Read one role ARN per line, skipping empty lines and comments
+    with open(filepath) as file:
+        lines = [line.split("#", 1)[0].strip() for line in file]
+
+    return [line for line in lines if line]
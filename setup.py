@@ -26,8 +26,14 @@ setup(
   keywords                      = ['prometheus', 'aws', 'guardduty'],
   classifiers                   = [],
   python_requires               = ' >= 3.11',
-  install_requires              = ["boto3==1.28.53", "python-json-logger==2.0.7", "prometheus_client==0.17.1"],
+  install_requires              = ["boto3==1.43.106", "python-json-logger==2.0.7", "prometheus_client==0.17.1", "PyYAML==6.0.3"],
   extras_require = {
+    'asyncio': [
+      'aiobotocore==3.9.2'
+    ],
+    'snappy': [
+      'python-snappy==0.7.3'
+    ],
     'dev': [
       'flake8==6.1.0',
       'twine==4.0.2'
@@ -0,0 +1,153 @@
+import json
+import os
+import re
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+from prometheus_aws_guardduty_exporter.async_collector import AsyncGuardDutyMetricsCollector, aiobotocore
+
+
+class GuardDutyStubHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.startswith("/detector"):
+            self._respond(200, {"detectorIds": self.server.detectors})
+        else:
+            self._respond(404, {"message": "Not found"})
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        match = re.match(r"^/detector/([^/]+)/findings/statistics$", self.path)
+
+        if match and match.group(1) in self.server.statistics:
+            self._respond(200, {"findingStatistics": {"countBySeverity": self.server.statistics[match.group(1)]}})
+        else:
+            self._respond(400, {"message": "Invalid detector", "__type": "BadRequestException"})
+
+    def _respond(self, status, body):
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@unittest.skipIf(aiobotocore is None, "aiobotocore is not installed")
+class TestAsyncGuardDutyMetricsCollector(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), GuardDutyStubHandler)
+        self.server.detectors = []
+        self.server.statistics = {}
+        self.serverThread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.serverThread.start()
+
+        self.endpointUrl = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.environ = patch.dict(os.environ, {"AWS_ACCESS_KEY_ID": "id", "AWS_SECRET_ACCESS_KEY": "secret"})
+        self.environ.start()
+
+    def tearDown(self):
+        self.environ.stop()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def testCollectShouldReturnCurrentFindingsMetricFromAllDetectorsOnSuccess(self):
+        self.server.detectors = ["detector-1", "detector-2"]
+        self.server.statistics = {
+            "detector-1": {"2.0": 1, "4.0": 2, "7.0": 3},
+            "detector-2": {"2.5": 4, "5.2": 5, "8.1": 6},
+        }
+
+        collector = AsyncGuardDutyMetricsCollector(regions=["eu-west-1", "us-east-1"], endpointUrl=self.endpointUrl, maxConcurrency=2)
+
+        try:
+            metrics = collector.collect()
+            metrics = collector.collect()
+        finally:
+            collector.stop()
+
+        findingsMetric = metrics[0]
+        self.assertEqual(findingsMetric.name, "aws_guardduty_current_findings")
+        self.assertEqual(len(findingsMetric.samples), 6)
+
+        self.assertEqual(findingsMetric.samples[0].value, 5)
+        self.assertEqual(findingsMetric.samples[0].labels, {"account_id": "", "region": "eu-west-1", "severity": "low"})
+        self.assertEqual(findingsMetric.samples[1].value, 7)
+        self.assertEqual(findingsMetric.samples[2].value, 9)
+        self.assertEqual(findingsMetric.samples[3].labels, {"account_id": "", "region": "us-east-1", "severity": "low"})
+
+        scrapeErrorsMetric = metrics[1]
+        self.assertEqual([sample.value for sample in scrapeErrorsMetric.samples], [0, 0])
+
+    def testCollectShouldIncreaseScrapeErrorsOnFailure(self):
+        self.server.detectors = ["detector-unknown"]
+
+        collector = AsyncGuardDutyMetricsCollector(regions=["eu-west-1"], endpointUrl=self.endpointUrl)
+
+        try:
+            metrics = collector.collect()
+        finally:
+            collector.stop()
+
+        self.assertEqual(len(metrics[0].samples), 0)
+        self.assertEqual(metrics[1].samples[0].value, 1)
+        self.assertEqual(metrics[1].samples[0].labels, {"account_id": "", "region": "eu-west-1"})
+
+    def testCollectShouldExportStatisticsWhenTrackingFindingsFails(self):
+        # The stub doesn't support listing findings
+        self.server.detectors = ["detector-1"]
+        self.server.statistics = {"detector-1": {"7.0": 2}}
+
+        collector = AsyncGuardDutyMetricsCollector(regions=["eu-west-1"], endpointUrl=self.endpointUrl, trackFindings=True)
+
+        try:
+            with patch.object(collector, "_logTrackingError") as logTrackingErrorMock:
+                metrics = collector.collect()
+        finally:
+            collector.stop()
+
+        self.assertEqual(logTrackingErrorMock.call_args.args[:2], (collector.targets[0], "detector-1"))
+        self.assertEqual([sample.value for sample in metrics[0].samples], [0, 0, 2])
+        self.assertEqual(metrics[1].samples[0].value, 0)
+
+    def testReconfigureShouldCloseTheClientsNotUsedAnymore(self):
+        self.server.detectors = ["detector-1"]
+        self.server.statistics = {"detector-1": {"2.0": 1}}
+
+        collector = AsyncGuardDutyMetricsCollector(regions=["eu-west-1", "us-east-1"], endpointUrl=self.endpointUrl)
+        closedClients = []
+
+        def trackClose(client):
+            close = client.close
+
+            async def _close():
+                closedClients.append(client)
+                await close()
+
+            client.close = _close
+
+        try:
+            collector.collect()
+            openedClients = [client for _, clients in collector.asyncClients.values() for client in clients]
+            for client in openedClients:
+                trackClose(client)
+
+            # us-east-1 is removed, while the eu-west-1 client is created again with the new timeouts
+            collector.reconfigure(regions=["eu-west-1"], readTimeout=5)
+
+            for _ in range(100):
+                if len(closedClients) == len(openedClients):
+                    break
+                time.sleep(0.01)
+
+            metrics = collector.collect()
+        finally:
+            collector.stop()
+
+        self.assertEqual(len(openedClients), 2)
+        self.assertCountEqual(closedClients, openedClients)
+        self.assertEqual({sample.labels["region"] for sample in metrics[0].samples}, {"eu-west-1"})
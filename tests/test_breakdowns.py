@@ -0,0 +1,36 @@
+import unittest
+from prometheus_aws_guardduty_exporter.breakdowns import addGroupedStatistics, limitCardinality, newRegionStats
+
+
+class TestBreakdowns(unittest.TestCase):
+    def testAddGroupedStatisticsShouldSumFindingsByResourceType(self):
+        regionStats = newRegionStats(["resource_type"])
+
+        addGroupedStatistics(regionStats, "resource_type", {"GroupedByResource": [
+            {"ResourceId": "i-1", "ResourceType": "Instance", "TotalFindings": 3},
+            {"ResourceId": "i-2", "ResourceType": "Instance", "TotalFindings": 2},
+            {"ResourceId": "bucket", "ResourceType": "S3Bucket", "TotalFindings": 1},
+        ]}, 6)
+
+        self.assertEqual(regionStats["resource_type"], {"Instance": 5, "S3Bucket": 1})
+
+    def testAddGroupedStatisticsShouldCountTheFindingsOfTheMissingGroupsAsOther(self):
+        regionStats = newRegionStats(["finding_type"])
+
+        # Only the top groups are returned
+        addGroupedStatistics(regionStats, "finding_type", {"GroupedByFindingType": [
+            {"FindingType": "Recon:EC2/PortProbeUnprotectedPort", "TotalFindings": 10},
+        ]}, 15)
+
+        addGroupedStatistics(regionStats, "finding_type", {"GroupedByFindingType": [
+            {"FindingType": "Recon:EC2/PortProbeUnprotectedPort", "TotalFindings": 3},
+        ]}, 4)
+
+        self.assertEqual(regionStats["finding_type"], {"Recon:EC2/PortProbeUnprotectedPort": 13, "other": 6})
+
+    def testLimitCardinalityShouldAggregateTheLessRelevantValuesIntoOther(self):
+        counts = {"a": 1, "b": 5, "c": 3, "d": 2}
+
+        self.assertEqual(limitCardinality(counts, 3), {"b": 5, "c": 3, "other": 3})
+        self.assertEqual(limitCardinality(counts, 4), counts)
+        self.assertEqual(limitCardinality(counts, 0), counts)
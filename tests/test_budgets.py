@@ -0,0 +1,46 @@
+import unittest
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_aws_guardduty_exporter.budgets import applySeriesBudget, buildSeriesMetrics, isAllowed
+
+
+class TestBudgets(unittest.TestCase):
+    def testIsAllowedShouldMatchIncludedAndNotExcludedPatterns(self):
+        self.assertTrue(isAllowed("eu-west-1"))
+        self.assertTrue(isAllowed("eu-west-1", ["eu-*"]))
+        self.assertFalse(isAllowed("us-east-1", ["eu-*"]))
+        self.assertFalse(isAllowed("eu-west-1", ["eu-*"], ["eu-west-*"]))
+        self.assertTrue(isAllowed("eu-central-1", None, ["eu-west-*"]))
+
+    def testApplySeriesBudgetShouldKeepTheFirstSeriesOfEachMetric(self):
+        metric = GaugeMetricFamily("aws_guardduty_current_findings", "Findings", labels=["region"])
+        for region in ["eu-west-1", "us-east-1", "ap-east-1"]:
+            metric.add_metric(value=1, labels=[region])
+
+        droppedSeries = applySeriesBudget([metric], 2)
+
+        self.assertEqual([sample.labels["region"] for sample in metric.samples], ["eu-west-1", "us-east-1"])
+        self.assertEqual(droppedSeries, {"aws_guardduty_current_findings": 1})
+
+        seriesMetric, droppedSeriesMetric = buildSeriesMetrics([metric], droppedSeries)
+        self.assertEqual([(sample.labels, sample.value) for sample in seriesMetric.samples], [({"metric": "aws_guardduty_current_findings"}, 2)])
+        self.assertEqual([(sample.labels, sample.value) for sample in droppedSeriesMetric.samples], [({"metric": "aws_guardduty_current_findings"}, 1)])
+
+    def testApplySeriesBudgetShouldKeepOrDropAllTheSeriesOfARegionTogether(self):
+        metric = GaugeMetricFamily("aws_guardduty_current_findings", "Findings", labels=["account_id", "region", "severity"])
+        for region in ["eu-west-1", "us-east-1"]:
+            for severity in ["low", "medium", "high"]:
+                metric.add_metric(value=1, labels=["111111111111", region, severity])
+
+        # The budget doesn't fit all the series of us-east-1, nor of eu-west-1 once lower
+        self.assertEqual(applySeriesBudget([metric], 5), {"aws_guardduty_current_findings": 3})
+        self.assertEqual({sample.labels["region"] for sample in metric.samples}, {"eu-west-1"})
+
+        self.assertEqual(applySeriesBudget([metric], 2), {"aws_guardduty_current_findings": 3})
+        self.assertEqual(metric.samples, [])
+
+    def testApplySeriesBudgetShouldNotLimitSeriesWhenDisabled(self):
+        metric = GaugeMetricFamily("aws_guardduty_current_findings", "Findings", labels=["region"])
+        metric.add_metric(value=1, labels=["eu-west-1"])
+
+        self.assertEqual(applySeriesBudget([metric], 0), {})
+        self.assertEqual(len(metric.samples), 1)
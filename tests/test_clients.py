@@ -0,0 +1,89 @@
+import boto3
+import datetime
+import unittest
+from botocore.stub import Stubber
+from unittest.mock import MagicMock, patch
+from prometheus_aws_guardduty_exporter.clients import GuardDutyClientsCache
+
+
+class TestGuardDutyClientsCache(unittest.TestCase):
+    def setUp(self):
+        self.stsClient = boto3.client("sts")
+        self.stsStubber = Stubber(self.stsClient)
+        self.stsStubber.activate()
+
+        self.botoSessionMock = MagicMock()
+        self.botoSessionMock.client.side_effect = lambda service, **kwargs: self.stsClient if service == "sts" else MagicMock()
+
+    def testGetClientShouldReuseTheSameClientForTheSameRegionAndRole(self):
+        with patch("boto3.session.Session", return_value=self.botoSessionMock) as sessionMock:
+            cache = GuardDutyClientsCache(None)
+
+            client1 = cache.getClient("eu-west-1")
+            client2 = cache.getClient("eu-west-1")
+            client3 = cache.getClient("us-east-1")
+
+        self.assertIs(client1, client2)
+        self.assertIsNot(client1, client3)
+        self.assertEqual(sessionMock.call_count, 2)
+
+    def testAssumeRoleCredentialsShouldBeFetchedOnceUntilCloseToExpiration(self):
+        self.stsStubber.add_response(
+            "assume_role",
+            {"Credentials": {
+                "AccessKeyId": "AKIAEXAMPLE00000000",
+                "SecretAccessKey": "secret",
+                "SessionToken": "token",
+                "Expiration": datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(hours=1),
+            }},
+            {"RoleArn": "arn:aws:iam::123456789012:role/guardduty", "RoleSessionName": "GuardDutyExporter", "DurationSeconds": 3600})
+
+        with patch("boto3.session.Session", return_value=self.botoSessionMock):
+            cache = GuardDutyClientsCache(None)
+            credentials = cache._createAssumeRoleCredentials("eu-west-1", "arn:aws:iam::123456789012:role/guardduty")
+
+        for _ in range(3):
+            frozen = credentials.get_frozen_credentials()
+            self.assertEqual(frozen.access_key, "AKIAEXAMPLE00000000")
+            self.assertEqual(frozen.token, "token")
+
+        self.stsStubber.assert_no_pending_responses()
+
+    def testAssumeRoleCredentialsShouldBeRefreshedWhenCloseToExpiration(self):
+        for accessKeyId in ["AKIAEXAMPLE00000001", "AKIAEXAMPLE00000002"]:
+            self.stsStubber.add_response(
+                "assume_role",
+                {"Credentials": {
+                    "AccessKeyId": accessKeyId,
+                    "SecretAccessKey": "secret",
+                    "SessionToken": "token",
+                    "Expiration": datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(minutes=5),
+                }},
+                {"RoleArn": "arn:aws:iam::123456789012:role/guardduty", "RoleSessionName": "GuardDutyExporter", "DurationSeconds": 3600})
+
+        with patch("boto3.session.Session", return_value=self.botoSessionMock):
+            cache = GuardDutyClientsCache(None)
+            credentials = cache._createAssumeRoleCredentials("eu-west-1", "arn:aws:iam::123456789012:role/guardduty")
+
+        self.assertEqual(credentials.get_frozen_credentials().access_key, "AKIAEXAMPLE00000001")
+        self.assertEqual(credentials.get_frozen_credentials().access_key, "AKIAEXAMPLE00000002")
+
+        self.stsStubber.assert_no_pending_responses()
+
+    def testRemoveClientShouldCloseTheClientAndItsStsClient(self):
+        self.botoSessionMock.client.side_effect = lambda service, **kwargs: MagicMock()
+
+        with patch("boto3.session.Session", return_value=self.botoSessionMock):
+            cache = GuardDutyClientsCache(None)
+            client1 = cache.getClient("eu-west-1", "arn:aws:iam::123456789012:role/guardduty")
+            client2 = cache.getClient("us-east-1")
+            stsClient = cache.stsClients[("eu-west-1", "arn:aws:iam::123456789012:role/guardduty")]
+
+        cache.removeClient("eu-west-1", "arn:aws:iam::123456789012:role/guardduty")
+        client1.close.assert_called_once()
+        stsClient.close.assert_called_once()
+        client2.close.assert_not_called()
+
+        cache.close()
+        client2.close.assert_called_once()
+        self.assertEqual((cache.clients, cache.stsClients), ({}, {}))
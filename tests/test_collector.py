@@ -1,8 +1,15 @@
+import logging
+import os
+import tempfile
+import threading
+import time
 import boto3
 import unittest
 from botocore.stub import Stubber
 from unittest.mock import MagicMock, patch
 from prometheus_aws_guardduty_exporter.collector import GuardDutyMetricsCollector
+from prometheus_aws_guardduty_exporter.findings import IndexedFinding
+from prometheus_aws_guardduty_exporter.scheduling import RefreshTier
 
 
 class TestGuardDutyMetricsCollector(unittest.TestCase):
@@ -43,11 +50,11 @@ class TestGuardDutyMetricsCollector(unittest.TestCase):
         self.assertEqual(len(findingsMetric.samples), 3)
 
         self.assertEqual(findingsMetric.samples[0].value, 1)
-        self.assertEqual(findingsMetric.samples[0].labels, {"region": "eu-west-1", "severity": "low"})
+        self.assertEqual(findingsMetric.samples[0].labels, {"account_id": "", "region": "eu-west-1", "severity": "low"})
         self.assertEqual(findingsMetric.samples[1].value, 2)
-        self.assertEqual(findingsMetric.samples[1].labels, {"region": "eu-west-1", "severity": "medium"})
+        self.assertEqual(findingsMetric.samples[1].labels, {"account_id": "", "region": "eu-west-1", "severity": "medium"})
         self.assertEqual(findingsMetric.samples[2].value, 3)
-        self.assertEqual(findingsMetric.samples[2].labels, {"region": "eu-west-1", "severity": "high"})
+        self.assertEqual(findingsMetric.samples[2].labels, {"account_id": "", "region": "eu-west-1", "severity": "high"})
 
         scrapeErrorsMetric = metrics[1]
         self.assertEqual(scrapeErrorsMetric.name, "aws_guardduty_scrape_errors")
@@ -55,7 +62,7 @@ class TestGuardDutyMetricsCollector(unittest.TestCase):
         self.assertEqual(len(scrapeErrorsMetric.samples), 1)
 
         self.assertEqual(scrapeErrorsMetric.samples[0].value, 0)
-        self.assertEqual(scrapeErrorsMetric.samples[0].labels, {"region": "eu-west-1"})
+        self.assertEqual(scrapeErrorsMetric.samples[0].labels, {"account_id": "", "region": "eu-west-1"})
 
         self.gdStubber.assert_no_pending_responses()
 
@@ -99,11 +106,11 @@ class TestGuardDutyMetricsCollector(unittest.TestCase):
         self.assertEqual(len(findingsMetric.samples), 3)
 
         self.assertEqual(findingsMetric.samples[0].value, 5)
-        self.assertEqual(findingsMetric.samples[0].labels, {"region": "eu-west-1", "severity": "low"})
+        self.assertEqual(findingsMetric.samples[0].labels, {"account_id": "", "region": "eu-west-1", "severity": "low"})
         self.assertEqual(findingsMetric.samples[1].value, 7)
-        self.assertEqual(findingsMetric.samples[1].labels, {"region": "eu-west-1", "severity": "medium"})
+        self.assertEqual(findingsMetric.samples[1].labels, {"account_id": "", "region": "eu-west-1", "severity": "medium"})
         self.assertEqual(findingsMetric.samples[2].value, 9)
-        self.assertEqual(findingsMetric.samples[2].labels, {"region": "eu-west-1", "severity": "high"})
+        self.assertEqual(findingsMetric.samples[2].labels, {"account_id": "", "region": "eu-west-1", "severity": "high"})
 
         scrapeErrorsMetric = metrics[1]
         self.assertEqual(scrapeErrorsMetric.name, "aws_guardduty_scrape_errors")
@@ -111,7 +118,7 @@ class TestGuardDutyMetricsCollector(unittest.TestCase):
         self.assertEqual(len(scrapeErrorsMetric.samples), 1)
 
         self.assertEqual(scrapeErrorsMetric.samples[0].value, 0)
-        self.assertEqual(scrapeErrorsMetric.samples[0].labels, {"region": "eu-west-1"})
+        self.assertEqual(scrapeErrorsMetric.samples[0].labels, {"account_id": "", "region": "eu-west-1"})
 
         self.gdStubber.assert_no_pending_responses()
 
@@ -151,7 +158,7 @@ class TestGuardDutyMetricsCollector(unittest.TestCase):
 
         # Collect metrics
         with patch("boto3.session.Session", return_value=self.botoSessionMock):
-            collector = GuardDutyMetricsCollector(regions=["eu-west-1", "us-east-1"])
+            collector = GuardDutyMetricsCollector(regions=["eu-west-1", "us-east-1"], maxConcurrency=1)
             metrics = collector.collect()
 
         findingsMetric = metrics[0]
@@ -160,17 +167,17 @@ class TestGuardDutyMetricsCollector(unittest.TestCase):
         self.assertEqual(len(findingsMetric.samples), 6)
 
         self.assertEqual(findingsMetric.samples[0].value, 1)
-        self.assertEqual(findingsMetric.samples[0].labels, {"region": "eu-west-1", "severity": "low"})
+        self.assertEqual(findingsMetric.samples[0].labels, {"account_id": "", "region": "eu-west-1", "severity": "low"})
         self.assertEqual(findingsMetric.samples[1].value, 2)
-        self.assertEqual(findingsMetric.samples[1].labels, {"region": "eu-west-1", "severity": "medium"})
+        self.assertEqual(findingsMetric.samples[1].labels, {"account_id": "", "region": "eu-west-1", "severity": "medium"})
         self.assertEqual(findingsMetric.samples[2].value, 3)
-        self.assertEqual(findingsMetric.samples[2].labels, {"region": "eu-west-1", "severity": "high"})
+        self.assertEqual(findingsMetric.samples[2].labels, {"account_id": "", "region": "eu-west-1", "severity": "high"})
         self.assertEqual(findingsMetric.samples[3].value, 4)
-        self.assertEqual(findingsMetric.samples[3].labels, {"region": "us-east-1", "severity": "low"})
+        self.assertEqual(findingsMetric.samples[3].labels, {"account_id": "", "region": "us-east-1", "severity": "low"})
         self.assertEqual(findingsMetric.samples[4].value, 5)
-        self.assertEqual(findingsMetric.samples[4].labels, {"region": "us-east-1", "severity": "medium"})
+        self.assertEqual(findingsMetric.samples[4].labels, {"account_id": "", "region": "us-east-1", "severity": "medium"})
         self.assertEqual(findingsMetric.samples[5].value, 6)
-        self.assertEqual(findingsMetric.samples[5].labels, {"region": "us-east-1", "severity": "high"})
+        self.assertEqual(findingsMetric.samples[5].labels, {"account_id": "", "region": "us-east-1", "severity": "high"})
 
         scrapeErrorsMetric = metrics[1]
         self.assertEqual(scrapeErrorsMetric.name, "aws_guardduty_scrape_errors")
@@ -178,9 +185,9 @@ class TestGuardDutyMetricsCollector(unittest.TestCase):
         self.assertEqual(len(scrapeErrorsMetric.samples), 2)
 
         self.assertEqual(scrapeErrorsMetric.samples[0].value, 0)
-        self.assertEqual(scrapeErrorsMetric.samples[0].labels, {"region": "eu-west-1"})
+        self.assertEqual(scrapeErrorsMetric.samples[0].labels, {"account_id": "", "region": "eu-west-1"})
         self.assertEqual(scrapeErrorsMetric.samples[1].value, 0)
-        self.assertEqual(scrapeErrorsMetric.samples[1].labels, {"region": "us-east-1"})
+        self.assertEqual(scrapeErrorsMetric.samples[1].labels, {"account_id": "", "region": "us-east-1"})
 
         self.gdStubber.assert_no_pending_responses()
 
@@ -211,7 +218,7 @@ class TestGuardDutyMetricsCollector(unittest.TestCase):
 
         # Collect metrics
         with patch("boto3.session.Session", return_value=self.botoSessionMock):
-            collector = GuardDutyMetricsCollector(regions=["eu-west-1", "us-east-1"])
+            collector = GuardDutyMetricsCollector(regions=["eu-west-1", "us-east-1"], maxConcurrency=1)
             metrics = collector.collect()
 
         findingsMetric = metrics[0]
@@ -220,11 +227,11 @@ class TestGuardDutyMetricsCollector(unittest.TestCase):
         self.assertEqual(len(findingsMetric.samples), 3)
 
         self.assertEqual(findingsMetric.samples[0].value, 4)
-        self.assertEqual(findingsMetric.samples[0].labels, {"region": "us-east-1", "severity": "low"})
+        self.assertEqual(findingsMetric.samples[0].labels, {"account_id": "", "region": "us-east-1", "severity": "low"})
         self.assertEqual(findingsMetric.samples[1].value, 5)
-        self.assertEqual(findingsMetric.samples[1].labels, {"region": "us-east-1", "severity": "medium"})
+        self.assertEqual(findingsMetric.samples[1].labels, {"account_id": "", "region": "us-east-1", "severity": "medium"})
         self.assertEqual(findingsMetric.samples[2].value, 6)
-        self.assertEqual(findingsMetric.samples[2].labels, {"region": "us-east-1", "severity": "high"})
+        self.assertEqual(findingsMetric.samples[2].labels, {"account_id": "", "region": "us-east-1", "severity": "high"})
 
         scrapeErrorsMetric = metrics[1]
         self.assertEqual(scrapeErrorsMetric.name, "aws_guardduty_scrape_errors")
@@ -232,9 +239,9 @@ class TestGuardDutyMetricsCollector(unittest.TestCase):
         self.assertEqual(len(scrapeErrorsMetric.samples), 2)
 
         self.assertEqual(scrapeErrorsMetric.samples[0].value, 1)
-        self.assertEqual(scrapeErrorsMetric.samples[0].labels, {"region": "eu-west-1"})
+        self.assertEqual(scrapeErrorsMetric.samples[0].labels, {"account_id": "", "region": "eu-west-1"})
         self.assertEqual(scrapeErrorsMetric.samples[1].value, 0)
-        self.assertEqual(scrapeErrorsMetric.samples[1].labels, {"region": "us-east-1"})
+        self.assertEqual(scrapeErrorsMetric.samples[1].labels, {"account_id": "", "region": "us-east-1"})
 
         self.gdStubber.assert_no_pending_responses()
 
@@ -263,7 +270,7 @@ class TestGuardDutyMetricsCollector(unittest.TestCase):
         self.assertEqual(len(scrapeErrorsMetric.samples), 1)
 
         self.assertEqual(scrapeErrorsMetric.samples[0].value, 1)
-        self.assertEqual(scrapeErrorsMetric.samples[0].labels, {"region": "us-east-1"})
+        self.assertEqual(scrapeErrorsMetric.samples[0].labels, {"account_id": "", "region": "us-east-1"})
 
         with patch("boto3.session.Session", return_value=self.botoSessionMock):
             metrics = collector.collect()
@@ -279,6 +286,795 @@ class TestGuardDutyMetricsCollector(unittest.TestCase):
         self.assertEqual(len(scrapeErrorsMetric.samples), 1)
 
         self.assertEqual(scrapeErrorsMetric.samples[0].value, 2)
-        self.assertEqual(scrapeErrorsMetric.samples[0].labels, {"region": "us-east-1"})
+        self.assertEqual(scrapeErrorsMetric.samples[0].labels, {"account_id": "", "region": "us-east-1"})
+
+        self.gdStubber.assert_no_pending_responses()
+
+    def testCollectShouldReturnNoMetricsWhenRefreshingInBackgroundBeforeTheFirstRefresh(self):
+        collector = GuardDutyMetricsCollector(regions=["eu-west-1"], refreshInterval=60)
+        metrics = collector.collect()
+
+        self.assertEqual(metrics, [])
+        self.gdStubber.assert_no_pending_responses()
+
+    def testCollectShouldReturnSnapshotWithoutCallingAwsWhenRefreshingInBackground(self):
+        # Mock GuardDuty
+        self.gdStubber.add_response(
+            "list_detectors",
+            {"DetectorIds": ["eu-detector-1"]},
+            {})
+
+        self.gdStubber.add_response(
+            "get_findings_statistics",
+            {"FindingStatistics": {
+                "CountBySeverity": {
+                    "2.0": 1,
+                    "4.0": 2,
+                    "7.0": 3,
+                }
+            }},
+            {"DetectorId": "eu-detector-1", "FindingCriteria": {"Criterion": {"service.archived": {"Eq": ["false"]}}}, "FindingStatisticTypes": ["COUNT_BY_SEVERITY"]})
+
+        # Refresh metrics once, then collect them multiple times
+        with patch("boto3.session.Session", return_value=self.botoSessionMock):
+            collector = GuardDutyMetricsCollector(regions=["eu-west-1"], refreshInterval=60)
+            collector.refresh()
+
+            metrics = collector.collect()
+            metrics = collector.collect()
+
+        self.assertEqual([metric.name for metric in metrics[:7]], [
+            "aws_guardduty_current_findings", "aws_guardduty_scrape_errors", "aws_guardduty_last_success_timestamp_seconds", "aws_guardduty_circuit_breaker_open",
+            "aws_guardduty_series", "aws_guardduty_series_dropped", "aws_guardduty_snapshot_age_seconds"])
+
+        findingsMetric = metrics[0]
+        self.assertEqual(findingsMetric.name, "aws_guardduty_current_findings")
+        self.assertEqual(len(findingsMetric.samples), 3)
+        self.assertEqual(findingsMetric.samples[0].value, 1)
+        self.assertEqual(findingsMetric.samples[1].value, 2)
+        self.assertEqual(findingsMetric.samples[2].value, 3)
+
+        snapshotAgeMetric = metrics[6]
+        self.assertEqual(snapshotAgeMetric.name, "aws_guardduty_snapshot_age_seconds")
+        self.assertEqual(snapshotAgeMetric.type, "gauge")
+        self.assertEqual(len(snapshotAgeMetric.samples), 1)
+        self.assertGreaterEqual(snapshotAgeMetric.samples[0].value, 0)
+
+        self.gdStubber.assert_no_pending_responses()
+
+    def testStartShouldRefreshMetricsInBackground(self):
+        # Mock GuardDuty
+        self.gdStubber.add_response(
+            "list_detectors",
+            {"DetectorIds": []},
+            {})
+
+        with patch("boto3.session.Session", return_value=self.botoSessionMock):
+            collector = GuardDutyMetricsCollector(regions=["eu-west-1"], refreshInterval=60)
+            collector.start()
+
+            # Wait until the first refresh has completed
+            for _ in range(100):
+                if collector.collect():
+                    break
+                time.sleep(0.01)
+
+            collector.stop()
+
+        metrics = collector.collect()
+        self.assertEqual([metric.name for metric in metrics[:7]], [
+            "aws_guardduty_current_findings", "aws_guardduty_scrape_errors", "aws_guardduty_last_success_timestamp_seconds", "aws_guardduty_circuit_breaker_open",
+            "aws_guardduty_series", "aws_guardduty_series_dropped", "aws_guardduty_snapshot_age_seconds"])
+        self.assertEqual(metrics[0].samples[0].labels, {"account_id": "", "region": "eu-west-1", "severity": "low"})
+        self.assertEqual(metrics[0].samples[0].value, 0)
+
+        self.gdStubber.assert_no_pending_responses()
+
+    def testCollectShouldReturnCurrentFindingsMetricFromMultipleAccountsOnSuccess(self):
+        # Mock GuardDuty
+        for detectorId, counts in [("detector-1", {"2.0": 1}), ("detector-2", {"8.0": 2})]:
+            self.gdStubber.add_response(
+                "list_detectors",
+                {"DetectorIds": [detectorId]},
+                {})
+
+            self.gdStubber.add_response(
+                "get_findings_statistics",
+                {"FindingStatistics": {"CountBySeverity": counts}},
+                {"DetectorId": detectorId, "FindingCriteria": {"Criterion": {"service.archived": {"Eq": ["false"]}}}, "FindingStatisticTypes": ["COUNT_BY_SEVERITY"]})
+
+        # Collect metrics
+        with patch("boto3.session.Session", return_value=self.botoSessionMock):
+            collector = GuardDutyMetricsCollector(
+                regions=["eu-west-1"],
+                roleArns=["arn:aws:iam::111111111111:role/guardduty", "arn:aws:iam::222222222222:role/guardduty"],
+                maxConcurrency=1)
+            metrics = collector.collect()
+
+        findingsMetric = metrics[0]
+        self.assertEqual(len(findingsMetric.samples), 6)
+        self.assertEqual(findingsMetric.samples[0].value, 1)
+        self.assertEqual(findingsMetric.samples[0].labels, {"account_id": "111111111111", "region": "eu-west-1", "severity": "low"})
+        self.assertEqual(findingsMetric.samples[5].value, 2)
+        self.assertEqual(findingsMetric.samples[5].labels, {"account_id": "222222222222", "region": "eu-west-1", "severity": "high"})
+
+        scrapeErrorsMetric = metrics[1]
+        self.assertEqual(len(scrapeErrorsMetric.samples), 2)
+        self.assertEqual(scrapeErrorsMetric.samples[0].labels, {"account_id": "111111111111", "region": "eu-west-1"})
+        self.assertEqual(scrapeErrorsMetric.samples[1].labels, {"account_id": "222222222222", "region": "eu-west-1"})
+
+        self.gdStubber.assert_no_pending_responses()
+
+    def testCollectShouldReturnApiCallsInstrumentationMetrics(self):
+        # Mock GuardDuty
+        self.gdStubber.add_response(
+            "list_detectors",
+            {"DetectorIds": ["eu-detector-1"]},
+            {})
+
+        self.gdStubber.add_client_error("get_findings_statistics", service_error_code="TooManyRequestsException", http_status_code=429)
+
+        # Collect metrics
+        with patch("boto3.session.Session", return_value=self.botoSessionMock):
+            collector = GuardDutyMetricsCollector(regions=["eu-west-1"])
+            metrics = {metric.name: metric for metric in collector.collect()}
+
+        apiCallsSamples = {(sample.labels["operation"], sample.labels["outcome"]): sample.value for sample in metrics["aws_guardduty_api_calls"].samples if sample.name == "aws_guardduty_api_calls_total"}
+        self.assertEqual(apiCallsSamples, {("ListDetectors", "success"): 1, ("GetFindingsStatistics", "throttled"): 1})
+
+        apiCallDurationCounts = {sample.labels["operation"]: sample.value for sample in metrics["aws_guardduty_api_call_duration_seconds"].samples if sample.name.endswith("_count")}
+        self.assertEqual(apiCallDurationCounts, {"ListDetectors": 1, "GetFindingsStatistics": 1})
+
+        regionDurationCounts = [sample for sample in metrics["aws_guardduty_region_collect_duration_seconds"].samples if sample.name.endswith("_count")]
+        self.assertEqual(len(regionDurationCounts), 1)
+        self.assertEqual(regionDurationCounts[0].labels, {"account_id": "", "region": "eu-west-1"})
+        self.assertEqual(regionDurationCounts[0].value, 1)
+
+        self.assertEqual(len(metrics["aws_guardduty_collect_duration_seconds"].samples), 1)
+        self.assertGreaterEqual(metrics["aws_guardduty_collect_duration_seconds"].samples[0].value, 0)
+
+        self.gdStubber.assert_no_pending_responses()
+
+    def testCollectShouldServeCachedMetricsUntilTheCacheTtlExpires(self):
+        # Mock GuardDuty
+        self.gdStubber.add_response(
+            "list_detectors",
+            {"DetectorIds": ["eu-detector-1"]},
+            {})
+
+        self.gdStubber.add_response(
+            "get_findings_statistics",
+            {"FindingStatistics": {"CountBySeverity": {"2.0": 1}}},
+            {"DetectorId": "eu-detector-1", "FindingCriteria": {"Criterion": {"service.archived": {"Eq": ["false"]}}}, "FindingStatisticTypes": ["COUNT_BY_SEVERITY"]})
+
+        # Collect metrics twice: the second scrape is served from cache
+        with patch("boto3.session.Session", return_value=self.botoSessionMock):
+            collector = GuardDutyMetricsCollector(regions=["eu-west-1"], cacheTtl=60)
+            collector.collect()
+            metrics = collector.collect()
+
+        self.assertEqual(metrics[0].samples[0].value, 1)
+        self.assertEqual(metrics[1].samples[0].value, 0)
+
+        lastSuccessMetric = metrics[2]
+        self.assertEqual(lastSuccessMetric.name, "aws_guardduty_last_success_timestamp_seconds")
+        self.assertEqual(len(lastSuccessMetric.samples), 1)
+        self.assertEqual(lastSuccessMetric.samples[0].labels, {"account_id": "", "region": "eu-west-1"})
+        self.assertAlmostEqual(lastSuccessMetric.samples[0].value, time.time(), delta=5)
+
+        self.gdStubber.assert_no_pending_responses()
+
+    def testCollectShouldServeLastGoodMetricsOnFailureUpToTheMaxStaleness(self):
+        # Mock GuardDuty
+        self.gdStubber.add_response(
+            "list_detectors",
+            {"DetectorIds": ["eu-detector-1"]},
+            {})
+
+        self.gdStubber.add_response(
+            "get_findings_statistics",
+            {"FindingStatistics": {"CountBySeverity": {"2.0": 1}}},
+            {"DetectorId": "eu-detector-1", "FindingCriteria": {"Criterion": {"service.archived": {"Eq": ["false"]}}}, "FindingStatisticTypes": ["COUNT_BY_SEVERITY"]})
+
+        self.gdStubber.add_client_error("list_detectors")
+        self.gdStubber.add_client_error("list_detectors")
+
+        with patch("boto3.session.Session", return_value=self.botoSessionMock):
+            collector = GuardDutyMetricsCollector(regions=["eu-west-1"], maxStaleness=60)
+            collector.collect()
+
+            # The last good metrics are served on failure
+            metrics = collector.collect()
+            self.assertEqual(len(metrics[0].samples), 3)
+            self.assertEqual(metrics[0].samples[0].value, 1)
+            self.assertEqual(metrics[1].samples[0].value, 1)
+
+            # The last good metrics are evicted once too stale
+            collector.states[collector.targets[0]].lastSuccessTime -= 120
+            metrics = collector.collect()
+            self.assertEqual(len(metrics[0].samples), 0)
+            self.assertEqual(metrics[1].samples[0].value, 2)
+            self.assertEqual(len(metrics[2].samples), 1)
+
+        self.gdStubber.assert_no_pending_responses()
+
+    def testCollectShouldServeStaleMetricsWhileRevalidatingInBackground(self):
+        # Mock GuardDuty
+        for count in [1, 2]:
+            self.gdStubber.add_response(
+                "list_detectors",
+                {"DetectorIds": ["eu-detector-1"]},
+                {})
+
+            self.gdStubber.add_response(
+                "get_findings_statistics",
+                {"FindingStatistics": {"CountBySeverity": {"2.0": count}}},
+                {"DetectorId": "eu-detector-1", "FindingCriteria": {"Criterion": {"service.archived": {"Eq": ["false"]}}}, "FindingStatisticTypes": ["COUNT_BY_SEVERITY"]})
+
+        with patch("boto3.session.Session", return_value=self.botoSessionMock):
+            collector = GuardDutyMetricsCollector(regions=["eu-west-1"], cacheTtl=60)
+            collector.collect()
+
+            # Hold the revalidation until the stale metrics have been served
+            revalidate = threading.Event()
+            collectTargets = collector._collectTargets
+
+            def _collectTargets(targets):
+                revalidate.wait(5)
+                return collectTargets(targets)
+
+            collector._collectTargets = _collectTargets
+
+            # Expire the cache: the stale metrics are served, while revalidated in background
+            collector.states[collector.targets[0]].lastAttemptTime -= 120
+            metrics = collector.collect()
+            self.assertEqual(metrics[0].samples[0].value, 1)
+            revalidate.set()
+
+            # Wait until the revalidation has completed
+            for _ in range(500):
+                if not collector.inFlightTargets:
+                    break
+                time.sleep(0.01)
+
+            metrics = collector.collect()
+            self.assertEqual(metrics[0].samples[0].value, 2)
+
+        self.gdStubber.assert_no_pending_responses()
+
+    def testCollectShouldShareASingleInFlightCollectionAcrossConcurrentScrapes(self):
+        # Mock GuardDuty
+        self.gdStubber.add_response(
+            "list_detectors",
+            {"DetectorIds": ["eu-detector-1"]},
+            {})
+
+        self.gdStubber.add_response(
+            "get_findings_statistics",
+            {"FindingStatistics": {"CountBySeverity": {"2.0": 1}}},
+            {"DetectorId": "eu-detector-1", "FindingCriteria": {"Criterion": {"service.archived": {"Eq": ["false"]}}}, "FindingStatisticTypes": ["COUNT_BY_SEVERITY"]})
+
+        with patch("boto3.session.Session", return_value=self.botoSessionMock):
+            collector = GuardDutyMetricsCollector(regions=["eu-west-1"])
+            refresh = collector.refresh
+            refreshing = threading.Event()
+            release = threading.Event()
+
+            def slowRefresh():
+                refreshing.set()
+                release.wait()
+                return refresh()
+
+            with patch.object(collector, "refresh", side_effect=slowRefresh) as refreshMock:
+                results = []
+                threads = [threading.Thread(target=lambda: results.append(collector.collect())) for _ in range(5)]
+
+                # Wait until the first scrape is collecting, then run the other ones
+                threads[0].start()
+                refreshing.wait()
+                for thread in threads[1:]:
+                    thread.start()
+
+                time.sleep(0.1)
+                release.set()
+                for thread in threads:
+                    thread.join()
+
+        self.assertEqual(refreshMock.call_count, 1)
+        self.assertEqual([metrics[0].samples[0].value for metrics in results], [1] * 5)
+        self.gdStubber.assert_no_pending_responses()
+
+    def testCollectShouldNotCollectMoreOftenThanTheMinCollectInterval(self):
+        # Mock GuardDuty
+        self.gdStubber.add_response(
+            "list_detectors",
+            {"DetectorIds": ["eu-detector-1"]},
+            {})
+
+        self.gdStubber.add_response(
+            "get_findings_statistics",
+            {"FindingStatistics": {"CountBySeverity": {"2.0": 1}}},
+            {"DetectorId": "eu-detector-1", "FindingCriteria": {"Criterion": {"service.archived": {"Eq": ["false"]}}}, "FindingStatisticTypes": ["COUNT_BY_SEVERITY"]})
+
+        # Collect metrics twice: the second scrape is served from the first collection
+        with patch("boto3.session.Session", return_value=self.botoSessionMock):
+            collector = GuardDutyMetricsCollector(regions=["eu-west-1"], minCollectInterval=60)
+            collector.collect()
+            metrics = collector.collect()
+
+        self.assertEqual(metrics[0].samples[0].value, 1)
+        self.assertEqual(metrics[1].samples[0].value, 0)
+        self.gdStubber.assert_no_pending_responses()
+
+    def testCollectShouldRefreshEachRegionAccordingToItsRefreshTier(self):
+        # Mock GuardDuty
+        for region, count in [("eu", 1), ("us", 2), ("us", 3)]:
+            self.gdStubber.add_response(
+                "list_detectors",
+                {"DetectorIds": [f"{region}-detector-1"]},
+                {})
+
+            self.gdStubber.add_response(
+                "get_findings_statistics",
+                {"FindingStatistics": {"CountBySeverity": {"2.0": count}}},
+                {"DetectorId": f"{region}-detector-1", "FindingCriteria": {"Criterion": {"service.archived": {"Eq": ["false"]}}}, "FindingStatisticTypes": ["COUNT_BY_SEVERITY"]})
+
+        # Collect metrics twice: the second scrape only refreshes the region out of the slow tier
+        with patch("boto3.session.Session", return_value=self.botoSessionMock):
+            collector = GuardDutyMetricsCollector(regions=["eu-west-1", "us-east-1"], maxConcurrency=1, refreshTiers=[RefreshTier(600, ["eu-*"])])
+            collector.collect()
+            metrics = collector.collect()
+
+        self.assertEqual([sample.value for sample in metrics[0].samples if sample.labels["severity"] == "low"], [1, 3])
+        self.assertTrue(300 <= collector.states[collector.targets[0]].nextRefreshDelay <= 600)
+        self.gdStubber.assert_no_pending_responses()
+
+    def testCollectShouldListDetectorsOnlyOnceUntilTheDetectorCacheTtlExpires(self):
+        # Mock GuardDuty
+        self.gdStubber.add_response(
+            "list_detectors",
+            {"DetectorIds": ["eu-detector-1"]},
+            {})
+
+        for count in [1, 2]:
+            self.gdStubber.add_response(
+                "get_findings_statistics",
+                {"FindingStatistics": {"CountBySeverity": {"2.0": count}}},
+                {"DetectorId": "eu-detector-1", "FindingCriteria": {"Criterion": {"service.archived": {"Eq": ["false"]}}}, "FindingStatisticTypes": ["COUNT_BY_SEVERITY"]})
+
+        with patch("boto3.session.Session", return_value=self.botoSessionMock):
+            collector = GuardDutyMetricsCollector(regions=["eu-west-1"], detectorCacheTtl=3600)
+            collector.collect()
+            metrics = collector.collect()
+
+        self.assertEqual(metrics[0].samples[0].value, 2)
+        self.gdStubber.assert_no_pending_responses()
+
+    def testCollectShouldListDetectorsAgainWhenACachedDetectorIsNotFound(self):
+        # Mock GuardDuty
+        self.gdStubber.add_response(
+            "list_detectors",
+            {"DetectorIds": ["eu-detector-1"]},
+            {})
+
+        self.gdStubber.add_client_error("get_findings_statistics", service_error_code="BadRequestException", http_status_code=400)
+
+        self.gdStubber.add_response(
+            "list_detectors",
+            {"DetectorIds": ["eu-detector-2"]},
+            {})
+
+        self.gdStubber.add_response(
+            "get_findings_statistics",
+            {"FindingStatistics": {"CountBySeverity": {"2.0": 1}}},
+            {"DetectorId": "eu-detector-2", "FindingCriteria": {"Criterion": {"service.archived": {"Eq": ["false"]}}}, "FindingStatisticTypes": ["COUNT_BY_SEVERITY"]})
+
+        with patch("boto3.session.Session", return_value=self.botoSessionMock):
+            collector = GuardDutyMetricsCollector(regions=["eu-west-1"], detectorCacheTtl=3600)
+            collector.collect()
+            metrics = collector.collect()
+
+        self.assertEqual(metrics[0].samples[0].value, 1)
+        self.assertEqual(metrics[1].samples[0].value, 1)
+        self.assertEqual(collector.states[collector.targets[0]].detectorIds, ["eu-detector-2"])
+        self.gdStubber.assert_no_pending_responses()
+
+    def testCollectShouldSkipRegionsWithoutDetectorsOrNotEnabled(self):
+        # Mock GuardDuty (the second scrape only calls the region with detectors, because cached)
+        self.gdStubber.add_response(
+            "list_detectors",
+            {"DetectorIds": ["eu-detector-1"]},
+            {})
+
+        self.gdStubber.add_response(
+            "get_findings_statistics",
+            {"FindingStatistics": {"CountBySeverity": {"2.0": 1}}},
+            {"DetectorId": "eu-detector-1", "FindingCriteria": {"Criterion": {"service.archived": {"Eq": ["false"]}}}, "FindingStatisticTypes": ["COUNT_BY_SEVERITY"]})
+
+        self.gdStubber.add_response(
+            "list_detectors",
+            {"DetectorIds": []},
+            {})
+
+        self.gdStubber.add_client_error("list_detectors", service_error_code="UnrecognizedClientException", http_status_code=403)
+
+        self.gdStubber.add_response(
+            "get_findings_statistics",
+            {"FindingStatistics": {"CountBySeverity": {"2.0": 2}}},
+            {"DetectorId": "eu-detector-1", "FindingCriteria": {"Criterion": {"service.archived": {"Eq": ["false"]}}}, "FindingStatisticTypes": ["COUNT_BY_SEVERITY"]})
+
+        with patch("boto3.session.Session", return_value=self.botoSessionMock):
+            collector = GuardDutyMetricsCollector(regions=["eu-west-1", "us-east-1", "ap-east-1"], maxConcurrency=1, detectorCacheTtl=3600, skipRegionsWithoutDetectors=True)
+
+            with patch.object(logging.getLogger(), "warning") as warningMock:
+                collector.collect()
+
+            metrics = collector.collect()
+
+        self.assertEqual(metrics[0].samples[0].value, 2)
+        self.assertEqual({sample.labels["region"] for metric in metrics[:4] for sample in metric.samples}, {"eu-west-1"})
+        self.assertEqual(metrics[1].samples[0].value, 0)
+
+        # The regions skipped because of an error code are logged and counted, as the credentials may be invalid
+        warningMock.assert_called_once()
+        self.assertIn("ap-east-1", warningMock.call_args.args[0])
+        self.assertIn("UnrecognizedClientException", warningMock.call_args.args[0])
+
+        regionsSkippedMetric = {metric.name: metric for metric in metrics}["aws_guardduty_regions_skipped"]
+        self.assertEqual([(sample.labels, sample.value) for sample in regionsSkippedMetric.samples], [
+            ({"account_id": "", "reason": "UnrecognizedClientException"}, 1),
+            ({"account_id": "", "reason": "no_detectors"}, 1),
+        ])
+        self.gdStubber.assert_no_pending_responses()
+
+    def testCollectShouldSkipRegionsWithoutDetectorsWithTheDefaultDetectorCacheTtl(self):
+        # Mock GuardDuty (the second scrape lists the detectors of the region with detectors only)
+        for count in [1, 2]:
+            self.gdStubber.add_response(
+                "list_detectors",
+                {"DetectorIds": ["eu-detector-1"]},
+                {})
+
+            self.gdStubber.add_response(
+                "get_findings_statistics",
+                {"FindingStatistics": {"CountBySeverity": {"2.0": count}}},
+                {"DetectorId": "eu-detector-1", "FindingCriteria": {"Criterion": {"service.archived": {"Eq": ["false"]}}}, "FindingStatisticTypes": ["COUNT_BY_SEVERITY"]})
+
+            if count == 1:
+                self.gdStubber.add_response(
+                    "list_detectors",
+                    {"DetectorIds": []},
+                    {})
+
+        with patch("boto3.session.Session", return_value=self.botoSessionMock):
+            collector = GuardDutyMetricsCollector(regions=["eu-west-1", "us-east-1"], maxConcurrency=1, skipRegionsWithoutDetectors=True)
+            collector.collect()
+            metrics = collector.collect()
+
+        self.assertEqual(metrics[0].samples[0].value, 2)
+        self.assertEqual({sample.labels["region"] for metric in metrics[:4] for sample in metric.samples}, {"eu-west-1"})
+        self.gdStubber.assert_no_pending_responses()
+
+    def testCollectShouldApplySeriesBudgetsAndFilters(self):
+        # Mock GuardDuty
+        self.gdStubber.add_response(
+            "list_detectors",
+            {"DetectorIds": ["eu-detector-1"]},
+            {})
+
+        self.gdStubber.add_response(
+            "get_findings_statistics",
+            {"FindingStatistics": {"CountBySeverity": {"2.0": 1, "5.0": 2, "8.0": 3, "8.5": 4}}},
+            {"DetectorId": "eu-detector-1", "FindingCriteria": {"Criterion": {"service.archived": {"Eq": ["false"]}}}, "FindingStatisticTypes": ["COUNT_BY_SEVERITY"]})
+
+        with patch("boto3.session.Session", return_value=self.botoSessionMock):
+            collector = GuardDutyMetricsCollector(
+                regions=["eu-west-1", "us-east-1"],
+                breakdowns=["severity_level"],
+                maxSeriesPerMetric=2,
+                excludeRegions=["us-*"],
+                excludeSeverities=["low"])
+            metrics = {metric.name: metric for metric in collector.collect()}
+
+        self.assertEqual([(sample.labels["severity"], sample.value) for sample in metrics["aws_guardduty_current_findings"].samples], [("medium", 2), ("high", 7)])
+
+        # The 4 severity levels of eu-west-1 don't fit the budget, so that the region is not partially exported
+        self.assertEqual(metrics["aws_guardduty_current_findings_by_severity_level"].samples, [])
+
+        seriesMetric = metrics["aws_guardduty_series"]
+        self.assertIn(({"metric": "aws_guardduty_current_findings_by_severity_level"}, 0), [(sample.labels, sample.value) for sample in seriesMetric.samples])
+
+        droppedSeriesMetric = metrics["aws_guardduty_series_dropped"]
+        self.assertIn(({"metric": "aws_guardduty_current_findings_by_severity_level"}, 4), [(sample.labels, sample.value) for sample in droppedSeriesMetric.samples])
+        self.assertIn(({"metric": "aws_guardduty_current_findings"}, 0), [(sample.labels, sample.value) for sample in droppedSeriesMetric.samples])
+
+        self.gdStubber.assert_no_pending_responses()
+
+    def testCollectShouldReuseTheSamplesOfTargetsNotRefreshed(self):
+        # Mock GuardDuty
+        self.gdStubber.add_response(
+            "list_detectors",
+            {"DetectorIds": ["eu-detector-1"]},
+            {})
+
+        self.gdStubber.add_response(
+            "get_findings_statistics",
+            {"FindingStatistics": {"CountBySeverity": {"2.0": 1}}},
+            {"DetectorId": "eu-detector-1", "FindingCriteria": {"Criterion": {"service.archived": {"Eq": ["false"]}}}, "FindingStatisticTypes": ["COUNT_BY_SEVERITY"]})
+
+        with patch("boto3.session.Session", return_value=self.botoSessionMock):
+            collector = GuardDutyMetricsCollector(regions=["eu-west-1"], cacheTtl=60)
+            firstMetrics = collector.collect()
+            secondMetrics = collector.collect()
+
+        self.assertIsNot(firstMetrics[0], secondMetrics[0])
+        self.assertIs(firstMetrics[0].samples[0], secondMetrics[0].samples[0])
+        self.gdStubber.assert_no_pending_responses()
+
+    def testReconfigureShouldScrapeOnlyTheAddedTargetsAndKeepTheStateOfTheOtherOnes(self):
+        # Mock GuardDuty
+        for region, count in [("eu", 1), ("us", 2), ("ap", 3)]:
+            self.gdStubber.add_response(
+                "list_detectors",
+                {"DetectorIds": [f"{region}-detector-1"]},
+                {})
+
+            self.gdStubber.add_response(
+                "get_findings_statistics",
+                {"FindingStatistics": {"CountBySeverity": {"2.0": count}}},
+                {"DetectorId": f"{region}-detector-1", "FindingCriteria": {"Criterion": {"service.archived": {"Eq": ["false"]}}}, "FindingStatisticTypes": ["COUNT_BY_SEVERITY"]})
+
+        # Collect metrics before and after replacing us-east-1 with ap-south-1
+        with patch("boto3.session.Session", return_value=self.botoSessionMock):
+            collector = GuardDutyMetricsCollector(regions=["eu-west-1", "us-east-1"], maxConcurrency=1, cacheTtl=600)
+            collector.collect()
+            euState = collector.states[collector.targets[0]]
+
+            collector.reconfigure(regions=["eu-west-1", "ap-south-1"], maxConcurrency=2, readTimeout=5)
+            metrics = collector.collect()
+
+        self.assertEqual([(sample.labels["region"], sample.value) for sample in metrics[0].samples if sample.labels["severity"] == "low"], [("eu-west-1", 1), ("ap-south-1", 3)])
+        self.assertIs(collector.states[collector.targets[0]], euState)
+        self.assertEqual([target.region for target in collector.states], ["eu-west-1", "ap-south-1"])
+        self.assertEqual(collector.maxConcurrency, 2)
+        self.assertEqual(collector.botoConfig.read_timeout, 5)
+
+        # The collection duration of the removed target is not exported anymore
+        durationMetric = {metric.name: metric for metric in metrics}["aws_guardduty_region_collect_duration_seconds"]
+        self.assertEqual({sample.labels["region"] for sample in durationMetric.samples}, {"eu-west-1", "ap-south-1"})
+        self.gdStubber.assert_no_pending_responses()
+
+    def testReconfigureShouldRefreshTheTargetsMovedToAFasterTierInTime(self):
+        # Mock GuardDuty
+        self.gdStubber.add_response(
+            "list_detectors",
+            {"DetectorIds": ["eu-detector-1"]},
+            {})
+
+        self.gdStubber.add_response(
+            "get_findings_statistics",
+            {"FindingStatistics": {"CountBySeverity": {"2.0": 1}}},
+            {"DetectorId": "eu-detector-1", "FindingCriteria": {"Criterion": {"service.archived": {"Eq": ["false"]}}}, "FindingStatisticTypes": ["COUNT_BY_SEVERITY"]})
+
+        with patch("boto3.session.Session", return_value=self.botoSessionMock):
+            collector = GuardDutyMetricsCollector(regions=["eu-west-1"], refreshTiers=[RefreshTier(600, ["eu-*"])])
+            collector.collect()
+            collector.reconfigure(regions=["eu-west-1"], refreshTiers=[RefreshTier(30, ["eu-*"])])
+
+        state = collector.states[collector.targets[0]]
+        self.assertEqual(state.refreshInterval, 30)
+        self.assertLessEqual(collector._getRefreshTime(state) - state.lastAttemptTime, 30)
+        self.gdStubber.assert_no_pending_responses()
+
+    def testCollectShouldSkipRegionWhileCircuitBreakerIsOpen(self):
+        # Mock GuardDuty
+        self.gdStubber.add_client_error("list_detectors")
+        self.gdStubber.add_client_error("list_detectors")
+
+        with patch("boto3.session.Session", return_value=self.botoSessionMock):
+            collector = GuardDutyMetricsCollector(regions=["eu-west-1"], circuitBreakerThreshold=2, circuitBreakerCooldown=60)
+            collector.collect()
+            metrics = collector.collect()
+
+            # No API call is issued while the circuit breaker is open
+            metrics = collector.collect()
+
+        self.assertEqual(metrics[1].samples[0].value, 2)
+
+        circuitBreakerMetric = metrics[3]
+        self.assertEqual(circuitBreakerMetric.name, "aws_guardduty_circuit_breaker_open")
+        self.assertEqual(circuitBreakerMetric.samples[0].labels, {"account_id": "", "region": "eu-west-1"})
+        self.assertEqual(circuitBreakerMetric.samples[0].value, 1)
+
+        self.gdStubber.assert_no_pending_responses()
+
+    def testCollectShouldSlowDownRateLimiterOnThrottling(self):
+        # Mock GuardDuty
+        self.gdStubber.add_client_error("list_detectors", service_error_code="TooManyRequestsException", http_status_code=429)
+
+        with patch("boto3.session.Session", return_value=self.botoSessionMock):
+            collector = GuardDutyMetricsCollector(regions=["eu-west-1"], rateLimit=10)
+            collector.collect()
+
+        self.assertEqual(collector.states[collector.targets[0]].rateLimiter.rate, 5)
+        self.gdStubber.assert_no_pending_responses()
+
+    def testCollectShouldReturnFindingsBreakdownsWithOneCallPerBreakdown(self):
+        # Mock GuardDuty
+        self.gdStubber.add_response(
+            "list_detectors",
+            {"DetectorIds": ["eu-detector-1"]},
+            {})
+
+        self.gdStubber.add_response(
+            "get_findings_statistics",
+            {"FindingStatistics": {"CountBySeverity": {"2": 1, "8.0": 2, "8.5": 3}}},
+            {"DetectorId": "eu-detector-1", "FindingCriteria": {"Criterion": {"service.archived": {"Eq": ["false"]}}}, "FindingStatisticTypes": ["COUNT_BY_SEVERITY"]})
+
+        self.gdStubber.add_response(
+            "get_findings_statistics",
+            {"FindingStatistics": {"GroupedByFindingType": [
+                {"FindingType": "Recon:EC2/PortProbeUnprotectedPort", "TotalFindings": 4},
+                {"FindingType": "UnauthorizedAccess:EC2/SSHBruteForce", "TotalFindings": 1},
+                {"FindingType": "Policy:S3/BucketBlockPublicAccessDisabled", "TotalFindings": 1},
+                {"FindingType": "Recon:IAMUser/MaliciousIPCaller", "TotalFindings": 1},
+            ]}},
+            {"DetectorId": "eu-detector-1", "FindingCriteria": {"Criterion": {"service.archived": {"Eq": ["false"]}}}, "GroupBy": "FINDING_TYPE", "OrderBy": "DESC", "MaxResults": 100})
+
+        # Collect metrics
+        with patch("boto3.session.Session", return_value=self.botoSessionMock):
+            collector = GuardDutyMetricsCollector(regions=["eu-west-1"], breakdowns=["finding_type", "severity_level"], breakdownLimit=3)
+            metrics = {metric.name: metric for metric in collector.collect()}
+
+        severityLevelMetric = metrics["aws_guardduty_current_findings_by_severity_level"]
+        self.assertEqual({sample.labels["severity_level"]: sample.value for sample in severityLevelMetric.samples}, {"2.0": 1, "8.0": 2, "8.5": 3})
+
+        findingTypeMetric = metrics["aws_guardduty_current_findings_by_finding_type"]
+        self.assertEqual(findingTypeMetric.samples[0].labels, {"account_id": "", "region": "eu-west-1", "finding_type": "Recon:EC2/PortProbeUnprotectedPort"})
+        self.assertEqual({sample.labels["finding_type"]: sample.value for sample in findingTypeMetric.samples}, {"Recon:EC2/PortProbeUnprotectedPort": 4, "UnauthorizedAccess:EC2/SSHBruteForce": 1, "other": 2})
+
+        self.assertNotIn("aws_guardduty_current_findings_by_resource_type", metrics)
+
+        self.gdStubber.assert_no_pending_responses()
+
+    def testCollectShouldTrackNewFindingsIncrementally(self):
+        def buildFinding(findingId, severity, createdAt):
+            return {
+                "AccountId": "111111111111", "Arn": "arn", "CreatedAt": createdAt, "Id": findingId, "Region": "eu-west-1",
+                "Resource": {}, "SchemaVersion": "2.0", "Severity": severity, "Type": "Recon:EC2/PortProbeUnprotectedPort",
+                "UpdatedAt": createdAt, "Service": {"Archived": False},
+            }
+
+        # Mock GuardDuty: the initial sync fetches all unarchived findings, in pages
+        self.gdStubber.add_response("list_detectors", {"DetectorIds": ["eu-detector-1"]}, {})
+        self.gdStubber.add_response("get_findings_statistics", {"FindingStatistics": {"CountBySeverity": {"8.0": 2}}})
+        self.gdStubber.add_response("list_findings", {"FindingIds": ["finding-1"], "NextToken": "page-2"})
+        self.gdStubber.add_response("get_findings", {"Findings": [buildFinding("finding-1", 8.0, "2024-01-01T00:00:00.000Z")]}, {"DetectorId": "eu-detector-1", "FindingIds": ["finding-1"]})
+        self.gdStubber.add_response("list_findings", {"FindingIds": ["finding-2"]})
+        self.gdStubber.add_response("get_findings", {"Findings": [buildFinding("finding-2", 8.0, "2024-01-02T00:00:00.000Z")]}, {"DetectorId": "eu-detector-1", "FindingIds": ["finding-2"]})
+
+        # Mock GuardDuty: the next poll only fetches the updated findings
+        self.gdStubber.add_response("list_detectors", {"DetectorIds": ["eu-detector-1"]}, {})
+        self.gdStubber.add_response("get_findings_statistics", {"FindingStatistics": {"CountBySeverity": {"8.0": 2, "2.0": 1}}})
+        self.gdStubber.add_response("list_findings", {"FindingIds": ["finding-3"]})
+        self.gdStubber.add_response("get_findings", {"Findings": [buildFinding("finding-3", 2.0, "2024-01-03T00:00:00.000Z")]}, {"DetectorId": "eu-detector-1", "FindingIds": ["finding-3"]})
+
+        with patch("boto3.session.Session", return_value=self.botoSessionMock):
+            collector = GuardDutyMetricsCollector(regions=["eu-west-1"], trackFindings=True)
+
+            metrics = {metric.name: metric for metric in collector.collect()}
+            newFindingsMetric = metrics["aws_guardduty_findings_new"]
+            self.assertEqual([sample.value for sample in newFindingsMetric.samples if sample.name.endswith("_total")], [0, 0, 0])
+
+            metrics = {metric.name: metric for metric in collector.collect()}
+            newFindingsMetric = metrics["aws_guardduty_findings_new"]
+            self.assertEqual({sample.labels["severity"]: sample.value for sample in newFindingsMetric.samples if sample.name.endswith("_total")}, {"low": 1, "medium": 0, "high": 0})
+
+        oldestFindingMetric = metrics["aws_guardduty_oldest_unarchived_finding_age_seconds"]
+        self.assertEqual(oldestFindingMetric.samples[0].labels, {"account_id": "", "region": "eu-west-1"})
+        self.assertAlmostEqual(oldestFindingMetric.samples[0].value, time.time() - 1704067200, delta=60)
+
+        self.gdStubber.assert_no_pending_responses()
+
+    def testCollectShouldSyncFindingsAgainWhenTheIndexDiffersFromTheCurrentFindings(self):
+        # Mock GuardDuty: a finding has been deleted since the previous poll, which fetches no updated findings
+        for _ in range(2):
+            self.gdStubber.add_response("list_detectors", {"DetectorIds": ["eu-detector-1"]}, {})
+            self.gdStubber.add_response("get_findings_statistics", {"FindingStatistics": {"CountBySeverity": {"8.0": 1}}})
+            self.gdStubber.add_response("list_findings", {"FindingIds": []})
+
+        with patch("boto3.session.Session", return_value=self.botoSessionMock):
+            collector = GuardDutyMetricsCollector(regions=["eu-west-1"], trackFindings=True)
+            tracker = collector._getFindingsTrackers(collector.targets[0], ["eu-detector-1"])[0]
+            tracker.watermark = 1704067200000
+            tracker.findings = {"finding-1": IndexedFinding(8.0, "Recon:EC2/PortProbeUnprotectedPort", False, 1704067200), "finding-2": IndexedFinding(8.0, "Recon:EC2/PortProbeUnprotectedPort", False, 1704067200)}
+
+            # The mismatch must show up on two consecutive refreshes
+            collector.collect()
+            self.assertIsNotNone(tracker.watermark)
+
+            collector.collect()
+
+        # The next poll syncs all the unarchived findings again
+        self.assertIsNone(tracker.watermark)
+        self.gdStubber.assert_no_pending_responses()
+
+    def testCollectShouldExportStatisticsAndResumeTrackingWhenPollingFindingsFails(self):
+        finding = {
+            "AccountId": "111111111111", "Arn": "arn", "CreatedAt": "2024-01-01T00:00:00.000Z", "Id": "finding-1", "Region": "eu-west-1",
+            "Resource": {}, "SchemaVersion": "2.0", "Severity": 8.0, "Type": "Recon:EC2/PortProbeUnprotectedPort",
+            "UpdatedAt": "2024-01-01T00:00:00.000Z", "Service": {"Archived": False},
+        }
+
+        # Mock GuardDuty: the initial sync fails on the second page
+        self.gdStubber.add_response("list_detectors", {"DetectorIds": ["eu-detector-1"]}, {})
+        self.gdStubber.add_response("get_findings_statistics", {"FindingStatistics": {"CountBySeverity": {"8.0": 2}}})
+        self.gdStubber.add_response("list_findings", {"FindingIds": ["finding-1"], "NextToken": "page-2"})
+        self.gdStubber.add_response("get_findings", {"Findings": [finding]}, {"DetectorId": "eu-detector-1", "FindingIds": ["finding-1"]})
+        self.gdStubber.add_client_error("list_findings")
+
+        # Mock GuardDuty: the next poll resumes from the last fetched finding
+        self.gdStubber.add_response("list_detectors", {"DetectorIds": ["eu-detector-1"]}, {})
+        self.gdStubber.add_response("get_findings_statistics", {"FindingStatistics": {"CountBySeverity": {"8.0": 2}}})
+        self.gdStubber.add_response("list_findings", {"FindingIds": ["finding-2"]}, {
+            "DetectorId": "eu-detector-1",
+            "FindingCriteria": {"Criterion": {"service.archived": {"Eq": ["false"]}, "updatedAt": {"GreaterThanOrEqual": 1704067200000}}},
+            "SortCriteria": {"AttributeName": "updatedAt", "OrderBy": "ASC"},
+            "MaxResults": 50,
+        })
+        self.gdStubber.add_response("get_findings", {"Findings": [dict(finding, Id="finding-2")]}, {"DetectorId": "eu-detector-1", "FindingIds": ["finding-2"]})
+
+        with patch("boto3.session.Session", return_value=self.botoSessionMock):
+            collector = GuardDutyMetricsCollector(regions=["eu-west-1"], trackFindings=True)
+
+            with patch.object(collector, "_logTrackingError") as logTrackingErrorMock:
+                metrics = {metric.name: metric for metric in collector.collect()}
+
+            # The statistics are still exported
+            self.assertEqual(logTrackingErrorMock.call_args.args[:2], (collector.targets[0], "eu-detector-1"))
+            self.assertEqual([sample.value for sample in metrics["aws_guardduty_current_findings"].samples], [0, 0, 2])
+            self.assertEqual([sample.value for sample in metrics["aws_guardduty_scrape_errors"].samples if sample.name.endswith("_total")], [0])
+
+            collector.collect()
+
+        tracker = collector._getFindingsTrackers(collector.targets[0], ["eu-detector-1"])[0]
+        self.assertEqual(sorted(tracker.findings.keys()), ["finding-1", "finding-2"])
+        self.assertIsNotNone(tracker.watermark)
+        self.gdStubber.assert_no_pending_responses()
+
+    def testStartShouldRestoreTheStateSavedOnStop(self):
+        # Mock GuardDuty
+        self.gdStubber.add_response(
+            "list_detectors",
+            {"DetectorIds": ["eu-detector-1"]},
+            {})
+
+        self.gdStubber.add_response(
+            "get_findings_statistics",
+            {"FindingStatistics": {"CountBySeverity": {"2.0": 1}}},
+            {"DetectorId": "eu-detector-1", "FindingCriteria": {"Criterion": {"service.archived": {"Eq": ["false"]}}}, "FindingStatisticTypes": ["COUNT_BY_SEVERITY"]})
+
+        self.gdStubber.add_client_error("list_detectors")
+
+        with tempfile.TemporaryDirectory() as tmpDir:
+            stateFilepath = os.path.join(tmpDir, "state.json.gz")
+
+            with patch("boto3.session.Session", return_value=self.botoSessionMock):
+                collector = GuardDutyMetricsCollector(regions=["eu-west-1"], maxStaleness=600, stateFilepath=stateFilepath)
+                collector.start()
+                collector.collect()
+                collector.collect()
+                collector.stop()
+
+            # Metrics are served from the restored state, without calling AWS
+            with patch("boto3.session.Session", return_value=self.botoSessionMock):
+                collector = GuardDutyMetricsCollector(regions=["eu-west-1"], cacheTtl=600, maxStaleness=600, stateFilepath=stateFilepath)
+                collector.start()
+                metrics = collector.collect()
+
+        self.assertEqual(metrics[0].samples[0].labels, {"account_id": "", "region": "eu-west-1", "severity": "low"})
+        self.assertEqual(metrics[0].samples[0].value, 1)
+        self.assertEqual(metrics[1].samples[0].value, 1)
+        self.assertEqual(len(metrics[2].samples), 1)
 
         self.gdStubber.assert_no_pending_responses()
@@ -0,0 +1,60 @@
+import os
+import tempfile
+import unittest
+from prometheus_aws_guardduty_exporter.config import ConfigFile, parseConfig
+from prometheus_aws_guardduty_exporter.scheduling import RefreshTier
+
+
+class TestConfig(unittest.TestCase):
+    def setUp(self):
+        self.tmpDir = tempfile.TemporaryDirectory()
+        self.filepath = os.path.join(self.tmpDir.name, "config.yml")
+
+    def tearDown(self):
+        self.tmpDir.cleanup()
+
+    def testParseConfigShouldReturnTheCollectorArguments(self):
+        config = parseConfig({
+            "regions": ["eu-west-1", "us-east-1"],
+            "role_arns": ["arn:aws:iam::123456789012:role/guardduty"],
+            "refresh_tiers": ["600:eu-*", {"interval": 60, "patterns": ["123456789012/us-*"]}],
+            "max_concurrency": 8,
+            "connect_timeout": 1,
+            "read_timeout": 5,
+        })
+
+        self.assertEqual(config, {
+            "regions": ["eu-west-1", "us-east-1"],
+            "roleArns": ["arn:aws:iam::123456789012:role/guardduty"],
+            "refreshTiers": [RefreshTier(600, ["eu-*"]), RefreshTier(60, ["123456789012/us-*"])],
+            "maxConcurrency": 8,
+            "connectTimeout": 1,
+            "readTimeout": 5,
+        })
+
+    def testParseConfigShouldRaiseErrorOnInvalidConfig(self):
+        with self.assertRaisesRegex(ValueError, "Unknown config settings: region"):
+            parseConfig({"region": "eu-west-1"})
+
+        with self.assertRaisesRegex(ValueError, "Invalid config regions"):
+            parseConfig({"regions": "eu-west-1"})
+
+        with self.assertRaisesRegex(ValueError, "Invalid refresh tier"):
+            parseConfig({"refresh_tiers": [{"interval": 60}]})
+
+    def testLoadShouldReturnTheConfigAndTrackChanges(self):
+        with open(self.filepath, "w") as file:
+            file.write("regions:\n  - eu-west-1\nread_timeout: 5\n")
+
+        configFile = ConfigFile(self.filepath)
+        self.assertTrue(configFile.hasChanged())
+        self.assertEqual(configFile.load(), {"regions": ["eu-west-1"], "readTimeout": 5})
+        self.assertFalse(configFile.hasChanged())
+
+        # Empty config files set nothing
+        with open(self.filepath, "w") as file:
+            file.write("")
+
+        os.utime(self.filepath, ns=(0, 0))
+        self.assertTrue(configFile.hasChanged())
+        self.assertEqual(configFile.load(), {})
@@ -0,0 +1,24 @@
+import boto3
+import unittest
+from botocore.exceptions import ClientError
+from prometheus_aws_guardduty_exporter.detectors import discoverRegions, isDetectorNotFoundError, isRegionDisabledError
+
+
+class TestDetectors(unittest.TestCase):
+    def testIsDetectorNotFoundErrorShouldMatchBadRequestAndNotFoundErrors(self):
+        self.assertTrue(isDetectorNotFoundError(ClientError({"Error": {"Code": "BadRequestException"}}, "GetFindingsStatistics")))
+        self.assertTrue(isDetectorNotFoundError(ClientError({"Error": {"Code": "ResourceNotFoundException"}}, "GetFindingsStatistics")))
+        self.assertFalse(isDetectorNotFoundError(ClientError({"Error": {"Code": "InternalServerErrorException"}}, "GetFindingsStatistics")))
+        self.assertFalse(isDetectorNotFoundError(ValueError()))
+
+    def testIsRegionDisabledErrorShouldMatchUnrecognizedClientErrors(self):
+        self.assertTrue(isRegionDisabledError(ClientError({"Error": {"Code": "UnrecognizedClientException"}}, "ListDetectors")))
+        self.assertFalse(isRegionDisabledError(ClientError({"Error": {"Code": "AccessDeniedException"}}, "ListDetectors")))
+
+    def testDiscoverRegionsShouldReturnTheRegionsWhereGuardDutyIsAvailable(self):
+        regions = discoverRegions()
+
+        self.assertIn("us-east-1", regions)
+        self.assertIn("eu-west-1", regions)
+        self.assertNotIn("cn-north-1", regions)
+        self.assertEqual(regions, boto3.session.Session().get_available_regions("guardduty"))
@@ -0,0 +1,143 @@
+import gzip
+import threading
+import time
+import unittest
+import urllib.request
+from prometheus_client import CollectorRegistry
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_aws_guardduty_exporter.exposition import CachedExposition, startCachedMetricsServer
+
+
+class CollectorMock():
+    def __init__(self, refreshInterval=None):
+        self.refreshInterval = refreshInterval
+        self.snapshotTimestamp = None
+        self.collects = 0
+        self.collecting = threading.Event()
+        self.release = threading.Event()
+        self.release.set()
+
+    def describe(self):
+        return []
+
+    def collect(self):
+        self.collects += 1
+        self.collecting.set()
+        self.release.wait()
+
+        if self.refreshInterval is not None:
+            return self.collectSnapshot() + self.collectRuntime()
+
+        metric = GaugeMetricFamily("aws_guardduty_current_findings", "The current number of unarchived findings", labels=["region"])
+        metric.add_metric(value=self.collects, labels=["eu-west-1"])
+
+        return [metric]
+
+    def collectSnapshot(self):
+        metric = GaugeMetricFamily("aws_guardduty_current_findings", "The current number of unarchived findings", labels=["region"])
+        metric.add_metric(value=self.snapshotTimestamp, labels=["eu-west-1"])
+
+        return [metric]
+
+    def collectRuntime(self):
+        return [GaugeMetricFamily("aws_guardduty_snapshot_age_seconds", "The number of seconds since the metrics snapshot has been refreshed", value=time.time() - self.snapshotTimestamp)]
+
+
+class TestCachedExposition(unittest.TestCase):
+    def setUp(self):
+        self.registry = CollectorRegistry()
+
+    def testGetPayloadShouldRenderThePayloadOncePerRefreshWhenRefreshingInBackground(self):
+        collector = CollectorMock(refreshInterval=60)
+        collector.snapshotTimestamp = 1
+        self.registry.register(collector)
+        exposition = CachedExposition(self.registry, collector)
+
+        self.assertIn(b'aws_guardduty_current_findings{region="eu-west-1"} 1.0', exposition.getPayload().text)
+        self.assertIn(b'aws_guardduty_current_findings{region="eu-west-1"} 1.0', exposition.getPayload().text)
+        self.assertEqual(exposition.renders, 1)
+
+        # A new snapshot has been built
+        collector.snapshotTimestamp = 2
+        self.assertIn(b'aws_guardduty_current_findings{region="eu-west-1"} 2.0', exposition.getPayload().text)
+        self.assertEqual(exposition.renders, 2)
+
+    def testGetPayloadShouldRenderTheSnapshotAgeOnEachScrapeWhenRefreshingInBackground(self):
+        def getSnapshotAge(payload):
+            return [float(line.split()[1]) for line in payload.text.decode("utf-8").splitlines() if line.startswith("aws_guardduty_snapshot_age_seconds ")]
+
+        collector = CollectorMock(refreshInterval=60)
+        collector.snapshotTimestamp = time.time()
+        self.registry.register(collector)
+        exposition = CachedExposition(self.registry, collector)
+
+        firstPayload = exposition.getPayload()
+        time.sleep(0.05)
+        secondPayload = exposition.getPayload()
+
+        self.assertEqual(exposition.renders, 1)
+        self.assertEqual(len(getSnapshotAge(firstPayload)), 1)
+        self.assertGreater(getSnapshotAge(secondPayload)[0], getSnapshotAge(firstPayload)[0])
+
+        # The snapshot and the time-dependent metrics are rendered as a single valid payload
+        self.assertEqual(gzip.decompress(secondPayload.textGzip), secondPayload.text)
+        self.assertEqual(gzip.decompress(secondPayload.openMetricsGzip), secondPayload.openMetrics)
+        self.assertEqual(secondPayload.openMetrics.count(b"# EOF"), 1)
+        self.assertTrue(secondPayload.openMetrics.endswith(b"# EOF\n"))
+        self.assertEqual(secondPayload.text.count(b"# TYPE aws_guardduty_current_findings "), 1)
+
+    def testGetPayloadShouldRenderAllFormats(self):
+        collector = CollectorMock()
+        self.registry.register(collector)
+        payload = CachedExposition(self.registry, collector).getPayload()
+
+        self.assertEqual(gzip.decompress(payload.textGzip), payload.text)
+        self.assertEqual(gzip.decompress(payload.openMetricsGzip), payload.openMetrics)
+        self.assertTrue(payload.openMetrics.endswith(b"# EOF\n"))
+
+    def testGetPayloadShouldCoalesceConcurrentScrapesWhenCollectingOnDemand(self):
+        collector = CollectorMock()
+        collector.release.clear()
+        self.registry.register(collector)
+        exposition = CachedExposition(self.registry, collector)
+
+        payloads = []
+        threads = [threading.Thread(target=lambda: payloads.append(exposition.getPayload())) for _ in range(5)]
+
+        # Wait until the first scrape is collecting, then run the other ones
+        threads[0].start()
+        collector.collecting.wait()
+        for thread in threads[1:]:
+            thread.start()
+
+        time.sleep(0.1)
+        collector.release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(collector.collects, 1)
+        self.assertEqual(len(set(payloads)), 1)
+
+        # A later scrape triggers a new collection
+        exposition.getPayload()
+        self.assertEqual(collector.collects, 2)
+
+    def testServerShouldNegotiateTheFormatAndEncoding(self):
+        collector = CollectorMock()
+        self.registry.register(collector)
+        exposition = CachedExposition(self.registry, collector)
+        server = startCachedMetricsServer(exposition, 0, "127.0.0.1")
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        url = f"http://127.0.0.1:{server.server_address[1]}/metrics"
+
+        with urllib.request.urlopen(url) as response:
+            self.assertTrue(response.headers["Content-Type"].startswith("text/plain"))
+            self.assertIsNone(response.headers["Content-Encoding"])
+            self.assertIn(b"aws_guardduty_current_findings", response.read())
+
+        request = urllib.request.Request(url, headers={"Accept": "application/openmetrics-text; version=1.0.0", "Accept-Encoding": "gzip"})
+        with urllib.request.urlopen(request) as response:
+            self.assertTrue(response.headers["Content-Type"].startswith("application/openmetrics-text"))
+            self.assertEqual(response.headers["Content-Encoding"], "gzip")
+            self.assertTrue(gzip.decompress(response.read()).endswith(b"# EOF\n"))
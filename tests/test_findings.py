@@ -0,0 +1,138 @@
+import unittest
+from prometheus_aws_guardduty_exporter.findings import FindingsTracker, addFindingsTracking, parseTimestamp
+
+
+def buildFinding(findingId, severity=5.0, archived=False, createdAt="2024-01-01T00:00:00.000Z", updatedAt="2024-01-02T00:00:00.000Z"):
+    return {
+        "Id": findingId,
+        "Type": "Recon:EC2/PortProbeUnprotectedPort",
+        "Severity": severity,
+        "CreatedAt": createdAt,
+        "UpdatedAt": updatedAt,
+        "Service": {"Archived": archived},
+    }
+
+
+class TestFindingsTracker(unittest.TestCase):
+    def testGetListFindingsParamsShouldOnlyFetchUnarchivedFindingsOnInitialSync(self):
+        tracker = FindingsTracker()
+
+        self.assertEqual(tracker.getListFindingsParams("detector-1"), {
+            "DetectorId": "detector-1",
+            "FindingCriteria": {"Criterion": {"service.archived": {"Eq": ["false"]}}},
+            "SortCriteria": {"AttributeName": "updatedAt", "OrderBy": "ASC"},
+            "MaxResults": 50,
+        })
+
+    def testGetListFindingsParamsShouldFetchFindingsUpdatedSinceTheWatermark(self):
+        tracker = FindingsTracker()
+        tracker.update([buildFinding("finding-1", updatedAt="2024-01-02T00:00:00.000Z")], parseTimestamp("2024-01-01T00:00:00.000Z"))
+
+        params = tracker.getListFindingsParams("detector-1", "token")
+        self.assertEqual(params["FindingCriteria"], {"Criterion": {"updatedAt": {"GreaterThanOrEqual": 1704153600000}}})
+        self.assertEqual(params["NextToken"], "token")
+
+    def testUpdateShouldMoveTheWatermarkToThePollStartTimeOnEmptyInitialSync(self):
+        tracker = FindingsTracker()
+        tracker.update([], 1704153600)
+
+        self.assertEqual(tracker.watermark, 1704153600000 - 60000)
+
+    def testUpdateShouldCountNewUnarchivedFindingsAfterTheInitialSync(self):
+        tracker = FindingsTracker()
+        tracker.update([buildFinding("finding-1", severity=8.0)], 1704153600)
+        self.assertEqual(tracker.newFindings, {"low": 0, "medium": 0, "high": 0})
+
+        tracker.update([
+            buildFinding("finding-1", severity=8.0, archived=True, updatedAt="2024-01-03T00:00:00.000Z"),
+            buildFinding("finding-2", severity=2.0, createdAt="2024-01-03T00:00:00.000Z", updatedAt="2024-01-03T00:00:00.000Z"),
+            buildFinding("finding-3", severity=5.0, archived=True, updatedAt="2024-01-03T00:00:00.000Z"),
+        ], 1704240000)
+
+        self.assertEqual(tracker.newFindings, {"low": 1, "medium": 0, "high": 0})
+        self.assertEqual(tracker.getOldestUnarchivedCreatedAt(), parseTimestamp("2024-01-03T00:00:00.000Z"))
+
+    def testUpdateShouldDropArchivedFindingsFromTheIndex(self):
+        tracker = FindingsTracker()
+        tracker.update([buildFinding("finding-1"), buildFinding("finding-2")], 1704153600)
+        tracker.update([buildFinding("finding-1", archived=True, updatedAt="2024-01-03T00:00:00.000Z")], 1704240000)
+
+        self.assertEqual(list(tracker.findings.keys()), ["finding-2"])
+        self.assertEqual(list(tracker.toDict()["findings"].keys()), ["finding-2"])
+
+    def testReconcileShouldSyncAgainWhenTheIndexDiffersFromTheUnarchivedCount(self):
+        tracker = FindingsTracker()
+        tracker.update([buildFinding("finding-1", createdAt="2023-01-01T00:00:00.000Z"), buildFinding("finding-2")], 1704153600)
+
+        # The index matches the actual count
+        tracker.reconcile(2)
+        self.assertIsNotNone(tracker.watermark)
+
+        # finding-1 has been deleted by GuardDuty, so it's never fetched again: the mismatch
+        # must show up on two consecutive refreshes before syncing again
+        tracker.reconcile(1)
+        self.assertIsNotNone(tracker.watermark)
+
+        tracker.reconcile(1)
+        self.assertIsNone(tracker.watermark)
+        self.assertEqual(tracker.getListFindingsParams("detector-1")["FindingCriteria"], {"Criterion": {"service.archived": {"Eq": ["false"]}}})
+
+        # The resync builds the index again, counting the findings missing from the previous one as new
+        tracker.update([buildFinding("finding-2"), buildFinding("finding-3", severity=8.0)], 1704240000)
+
+        self.assertEqual(sorted(tracker.findings.keys()), ["finding-2", "finding-3"])
+        self.assertEqual(tracker.newFindings, {"low": 0, "medium": 0, "high": 1})
+        self.assertEqual(tracker.getOldestUnarchivedCreatedAt(), parseTimestamp("2024-01-01T00:00:00.000Z"))
+
+    def testReconcileShouldNotSyncAgainOnFindingsCreatedDuringThePoll(self):
+        tracker = FindingsTracker()
+        tracker.update([buildFinding("finding-1"), buildFinding("finding-2")], 1704153600)
+
+        # finding-3 has been created between the statistics call (counting 2 findings) and the poll
+        tracker.update([buildFinding("finding-3", updatedAt="2024-01-03T00:00:00.000Z")], 1704240000)
+        tracker.reconcile(2)
+        self.assertIsNotNone(tracker.watermark)
+
+        # The next refresh counts it too
+        tracker.reconcile(3)
+        self.assertIsNotNone(tracker.watermark)
+        self.assertEqual(tracker.mismatches, 0)
+
+    def testUpdateShouldResumeAnInterruptedSync(self):
+        tracker = FindingsTracker()
+
+        # The sync fails after the first page
+        tracker.update([buildFinding("finding-1", updatedAt="2024-01-02T00:00:00.000Z")], 1704153600, complete=False)
+        self.assertIsNone(tracker.watermark)
+        self.assertEqual(tracker.findings, {})
+
+        # The next poll resumes from the most recently updated finding fetched so far
+        self.assertEqual(tracker.getListFindingsParams("detector-1")["FindingCriteria"], {"Criterion": {
+            "service.archived": {"Eq": ["false"]},
+            "updatedAt": {"GreaterThanOrEqual": 1704153600000},
+        }})
+
+        # The state is kept across restarts
+        tracker = FindingsTracker.fromDict(tracker.toDict())
+
+        tracker.update([buildFinding("finding-1", updatedAt="2024-01-02T00:00:00.000Z"), buildFinding("finding-2", updatedAt="2024-01-03T00:00:00.000Z")], 1704240000)
+
+        self.assertEqual(sorted(tracker.findings.keys()), ["finding-1", "finding-2"])
+        self.assertEqual(tracker.newFindings, {"low": 0, "medium": 0, "high": 0})
+        self.assertEqual(tracker.watermark, 1704240000000)
+        self.assertEqual(tracker.getListFindingsParams("detector-1")["FindingCriteria"], {"Criterion": {"updatedAt": {"GreaterThanOrEqual": 1704240000000}}})
+
+    def testAddFindingsTrackingShouldSumAllTrackers(self):
+        tracker1 = FindingsTracker()
+        tracker1.update([buildFinding("finding-1", createdAt="2024-01-02T00:00:00.000Z")], 1704153600)
+        tracker1.newFindings["high"] = 2
+
+        tracker2 = FindingsTracker()
+        tracker2.update([buildFinding("finding-2", createdAt="2024-01-01T00:00:00.000Z")], 1704153600)
+        tracker2.newFindings["high"] = 1
+
+        regionStats = {}
+        addFindingsTracking(regionStats, [tracker1, tracker2])
+
+        self.assertEqual(regionStats["new_findings"], {"low": 0, "medium": 0, "high": 3})
+        self.assertEqual(regionStats["oldest_unarchived_finding_created_at"], parseTimestamp("2024-01-01T00:00:00.000Z"))
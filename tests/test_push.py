@@ -0,0 +1,193 @@
+import logging
+import os
+import struct
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from prometheus_aws_guardduty_exporter.cli import main, parseArguments
+from prometheus_aws_guardduty_exporter.push import encodeSnappy, pushToGateway, pushToRemoteWrite
+from tests.test_async_collector import GuardDutyStubHandler
+
+
+def decodeVarint(payload: bytes, offset: int):
+    value = 0
+    shift = 0
+
+    while True:
+        byte = payload[offset]
+        value |= (byte & 0x7F) << shift
+        offset += 1
+        shift += 7
+
+        if not byte & 0x80:
+            return value, offset
+
+
+def decodeProtobuf(payload: bytes):
+    fields = []
+    offset = 0
+
+    while offset < len(payload):
+        key, offset = decodeVarint(payload, offset)
+        fieldNumber, wireType = key >> 3, key & 7
+
+        if wireType == 0:
+            value, offset = decodeVarint(payload, offset)
+        elif wireType == 1:
+            value = struct.unpack("<d", payload[offset:offset + 8])[0]
+            offset += 8
+        else:
+            length, offset = decodeVarint(payload, offset)
+            value = payload[offset:offset + length]
+            offset += length
+
+        fields.append((fieldNumber, value))
+
+    return fields
+
+
+def decodeSnappy(payload: bytes) -> bytes:
+    length, offset = decodeVarint(payload, 0)
+    output = bytearray()
+
+    while offset < len(payload):
+        tag = payload[offset]
+        offset += 1
+
+        if tag & 3 == 0:
+            literalLength = tag >> 2
+            if literalLength >= 60:
+                literalLength, offset = int.from_bytes(payload[offset:offset + literalLength - 59], "little"), offset + literalLength - 59
+
+            output += payload[offset:offset + literalLength + 1]
+            offset += literalLength + 1
+            continue
+
+        if tag & 3 == 1:
+            copyLength, copyOffset, offset = ((tag >> 2) & 7) + 4, (tag >> 5) << 8 | payload[offset], offset + 1
+        elif tag & 3 == 2:
+            copyLength, copyOffset, offset = (tag >> 2) + 1, int.from_bytes(payload[offset:offset + 2], "little"), offset + 2
+        else:
+            copyLength, copyOffset, offset = (tag >> 2) + 1, int.from_bytes(payload[offset:offset + 4], "little"), offset + 4
+
+        for _ in range(copyLength):
+            output.append(output[-copyOffset])
+
+    assert len(output) == length
+    return bytes(output)
+
+
+def decodeWriteRequest(payload: bytes):
+    timeseries = []
+
+    for _, encodedTimeseries in decodeProtobuf(payload):
+        labels = {}
+        samples = []
+
+        for fieldNumber, value in decodeProtobuf(encodedTimeseries):
+            if fieldNumber == 1:
+                label = dict(decodeProtobuf(value))
+                labels[label[1].decode("utf-8")] = label[2].decode("utf-8")
+            else:
+                samples.append(dict(decodeProtobuf(value)))
+
+        timeseries.append((labels, samples))
+
+    return timeseries
+
+
+class ReceiverStubHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        self._receive()
+
+    def do_PUT(self):
+        self._receive()
+
+    def _receive(self):
+        self.server.requests.append((self.command, self.path, dict(self.headers), self.rfile.read(int(self.headers.get("Content-Length", 0)))))
+        self.send_response(self.server.status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestPush(unittest.TestCase):
+    def setUp(self):
+        self.receiver = ThreadingHTTPServer(("127.0.0.1", 0), ReceiverStubHandler)
+        self.receiver.requests = []
+        self.receiver.status = 200
+        threading.Thread(target=self.receiver.serve_forever, daemon=True).start()
+        self.receiverUrl = f"http://127.0.0.1:{self.receiver.server_address[1]}"
+
+    def tearDown(self):
+        self.receiver.shutdown()
+        self.receiver.server_close()
+
+    def buildMetrics(self):
+        findingsMetric = GaugeMetricFamily("aws_guardduty_current_findings", "The current number of unarchived findings", labels=["account_id", "region", "severity"])
+        findingsMetric.add_metric(value=3, labels=["", "eu-west-1", "high"])
+        scrapeErrorsMetric = CounterMetricFamily("aws_guardduty_scrape_errors", "The total number of scrape errors", labels=["account_id", "region"])
+        scrapeErrorsMetric.add_metric(value=1, labels=["", "eu-west-1"])
+
+        return [findingsMetric, scrapeErrorsMetric]
+
+    def testEncodeSnappyShouldEncodePayloadsOfAnyLength(self):
+        for length in [0, 1, 60, 255, 256, 65536, 100000]:
+            payload = os.urandom(length)
+            self.assertEqual(decodeSnappy(encodeSnappy(payload)), payload)
+
+    def testPushToRemoteWriteShouldPostSnappyCompressedProtobuf(self):
+        pushToRemoteWrite(f"{self.receiverUrl}/api/v1/write", self.buildMetrics(), "guardduty")
+
+        self.assertEqual(len(self.receiver.requests), 1)
+        method, path, headers, body = self.receiver.requests[0]
+        self.assertEqual((method, path), ("POST", "/api/v1/write"))
+        self.assertEqual(headers["Content-Encoding"], "snappy")
+        self.assertEqual(headers["Content-Type"], "application/x-protobuf")
+        self.assertEqual(headers["X-Prometheus-Remote-Write-Version"], "0.1.0")
+
+        timeseries = decodeWriteRequest(decodeSnappy(body))
+        self.assertEqual([labels for labels, _ in timeseries], [
+            {"__name__": "aws_guardduty_current_findings", "job": "guardduty", "region": "eu-west-1", "severity": "high"},
+            {"__name__": "aws_guardduty_scrape_errors_total", "job": "guardduty", "region": "eu-west-1"},
+        ])
+        self.assertEqual([samples[0][1] for _, samples in timeseries], [3, 1])
+        self.assertGreater(timeseries[0][1][0][2], 0)
+
+    def testPushToRemoteWriteShouldRaiseErrorOnFailure(self):
+        self.receiver.status = 500
+
+        with self.assertRaises(Exception):
+            pushToRemoteWrite(f"{self.receiverUrl}/api/v1/write", self.buildMetrics(), "guardduty")
+
+    def testPushToGatewayShouldReplaceTheMetricsOfTheJob(self):
+        pushToGateway(self.receiverUrl, self.buildMetrics(), "guardduty")
+
+        method, path, _, body = self.receiver.requests[0]
+        self.assertEqual((method, path), ("PUT", "/metrics/job/guardduty"))
+        self.assertIn(b'aws_guardduty_current_findings{account_id="",region="eu-west-1",severity="high"} 3.0', body)
+
+    def testMainShouldCollectOnceAndPushMetrics(self):
+        guardDuty = ThreadingHTTPServer(("127.0.0.1", 0), GuardDutyStubHandler)
+        guardDuty.detectors = ["detector-1"]
+        guardDuty.statistics = {"detector-1": {"7.0": 2}}
+        threading.Thread(target=guardDuty.serve_forever, daemon=True).start()
+        self.addCleanup(guardDuty.server_close)
+        self.addCleanup(guardDuty.shutdown)
+
+        # Restore the logger configured by main()
+        logger = logging.getLogger()
+        self.addCleanup(setattr, logger, "handlers", list(logger.handlers))
+        self.addCleanup(logger.setLevel, logger.level)
+
+        environ = {"AWS_ACCESS_KEY_ID": "id", "AWS_SECRET_ACCESS_KEY": "secret", "AWS_ENDPOINT_URL": f"http://127.0.0.1:{guardDuty.server_address[1]}"}
+        with patch.dict(os.environ, environ), patch("signal.signal"):
+            exitCode = main(parseArguments(["--region", "eu-west-1", "--push-remote-write", f"{self.receiverUrl}/api/v1/write", "--log-level", "CRITICAL"]))
+
+        self.assertEqual(exitCode, 0)
+        timeseries = decodeWriteRequest(decodeSnappy(self.receiver.requests[0][3]))
+        self.assertIn(({"__name__": "aws_guardduty_current_findings", "job": "aws_guardduty_exporter", "region": "eu-west-1", "severity": "high"}, [{1: 2.0, 2: timeseries[0][1][0][2]}]), timeseries)
@@ -0,0 +1,70 @@
+import unittest
+from botocore.exceptions import ClientError
+from prometheus_aws_guardduty_exporter.ratelimit import CircuitBreaker, TokenBucket, isThrottlingError
+
+
+class TestTokenBucket(unittest.TestCase):
+    def testReserveShouldNotWaitWhileTokensAreAvailable(self):
+        bucket = TokenBucket(rate=10, burst=2)
+
+        self.assertEqual(bucket.reserve(), 0)
+        self.assertEqual(bucket.reserve(), 0)
+        self.assertAlmostEqual(bucket.reserve(), 0.1, delta=0.01)
+        self.assertAlmostEqual(bucket.reserve(), 0.2, delta=0.01)
+
+    def testOnThrottledShouldHalveTheRateDownToTheMinRate(self):
+        bucket = TokenBucket(rate=16)
+
+        bucket.onThrottled()
+        self.assertEqual(bucket.rate, 8)
+
+        for _ in range(10):
+            bucket.onThrottled()
+        self.assertEqual(bucket.rate, 1)
+
+    def testOnSuccessShouldIncreaseTheRateUpToTheMaxRate(self):
+        bucket = TokenBucket(rate=10)
+        bucket.onThrottled()
+
+        bucket.onSuccess()
+        self.assertEqual(bucket.rate, 6)
+
+        for _ in range(10):
+            bucket.onSuccess()
+        self.assertEqual(bucket.rate, 10)
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    def testShouldOpenAfterThresholdConsecutiveFailuresUntilCooldown(self):
+        breaker = CircuitBreaker(threshold=2, cooldown=60)
+
+        breaker.onFailure(100)
+        self.assertFalse(breaker.isOpen(100))
+
+        breaker.onFailure(100)
+        self.assertTrue(breaker.isOpen(100))
+        self.assertTrue(breaker.isOpen(159))
+        self.assertFalse(breaker.isOpen(160))
+
+        # A single failure after the cooldown opens it again
+        breaker.onFailure(160)
+        self.assertTrue(breaker.isOpen(160))
+
+        breaker.onSuccess()
+        self.assertFalse(breaker.isOpen(160))
+
+    def testShouldNeverOpenWhenDisabled(self):
+        breaker = CircuitBreaker(threshold=0, cooldown=60)
+
+        for _ in range(10):
+            breaker.onFailure(100)
+
+        self.assertFalse(breaker.isOpen(100))
+
+
+class TestIsThrottlingError(unittest.TestCase):
+    def testShouldReturnTrueOnlyOnThrottlingErrorCodes(self):
+        self.assertTrue(isThrottlingError(ClientError({"Error": {"Code": "TooManyRequestsException"}}, "GetFindingsStatistics")))
+        self.assertTrue(isThrottlingError(ClientError({"Error": {"Code": "ThrottlingException"}}, "ListDetectors")))
+        self.assertFalse(isThrottlingError(ClientError({"Error": {"Code": "BadRequestException"}}, "ListDetectors")))
+        self.assertFalse(isThrottlingError(ValueError("error")))
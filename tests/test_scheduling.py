@@ -0,0 +1,30 @@
+import unittest
+from prometheus_aws_guardduty_exporter.scheduling import RefreshTier, getNextRefreshDelay, getRefreshInterval, parseRefreshTier
+from prometheus_aws_guardduty_exporter.targets import Target
+
+
+class TestScheduling(unittest.TestCase):
+    def testParseRefreshTierShouldReturnTheIntervalAndPatterns(self):
+        self.assertEqual(parseRefreshTier("30:us-east-1, eu-*"), RefreshTier(30, ["us-east-1", "eu-*"]))
+
+    def testParseRefreshTierShouldRaiseErrorOnInvalidTier(self):
+        with self.assertRaises(ValueError):
+            parseRefreshTier("30")
+
+        with self.assertRaises(ValueError):
+            parseRefreshTier("fast:us-east-1")
+
+    def testGetRefreshIntervalShouldReturnTheIntervalOfTheFirstMatchingTier(self):
+        tiers = [RefreshTier(30, ["111111111111/us-east-1"]), RefreshTier(60, ["us-*"]), RefreshTier(600, ["*"])]
+
+        self.assertEqual(getRefreshInterval(tiers, Target("111111111111", None, "us-east-1"), 0), 30)
+        self.assertEqual(getRefreshInterval(tiers, Target("222222222222", None, "us-east-1"), 0), 60)
+        self.assertEqual(getRefreshInterval(tiers, Target("222222222222", None, "eu-west-1"), 0), 600)
+        self.assertEqual(getRefreshInterval([], Target("222222222222", None, "eu-west-1"), 10), 10)
+
+    def testGetNextRefreshDelayShouldStaggerTheFirstRefreshAndJitterTheFollowingOnes(self):
+        for _ in range(100):
+            self.assertTrue(50 <= getNextRefreshDelay(100, 0.1, first=True) <= 100)
+            self.assertTrue(90 <= getNextRefreshDelay(100, 0.1, first=False) <= 110)
+
+        self.assertEqual(getNextRefreshDelay(100, 0, first=True), 100)
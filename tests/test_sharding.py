@@ -0,0 +1,123 @@
+import os
+import threading
+import time
+import unittest
+from http.server import ThreadingHTTPServer
+from unittest.mock import patch
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from prometheus_aws_guardduty_exporter.collector import GuardDutyMetricsCollector
+from prometheus_aws_guardduty_exporter.sharding import HashRing, ShardedMetricsCollector, filterShardTargets, mergeMetrics
+from prometheus_aws_guardduty_exporter.targets import buildTargets
+from tests.test_async_collector import GuardDutyStubHandler
+
+
+class TestSharding(unittest.TestCase):
+    def testFilterShardTargetsShouldPartitionTargetsAcrossShards(self):
+        targets = buildTargets([f"region-{index}" for index in range(20)], [f"arn:aws:iam::{index:012d}:role/a" for index in range(25)])
+        shards = [filterShardTargets(targets, shardIndex, 4) for shardIndex in range(4)]
+
+        self.assertEqual(sorted(target for shard in shards for target in shard), sorted(targets))
+        for shard in shards:
+            self.assertGreater(len(shard), len(targets) / 8)
+
+    def testHashRingShouldMoveFewKeysWhenAddingAShard(self):
+        keys = [f"{index:012d}/eu-west-1" for index in range(1000)]
+        ring = HashRing(4)
+        largerRing = HashRing(5)
+
+        # Keys only move to the added shard
+        moved = [key for key in keys if ring.getShard(key) != largerRing.getShard(key)]
+        self.assertTrue(all(largerRing.getShard(key) == 4 for key in moved))
+        self.assertLess(len(moved), len(keys) / 3)
+
+    def testMergeMetricsShouldConcatenateSeriesAndAggregateDuplicatedOnes(self):
+        def buildMetrics(region, findings, errors, duration):
+            findingsMetric = GaugeMetricFamily("aws_guardduty_current_findings", "Findings", labels=["region"])
+            findingsMetric.add_metric(value=findings, labels=[region])
+            apiCallsMetric = CounterMetricFamily("aws_guardduty_api_calls", "API calls", labels=["operation"])
+            apiCallsMetric.add_metric(value=errors, labels=["ListDetectors"])
+            durationMetric = GaugeMetricFamily("aws_guardduty_collect_duration_seconds", "Duration")
+            durationMetric.add_metric(value=duration, labels=[])
+
+            return [findingsMetric, apiCallsMetric, durationMetric]
+
+        metrics = {metric.name: metric for metric in mergeMetrics([buildMetrics("eu-west-1", 1, 2, 3), buildMetrics("us-east-1", 4, 5, 1)])}
+
+        self.assertEqual([(sample.labels, sample.value) for sample in metrics["aws_guardduty_current_findings"].samples], [({"region": "eu-west-1"}, 1), ({"region": "us-east-1"}, 4)])
+        self.assertEqual([sample.value for sample in metrics["aws_guardduty_api_calls"].samples], [7])
+        self.assertEqual([sample.value for sample in metrics["aws_guardduty_collect_duration_seconds"].samples], [3])
+
+    def testCollectorShouldOnlyScrapeTheTargetsOfItsShard(self):
+        collectors = [GuardDutyMetricsCollector(regions=["eu-west-1", "us-east-1", "ap-east-1"], roleArns=["arn:aws:iam::111111111111:role/a", "arn:aws:iam::222222222222:role/b"], shardIndex=shardIndex, shardsCount=2) for shardIndex in range(2)]
+
+        self.assertEqual(sorted(collectors[0].targets + collectors[1].targets), sorted(buildTargets(["eu-west-1", "us-east-1", "ap-east-1"], ["arn:aws:iam::111111111111:role/a", "arn:aws:iam::222222222222:role/b"])))
+
+    def testShardedCollectorShouldExportTheAgeOfTheOldestShardSnapshot(self):
+        collector = ShardedMetricsCollector(2, "threads", regions=["eu-west-1"], refreshInterval=60)
+
+        # The second shard has not refreshed its metrics for a while
+        collector.shardsMetrics = {0: [], 1: []}
+        collector.shardsSnapshotTimestamps = {0: time.time() - 5, 1: time.time() - 300}
+
+        metrics = {metric.name: metric for metric in collector.collect()}
+        self.assertAlmostEqual(metrics["aws_guardduty_snapshot_age_seconds"].samples[0].value, 300, delta=5)
+
+    def testShardedCollectorShouldCountAndBudgetTheSeriesOfAllShards(self):
+        def buildMetrics(regions):
+            findingsMetric = GaugeMetricFamily("aws_guardduty_current_findings", "Findings", labels=["region"])
+            for region in regions:
+                findingsMetric.add_metric(value=1, labels=[region])
+
+            return [findingsMetric]
+
+        collector = ShardedMetricsCollector(2, "threads", regions=["eu-west-1"], refreshInterval=60, maxSeriesPerMetric=6)
+        collector.shardsMetrics = {0: buildMetrics([f"region-{index}" for index in range(3)]), 1: buildMetrics([f"region-{index}" for index in range(3, 8)])}
+
+        metrics = {metric.name: metric for metric in collector.collect()}
+        self.assertEqual(len(metrics["aws_guardduty_current_findings"].samples), 6)
+        self.assertEqual([(sample.labels, sample.value) for sample in metrics["aws_guardduty_series"].samples], [({"metric": "aws_guardduty_current_findings"}, 6)])
+        self.assertEqual([(sample.labels, sample.value) for sample in metrics["aws_guardduty_series_dropped"].samples], [({"metric": "aws_guardduty_current_findings"}, 2)])
+
+        # Without budget, the series of all shards are counted
+        collector.maxSeriesPerMetric = 0
+        metrics = {metric.name: metric for metric in collector.collect()}
+        self.assertEqual([sample.value for sample in metrics["aws_guardduty_series"].samples], [8])
+
+
+class TestShardedMetricsCollector(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), GuardDutyStubHandler)
+        self.server.detectors = ["detector-1"]
+        self.server.statistics = {"detector-1": {"2.0": 1, "4.0": 2, "7.0": 3}}
+        self.serverThread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.serverThread.start()
+
+        self.environ = patch.dict(os.environ, {"AWS_ACCESS_KEY_ID": "id", "AWS_SECRET_ACCESS_KEY": "secret"})
+        self.environ.start()
+
+    def tearDown(self):
+        self.environ.stop()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def testCollectShouldReturnTheMergedMetricsOfAllShards(self):
+        regions = ["eu-west-1", "us-east-1", "ap-east-1", "sa-east-1"]
+        collector = ShardedMetricsCollector(2, "threads", logLevel="CRITICAL", regions=regions, refreshInterval=60, endpointUrl=f"http://127.0.0.1:{self.server.server_address[1]}")
+        collector.start()
+
+        try:
+            # Wait until all shards have published their metrics
+            for _ in range(600):
+                metrics = {metric.name: metric for metric in collector.collect()}
+                if len(collector.shardsMetrics) == 2:
+                    break
+                time.sleep(0.1)
+        finally:
+            collector.stop()
+
+        self.assertEqual(sorted({sample.labels["region"] for sample in metrics["aws_guardduty_current_findings"].samples}), sorted(regions))
+        self.assertEqual([sample.value for sample in metrics["aws_guardduty_current_findings"].samples if sample.labels["severity"] == "high"], [3] * 4)
+        self.assertEqual([sample.value for sample in metrics["aws_guardduty_shard_up"].samples], [1, 1])
+        self.assertEqual(len(metrics["aws_guardduty_snapshot_age_seconds"].samples), 1)
+        self.assertIn(({"metric": "aws_guardduty_current_findings"}, 12), [(sample.labels, sample.value) for sample in metrics["aws_guardduty_series"].samples])
+        self.assertIn("aws_guardduty_api_calls", metrics)
@@ -0,0 +1,66 @@
+import json
+import os
+import subprocess
+import sys
+import unittest
+
+# Each measurement runs in a fresh interpreter, so that it's not affected by the modules loaded by other tests
+IMPORT_SCRIPT = """
+import json, resource, sys, time
+startTime = time.monotonic()
+from prometheus_aws_guardduty_exporter.cli import parseArguments
+parseArguments(["--region", "eu-west-1"])
+print(json.dumps({
+    "seconds": time.monotonic() - startTime,
+    "modules": [name for name in ("boto3", "botocore", "aiobotocore", "pythonjsonlogger") if name in sys.modules],
+}))
+"""
+
+DISCOVER_REGIONS_SCRIPT = """
+import json, sys
+from prometheus_aws_guardduty_exporter.detectors import discoverRegions
+regions = discoverRegions()
+print(json.dumps({
+    "regions": regions,
+    "modules": [name for name in ("boto3", "botocore") if name in sys.modules],
+}))
+"""
+
+CLIENTS_SCRIPT = """
+import json, resource
+from prometheus_aws_guardduty_exporter.clients import GuardDutyClientsCache
+cache = GuardDutyClientsCache(None)
+cache.getClient("us-east-1")
+rssBefore = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+for region in ["eu-west-1", "eu-west-2", "eu-west-3", "eu-central-1", "eu-north-1", "us-east-2", "us-west-1", "us-west-2", "ap-south-1", "ap-northeast-1"] * 2:
+    cache.getClient(region, f"arn:aws:iam::{len(cache.clients):012d}:role/guardduty")
+print(json.dumps({"rssIncreaseMegabytes": (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rssBefore) / 1024}))
+"""
+
+
+def runScript(script: str) -> dict:
+    env = dict(os.environ, AWS_ACCESS_KEY_ID="id", AWS_SECRET_ACCESS_KEY="secret")
+    output = subprocess.run([sys.executable, "-c", script], env=env, check=True, capture_output=True, text=True).stdout
+
+    return json.loads(output)
+
+
+class TestStartup(unittest.TestCase):
+    def testImportingTheCliShouldNotLoadAwsSdks(self):
+        result = runScript(IMPORT_SCRIPT)
+
+        self.assertEqual(result["modules"], [])
+        self.assertLess(result["seconds"], 2)
+
+    def testDiscoveringRegionsShouldNotLoadAwsSdks(self):
+        result = runScript(DISCOVER_REGIONS_SCRIPT)
+
+        # The main process discovers the regions with --all-regions, even when sharding
+        self.assertEqual(result["modules"], [])
+        self.assertIn("us-east-1", result["regions"])
+
+    def testCreatingClientsShouldShareTheServiceModels(self):
+        result = runScript(CLIENTS_SCRIPT)
+
+        # Each client used to load its own copy of the service models (about 10 MB each)
+        self.assertLess(result["rssIncreaseMegabytes"], 50)
@@ -0,0 +1,34 @@
+import gzip
+import json
+import os
+import tempfile
+import unittest
+from prometheus_aws_guardduty_exporter.state import StateFile
+
+
+class TestStateFile(unittest.TestCase):
+    def setUp(self):
+        self.tmpDir = tempfile.TemporaryDirectory()
+        self.filepath = os.path.join(self.tmpDir.name, "state.json.gz")
+
+    def tearDown(self):
+        self.tmpDir.cleanup()
+
+    def testLoadShouldReturnNoneIfTheFileDoesNotExist(self):
+        self.assertIsNone(StateFile(self.filepath).load())
+
+    def testLoadShouldReturnTheSavedState(self):
+        stateFile = StateFile(self.filepath)
+        stateFile.save({"savedAt": 1, "targets": [{"region": "eu-west-1"}]})
+        stateFile.save({"savedAt": 2, "targets": [{"region": "us-east-1"}]})
+
+        self.assertEqual(stateFile.load(), {"version": 1, "savedAt": 2, "targets": [{"region": "us-east-1"}]})
+
+        # No temporary file is left behind
+        self.assertEqual(os.listdir(self.tmpDir.name), ["state.json.gz"])
+
+    def testLoadShouldIgnoreStateSavedWithAnIncompatibleVersion(self):
+        with gzip.open(self.filepath, "wt", encoding="utf-8") as file:
+            json.dump({"version": 0, "savedAt": 1, "targets": []}, file)
+
+        self.assertIsNone(StateFile(self.filepath).load())
@@ -0,0 +1,36 @@
+import os
+import tempfile
+import unittest
+from prometheus_aws_guardduty_exporter.targets import Target, buildTargets, loadRoleArns, parseAccountId
+
+
+class TestTargets(unittest.TestCase):
+    def testParseAccountIdShouldReturnTheAccountIdOfTheRoleArn(self):
+        self.assertEqual(parseAccountId("arn:aws:iam::123456789012:role/guardduty"), "123456789012")
+        self.assertEqual(parseAccountId(None), "")
+
+    def testParseAccountIdShouldRaiseErrorOnInvalidRoleArn(self):
+        with self.assertRaises(ValueError):
+            parseAccountId("guardduty")
+
+    def testBuildTargetsShouldReturnTheAccountsByRegionsMatrix(self):
+        targets = buildTargets(["eu-west-1", "us-east-1"], ["arn:aws:iam::111111111111:role/a", "arn:aws:iam::222222222222:role/b"])
+
+        self.assertEqual(targets, [
+            Target("111111111111", "arn:aws:iam::111111111111:role/a", "eu-west-1"),
+            Target("111111111111", "arn:aws:iam::111111111111:role/a", "us-east-1"),
+            Target("222222222222", "arn:aws:iam::222222222222:role/b", "eu-west-1"),
+            Target("222222222222", "arn:aws:iam::222222222222:role/b", "us-east-1"),
+        ])
+
+    def testBuildTargetsShouldUseDefaultCredentialsWithoutRoles(self):
+        self.assertEqual(buildTargets(["eu-west-1"]), [Target("", None, "eu-west-1")])
+
+    def testLoadRoleArnsShouldSkipEmptyLinesAndComments(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False) as file:
+            file.write("# Production\narn:aws:iam::111111111111:role/a\n\narn:aws:iam::222222222222:role/b  # Staging\n")
+
+        try:
+            self.assertEqual(loadRoleArns(file.name), ["arn:aws:iam::111111111111:role/a", "arn:aws:iam::222222222222:role/b"])
+        finally:
+            os.unlink(file.name)